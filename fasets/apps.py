@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class FasetsConfig(AppConfig):
+    name = "fasets"
+
+    def ready(self):
+        # ファセット索引を商品・M2M の変更に追従させる
+        from . import signals  # noqa: F401
@@ -0,0 +1,236 @@
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+
+from .facet_index import FACETS, disjunctive, through_of
+from .models import FacetCount, FacetCountBuild, Product
+
+# ファセット件数の集計表（FacetCount）
+#   - 絞り込みなし:   ("", 0, ファセット, 値) → 件数
+#   - 1 値で絞り込み: (ファセット F, 値 v, ファセット G, 値 w) → v と w を両方持つ商品数（G = F も持つ）
+#     filtered では F 自身の件数も (F, v, F, w) の行から、disjunctive では絞り込みなしの行から読む
+#   - M2M の変更（signals.py）と同じトランザクションで差分を足し引きする
+# 読むのは sql / orm の検索だけ（views.FACET_ENGINE）なので既定では無効
+# 有効にしたら rebuild_facet_counts で作り直す（作り直すまでは読まずに毎回集計する）
+ENABLED = getattr(settings, "FASETS_MATERIALIZED_COUNTS", False)
+
+NO_FILTER = ("", 0)
+
+# 集計表の形式（行の持ち方を変えたら上げる。古い形式で作った表は読まない）
+FORMAT = 2
+BUILD_KEY = "facetcounts:build"
+BUILD_CHECK_SECONDS = 60
+
+
+# ---------------------------
+# 読み出し
+# ---------------------------
+def built():
+    """今の形式で作り直した集計表があるか（DB の記録を BUILD_CHECK_SECONDS だけキャッシュする）"""
+    format_ = cache.get(BUILD_KEY)
+    if format_ is None:
+        format_ = FacetCountBuild.objects.values_list("format", flat=True).first() or 0
+        cache.set(BUILD_KEY, format_, BUILD_CHECK_SECONDS)
+    return format_ == FORMAT
+
+
+def lookup(selected):
+    """
+    selected: {ファセット: [値ID, ...]}
+    絞り込みなし・1 値の絞り込みなら {ファセット: [{"id", "name", "count"}]}
+    それ以外・集計表を作り直していなければ None
+    """
+    active = [(facet, set(ids)) for facet, ids in selected.items() if ids]
+    if not active:
+        rows = FacetCount.objects.filter(filter_facet="", filter_value=0)
+    elif len(active) == 1 and len(active[0][1]) == 1:
+        facet, (value_id,) = active[0]
+        if disjunctive():
+            others = [other for other in FACETS if other != facet]
+            rows = FacetCount.objects.filter(
+                Q(filter_facet=facet, filter_value=value_id, facet__in=others)
+                | Q(filter_facet="", filter_value=0, facet=facet)
+            )
+        else:
+            rows = FacetCount.objects.filter(filter_facet=facet, filter_value=value_id)
+    else:
+        return None
+    if not built():
+        return None
+
+    facets = {facet: [] for facet in FACETS}
+    for facet, value_id, name, count in (
+        rows.filter(count__gt=0).order_by("-count", "value").values_list("facet", "value", "name", "count")
+    ):
+        facets[facet].append({"id": value_id, "name": name, "count": count})
+    return facets
+
+
+# ---------------------------
+# 差分更新
+# ---------------------------
+def _owned(facet, product_ids):
+    """商品 → ファセットの値ID のリスト"""
+    through, column = through_of(facet)
+    owned = defaultdict(list)
+    for product_id, value_id in through.objects.filter(product_id__in=product_ids).values_list("product_id", column):
+        owned[product_id].append(value_id)
+    return owned
+
+
+def _apply(deltas):
+    """
+    {(filter_facet, filter_value, facet, value): 増減} を足し込む
+    行がなければ増減のまま作る（減算が先に来ても後の加算と合わせて正しい件数になる。0 以下の行は読まない）
+    """
+    missing = []
+    for key, delta in deltas.items():
+        if not delta:
+            continue
+        fields = dict(zip(("filter_facet", "filter_value", "facet", "value"), key))
+        if not FacetCount.objects.filter(**fields).update(count=F("count") + delta):
+            missing.append((fields, delta))
+    if not missing:
+        return
+
+    names = {}
+    for facet in {fields["facet"] for fields, _ in missing}:
+        ids = [fields["value"] for fields, _ in missing if fields["facet"] == facet]
+        names[facet] = dict(FACETS[facet].objects.filter(id__in=ids).values_list("id", "name"))
+    for fields, delta in missing:
+        try:
+            with transaction.atomic():
+                FacetCount.objects.create(**fields, name=names[fields["facet"]].get(fields["value"], ""), count=delta)
+        except IntegrityError:
+            # 同時に作られた
+            FacetCount.objects.filter(**fields).update(count=F("count") + delta)
+
+
+def relations_changed(facet, pairs, delta):
+    """(商品ID, 値ID) の組が facet に追加（delta=1）・削除（delta=-1）された"""
+    if not pairs:
+        return
+    deltas = Counter()
+    for _, value_id in pairs:
+        deltas[NO_FILTER + (facet, value_id)] += delta
+
+    product_ids = {product_id for product_id, _ in pairs}
+    for other in FACETS:
+        if other == facet:
+            continue
+        owned = _owned(other, product_ids)
+        for product_id, value_id in pairs:
+            for other_id in owned[product_id]:
+                deltas[(facet, value_id, other, other_id)] += delta
+                deltas[(other, other_id, facet, value_id)] += delta
+
+    # 同じファセットの組：変わった値 C と商品が持つ値 T（追加後・削除前なので C を含む）
+    # C × T と (T - C) × C が増減する
+    owned = _owned(facet, product_ids)
+    changed = defaultdict(set)
+    for product_id, value_id in pairs:
+        changed[product_id].add(value_id)
+    for product_id, values in changed.items():
+        for value_id in values:
+            for other_id in owned[product_id]:
+                deltas[(facet, value_id, facet, other_id)] += delta
+                if other_id not in values:
+                    deltas[(facet, other_id, facet, value_id)] += delta
+    _apply(deltas)
+
+
+def existing_pairs(facet, product_ids=None, value_ids=None):
+    """中間テーブルにある (商品ID, 値ID) の組（削除前に呼ぶ）"""
+    through, column = through_of(facet)
+    qs = through.objects.all()
+    if product_ids is not None:
+        qs = qs.filter(product_id__in=product_ids)
+    if value_ids is not None:
+        qs = qs.filter(**{f"{column}__in": value_ids})
+    return list(qs.values_list("product_id", column))
+
+
+def products_deleted(product_ids):
+    """商品の削除（中間テーブルの行は m2m_changed なしで消えるので削除前に呼ぶ）"""
+    owned = {facet: _owned(facet, product_ids) for facet in FACETS}
+    deltas = Counter()
+    for product_id in product_ids:
+        for facet in FACETS:
+            for value_id in owned[facet][product_id]:
+                deltas[NO_FILTER + (facet, value_id)] -= 1
+                for other in FACETS:
+                    for other_id in owned[other][product_id]:
+                        deltas[(facet, value_id, other, other_id)] -= 1
+    _apply(deltas)
+
+
+def value_deleted(facet, value_id):
+    FacetCount.objects.filter(
+        Q(facet=facet, value=value_id) | Q(filter_facet=facet, filter_value=value_id)
+    ).delete()
+
+
+def value_renamed(facet, value_id, name):
+    FacetCount.objects.filter(facet=facet, value=value_id).exclude(name=name).update(name=name)
+
+
+# ---------------------------
+# 作り直し
+# ---------------------------
+def rebuild(batch_size=1000):
+    """集計表を DB の内容から作り直し、行数を返す"""
+    labels = {facet: dict(model.objects.values_list("id", "name")) for facet, model in FACETS.items()}
+    rows = []
+
+    for facet in FACETS:
+        through, column = through_of(facet)
+        for value_id, count in through.objects.values_list(column).annotate(count=Count("product_id")).order_by():
+            rows.append(FacetCount(
+                filter_facet="", filter_value=0, facet=facet, value=value_id,
+                name=labels[facet].get(value_id, ""), count=count,
+            ))
+
+    # 同じ商品が持つ同じファセットの値の組（中間テーブルを商品で自己結合。v = w も入れる）
+    for facet in FACETS:
+        through, column = through_of(facet)
+        pairs = (
+            through.objects.values_list(column, f"product__{facet}__id")
+            .annotate(count=Count("product_id"))
+            .order_by()
+        )
+        for value_id, other_id, count in pairs:
+            rows.append(FacetCount(
+                filter_facet=facet, filter_value=value_id, facet=facet, value=other_id,
+                name=labels[facet].get(other_id, ""), count=count,
+            ))
+
+    # 同じ商品が持つ 2 つのファセットの値の組を数える（両方向に入れる）
+    facets = list(FACETS)
+    for i, facet in enumerate(facets):
+        for other in facets[i + 1:]:
+            pairs = (
+                Product.objects.filter(**{f"{facet}__isnull": False, f"{other}__isnull": False})
+                .values_list(f"{facet}__id", f"{other}__id")
+                .annotate(count=Count("id"))
+                .order_by()
+            )
+            for value_id, other_id, count in pairs:
+                rows.append(FacetCount(
+                    filter_facet=facet, filter_value=value_id, facet=other, value=other_id,
+                    name=labels[other].get(other_id, ""), count=count,
+                ))
+                rows.append(FacetCount(
+                    filter_facet=other, filter_value=other_id, facet=facet, value=value_id,
+                    name=labels[facet].get(value_id, ""), count=count,
+                ))
+
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create(rows, batch_size=batch_size)
+        FacetCountBuild.objects.all().delete()
+        FacetCountBuild.objects.create(format=FORMAT)
+        transaction.on_commit(lambda: cache.delete(BUILD_KEY))
+    return len(rows)
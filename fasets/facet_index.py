@@ -0,0 +1,256 @@
+import threading
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Connector, Product, Usage, Wood
+
+# ファセット名（Product の M2M フィールド名）→ 値のモデル
+FACETS = {
+    "woods": Wood,
+    "connectors": Connector,
+    "usages": Usage,
+}
+
+# ファセット件数の数え方（すべての検索方法・集計表で共通）
+#   "filtered": 絞り込んだ結果全体で数える（従来どおり）
+#   "disjunctive": 各ファセット自身の条件は除いて数える（同じファセット内で OR を追加したときの件数）
+FACET_COUNTS = getattr(settings, "FASETS_FACET_COUNTS", "filtered")
+
+
+def disjunctive():
+    return FACET_COUNTS == "disjunctive"
+
+
+# 他プロセスの変更を反映するための版数と変更ログ（Django キャッシュで共有）
+VERSION_KEY = "facetindex:version"
+CHANGE_KEY = "facetindex:change:{}"
+CHANGE_TTL = 60 * 60
+# 未反映の変更がこれより多ければ差分ではなく作り直す
+MAX_PENDING_CHANGES = 1000
+
+
+def _bitmap(positions, size):
+    """ビット位置の列 → ビットマップ（1ビットずつ OR すると遅いので bytearray で組み立てる）"""
+    buffer = bytearray((size + 7) // 8)
+    for pos in positions:
+        buffer[pos >> 3] |= 1 << (pos & 7)
+    return int.from_bytes(buffer, "little")
+
+
+class FacetIndex:
+    """
+    ファセットの値ごとに商品のビットマップ（Python の int をビット列として使う）を持つ索引
+    同じファセット内は OR、ファセット間は AND で絞り込み、件数は popcount で数える
+    ビット位置は商品を読み込んだ順（作成時は ID 昇順、以降の追加は末尾）
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.positions = {}  # 商品ID → ビット位置
+        self.ids = []  # ビット位置 → 商品ID
+        self.names = []  # ビット位置 → 商品名
+        self.alive = 0  # 削除されていない商品
+        self.bitmaps = {facet: {} for facet in FACETS}  # ファセット → {値ID: ビットマップ}
+        self.labels = {facet: {} for facet in FACETS}  # ファセット → {値ID: 名前}
+        self._orders = {}  # 並びの列（name / id）→ 昇順のビット位置のリスト
+
+    @classmethod
+    def build(cls):
+        """DB から全件を読み込む（版数は読み込み前に取り、その後の変更は差分で反映する）"""
+        index = cls()
+        index.version = cache.get(VERSION_KEY) or 0
+        for product_id, name in Product.objects.order_by("id").values_list("id", "name"):
+            index._set_product(product_id, name)
+
+        for facet, model in FACETS.items():
+            through, column = through_of(facet)
+            members = {}
+            for product_id, value_id in through.objects.values_list("product_id", column):
+                members.setdefault(value_id, []).append(index.positions[product_id])
+            index.labels[facet] = dict(model.objects.values_list("id", "name"))
+            index.bitmaps[facet] = {
+                value_id: _bitmap(members.get(value_id, []), len(index.ids))
+                for value_id in index.labels[facet]
+            }
+        return index
+
+    # ---------------------------
+    # 検索
+    # ---------------------------
+    def union(self, facet, value_ids):
+        bits = 0
+        for value_id in value_ids:
+            bits |= self.bitmaps[facet].get(value_id, 0)
+        return bits
+
+    def search(self, selected):
+        """
+        selected: {ファセット: [値ID, ...]}
+        (結果のビットマップ, {ファセット: [{"id", "name", "count"}, ...]}) を返す
+        各ファセットの件数は結果全体で数える（FACET_COUNTS が "disjunctive" ならそのファセット自身の条件は除く）
+        """
+        unions = {facet: self.union(facet, ids) for facet, ids in selected.items() if ids}
+        result = self.alive
+        for bits in unions.values():
+            result &= bits
+
+        facets = {}
+        for facet in FACETS:
+            base = result
+            if disjunctive():
+                base = self.alive
+                for other, bits in unions.items():
+                    if other != facet:
+                        base &= bits
+            counts = [
+                {"id": value_id, "name": self.labels[facet].get(value_id), "count": (base & bits).bit_count()}
+                for value_id, bits in self.bitmaps[facet].items()
+            ]
+            facets[facet] = sorted((c for c in counts if c["count"]), key=lambda c: (-c["count"], c["id"]))
+        return result, facets
+
+    def sort_key(self, field):
+        """ビット位置 → 並びのキー（pagination.fields と同じ (name, id) / id）"""
+        if field == "name":
+            return lambda pos: (self.names[pos], self.ids[pos])
+        return self.ids.__getitem__
+
+    def order(self, field):
+        """field（"name" / "id"）の昇順に並べたビット位置のリスト（商品が変わるまで再利用）"""
+        if field not in self._orders:
+            self._orders[field] = sorted(range(len(self.ids)), key=self.sort_key(field))
+        return self._orders[field]
+
+    def results(self, bits, ordering, after=None, limit=None):
+        """
+        ビットマップの商品を ordering（"-" は降順）の順に [{"id", "name"}] で返す
+        after（並びのキー）を渡すとその後ろから、limit 件まで
+        """
+        field = ordering.lstrip("-")
+        descending = ordering.startswith("-")
+        order = self.order(field)
+        if after is None:
+            start = len(order) - 1 if descending else 0
+        else:
+            key = tuple(after) if field == "name" else after[0]
+            if descending:
+                start = bisect_left(order, key, key=self.sort_key(field)) - 1
+            else:
+                start = bisect_right(order, key, key=self.sort_key(field))
+
+        data = bits.to_bytes((len(self.ids) + 7) // 8, "little")
+        step = -1 if descending else 1
+        rows = []
+        i = start
+        while 0 <= i < len(order) and (limit is None or len(rows) < limit):
+            pos = order[i]
+            if data[pos >> 3] >> (pos & 7) & 1:
+                rows.append({"id": self.ids[pos], "name": self.names[pos]})
+            i += step
+        return rows
+
+    # ---------------------------
+    # 差分の反映
+    # ---------------------------
+    def _set_product(self, product_id, name):
+        pos = self.positions.get(product_id)
+        if pos is None:
+            pos = self.positions[product_id] = len(self.ids)
+            self.ids.append(product_id)
+            self.names.append(name)
+        else:
+            self.names[pos] = name
+        self.alive |= 1 << pos
+        return pos
+
+    def refresh_products(self, product_ids):
+        """商品の名前・有無・所属する値を DB から読み直す"""
+        rows = dict(Product.objects.filter(id__in=product_ids).values_list("id", "name"))
+        mask = 0
+        for product_id in product_ids:
+            if product_id in rows:
+                mask |= 1 << self._set_product(product_id, rows[product_id])
+            elif product_id in self.positions:
+                pos = self.positions[product_id]
+                self.alive &= ~(1 << pos)
+                mask |= 1 << pos
+        self._orders.clear()
+
+        for facet in FACETS:
+            bitmaps = self.bitmaps[facet]
+            for value_id, bits in bitmaps.items():
+                if bits & mask:
+                    bitmaps[value_id] = bits & ~mask
+            through, column = through_of(facet)
+            for product_id, value_id in through.objects.filter(product_id__in=rows).values_list("product_id", column):
+                bitmaps[value_id] = bitmaps.get(value_id, 0) | (1 << self.positions[product_id])
+
+    def refresh_values(self, facet, value_ids):
+        """ファセットの値の名前・有無・所属する商品を DB から読み直す"""
+        labels = dict(FACETS[facet].objects.filter(id__in=value_ids).values_list("id", "name"))
+        through, column = through_of(facet)
+        members = {value_id: [] for value_id in labels}
+        for product_id, value_id in through.objects.filter(**{f"{column}__in": labels}).values_list("product_id", column):
+            if product_id in self.positions:
+                members[value_id].append(self.positions[product_id])
+
+        for value_id in value_ids:
+            if value_id in labels:
+                self.labels[facet][value_id] = labels[value_id]
+                self.bitmaps[facet][value_id] = _bitmap(members[value_id], len(self.ids))
+            else:
+                self.labels[facet].pop(value_id, None)
+                self.bitmaps[facet].pop(value_id, None)
+
+    def apply(self, kind, ids):
+        if kind == "products":
+            self.refresh_products(ids)
+        else:
+            self.refresh_values(kind, ids)
+
+
+def through_of(facet):
+    """M2M の中間テーブルと、値の列名（wood_id など）"""
+    field = Product._meta.get_field(facet)
+    return field.remote_field.through, f"{field.related_model._meta.model_name}_id"
+
+
+# ---------------------------
+# プロセス内の索引
+# ---------------------------
+_index = None
+_lock = threading.Lock()
+
+
+def record_change(kind, ids):
+    """変更ログに追加する（kind は "products" かファセット名）。コミット後に呼ぶ"""
+    cache.add(VERSION_KEY, 0, None)
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        # 追い出された直後（版数が戻るので各プロセスは作り直す）
+        cache.set(VERSION_KEY, 1, None)
+        version = 1
+    cache.set(CHANGE_KEY.format(version), (kind, list(ids)), CHANGE_TTL)
+
+
+def get_index():
+    """プロセス内の索引を返す（初回に作成し、以降は変更ログの差分を反映する）"""
+    global _index
+    with _lock:
+        version = cache.get(VERSION_KEY) or 0
+        if _index is None or not 0 <= version - _index.version <= MAX_PENDING_CHANGES:
+            _index = FacetIndex.build()
+        elif version > _index.version:
+            keys = [CHANGE_KEY.format(v) for v in range(_index.version + 1, version + 1)]
+            changes = cache.get_many(keys)
+            if len(changes) < len(keys):
+                # 期限切れ・書き込み途中の変更がある
+                _index = FacetIndex.build()
+            else:
+                for key in keys:
+                    _index.apply(*changes[key])
+                _index.version = version
+        return _index
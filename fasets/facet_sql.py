@@ -0,0 +1,118 @@
+from django.db import connection
+
+from . import facet_index
+from .models import Product
+from .pagination import fields
+
+# 結果と 3 つのファセット件数を 1 回の SQL（CTE + UNION ALL）で取得する
+#   - 各ファセットの条件は中間テーブルの product_id の集合（CTE）にする
+#   - 結果 = すべての条件の積、ファセット件数 = 同じ条件の積を値ごとに数える
+#     （facet_index.FACET_COUNTS が "disjunctive" なら自分以外の条件の積）
+#   - 行の種類（kind）と並び（ord）を付けて 1 つの結果にまとめる
+#   - 結果だけキーセットで範囲を絞る（ファセットは絞り込み全体で数える）
+FACETS = ("woods", "connectors", "usages")
+
+
+def _q(name):
+    return connection.ops.quote_name(name)
+
+
+def _through(facet):
+    """中間テーブル名・値の列名・値のテーブル名"""
+    field = Product._meta.get_field(facet)
+    through = field.remote_field.through
+    value_model = field.related_model
+    return through._meta.db_table, f"{value_model._meta.model_name}_id", value_model._meta.db_table
+
+
+def _order_clause(ordering, alias):
+    """"name" / "-name" / "id" / "-id" → ORDER BY 句（同じ値は id で並べる）"""
+    direction = "DESC" if ordering.startswith("-") else "ASC"
+    return ", ".join(f"{alias}.{_q(column)} {direction}" for column in fields(ordering))
+
+
+def _after_clause(ordering, alias, key):
+    """並び順でキーより後ろの行の条件（pagination.after_q と同じ展開）"""
+    op = "<" if ordering.startswith("-") else ">"
+    columns = fields(ordering)
+    terms, params = [], []
+    for i, column in enumerate(columns):
+        term = [f"{alias}.{_q(columns[j])} = %s" for j in range(i)] + [f"{alias}.{_q(column)} {op} %s"]
+        terms.append(f"({' AND '.join(term)})")
+        params.extend(key[:i + 1])
+    return f"({' OR '.join(terms)})", params
+
+
+def build_query(selected, ordering, after=None, limit=None):
+    """
+    selected: {ファセット: [値ID, ...]} → (SQL, パラメータ)
+    after（並び順のキー）より後ろの結果を最大 limit 行
+    """
+    product_table = Product._meta.db_table
+    ctes, params = [], []
+    filtered = [facet for facet in FACETS if selected.get(facet)]
+
+    # 条件ごとの商品集合
+    for facet in filtered:
+        table, column, _ = _through(facet)
+        ids = selected[facet]
+        ctes.append(
+            f"f_{facet} AS (SELECT DISTINCT product_id FROM {_q(table)} "
+            f"WHERE {_q(column)} IN ({', '.join(['%s'] * len(ids))}))"
+        )
+        params.extend(ids)
+
+    def conditions(column, exclude=None):
+        return [f"{column} IN (SELECT product_id FROM f_{facet})" for facet in filtered if facet != exclude]
+
+    # 結果（並び順を ord に）
+    where = conditions(f"p.{_q('id')}")
+    if after is not None:
+        clause, after_params = _after_clause(ordering, "p", after)
+        where.append(clause)
+        params.extend(after_params)
+    window = (
+        f"SELECT p.{_q('id')}, p.{_q('name')} FROM {_q(product_table)} p"
+        + (f" WHERE {' AND '.join(where)}" if where else "")
+        + f" ORDER BY {_order_clause(ordering, 'p')}"
+    )
+    if limit is not None:
+        window += " LIMIT %s"
+        params.append(limit)
+    parts = [
+        f"SELECT 'results' AS kind, p.{_q('id')} AS id, p.{_q('name')} AS name, "
+        f"ROW_NUMBER() OVER (ORDER BY {_order_clause(ordering, 'p')}) AS ord "
+        f"FROM ({window}) p"
+    ]
+
+    # ファセット件数（disjunctive なら自分の条件は除く。件数の多い順に ord）
+    for facet in FACETS:
+        table, column, value_table = _through(facet)
+        where = conditions(f"t.{_q('product_id')}", exclude=facet if facet_index.disjunctive() else None)
+        parts.append(
+            f"SELECT '{facet}' AS kind, v.{_q('id')} AS id, v.{_q('name')} AS name, -COUNT(*) AS ord "
+            f"FROM {_q(table)} t JOIN {_q(value_table)} v ON v.{_q('id')} = t.{_q(column)}"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + f" GROUP BY v.{_q('id')}, v.{_q('name')}"
+        )
+
+    sql = (f"WITH {', '.join(ctes)} " if ctes else "") + " UNION ALL ".join(parts) + " ORDER BY kind, ord, id"
+    return sql, params
+
+
+def search(selected, ordering, after=None, limit=None):
+    """{"results": [{"id", "name"}], "facets": {ファセット: [{"id", "name", "count"}]}} を 1 クエリで返す"""
+    sql, params = build_query(selected, ordering, after, limit)
+    results = []
+    facets = {facet: [] for facet in FACETS}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for kind, value_id, name, ord_ in cursor.fetchall():
+            if kind == "results":
+                results.append({"id": value_id, "name": name})
+            else:
+                facets[kind].append({"id": value_id, "name": name, "count": -ord_})
+    return {
+        "results": results,
+        "facets": facets
+    }
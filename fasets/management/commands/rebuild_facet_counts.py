@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from fasets import facet_counts
+
+
+class Command(BaseCommand):
+    help = "ファセット件数の集計表（FacetCount）を DB の内容から作り直す"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="bulk_create の 1 回あたりの行数")
+
+    def handle(self, *args, **options):
+        t0 = time.perf_counter()
+        rows = facet_counts.rebuild(batch_size=options["batch_size"])
+        self.stdout.write(f"✅ FacetCount rebuilt: {rows} rows ({time.perf_counter() - t0:.2f}s)")
@@ -0,0 +1,106 @@
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from fasets.models import Connector, Usage, Wood
+from fasets.pagination import PAGE_SIZE
+from fasets.views import ProductSearchAPIView
+
+# 検索 1 回あたりのクエリ数の上限（bitmap は索引の作成後）
+QUERY_BUDGETS = {
+    "bitmap": 0,
+    "sql": 1,
+    "orm": 4,
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class Measurement:
+    """計測結果（クエリ数・経過ミリ秒・実行した SQL）"""
+
+    def __init__(self):
+        self.queries = 0
+        self.ms = 0.0
+        self.sql = []
+
+
+@contextmanager
+def query_budget(max_queries=None, max_ms=None, label="search"):
+    """
+    ブロック内のクエリ数と経過時間を測り、上限を超えたら QueryBudgetExceeded
+    with query_budget(max_queries=1, max_ms=50) as measured: ...
+    """
+    measured = Measurement()
+    t0 = time.perf_counter()
+    with CaptureQueriesContext(connection) as ctx:
+        yield measured
+    measured.ms = (time.perf_counter() - t0) * 1000
+    measured.sql = [q["sql"] for q in ctx.captured_queries]
+    measured.queries = len(measured.sql)
+
+    if max_queries is not None and measured.queries > max_queries:
+        raise QueryBudgetExceeded(
+            f"{label}: {measured.queries} queries (budget {max_queries})\n" + "\n".join(measured.sql)
+        )
+    if max_ms is not None and measured.ms > max_ms:
+        raise QueryBudgetExceeded(f"{label}: {measured.ms:.1f} ms (budget {max_ms} ms)")
+
+
+class Command(BaseCommand):
+    help = "検索方法ごとに、代表的な条件での 1 回あたりのクエリ数と時間を測り、上限を超えたら失敗する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--engine", action="append", choices=sorted(QUERY_BUDGETS),
+                            help="測る検索方法（複数可、省略時はすべて）")
+        parser.add_argument("--repeat", type=int, default=5, help="条件ごとの実行回数（中央値を使う）")
+        parser.add_argument("--max-ms", type=float, default=None, help="1 回あたりの時間の上限（ミリ秒）")
+
+    def shapes(self):
+        """条件なし・1 値・ファセットをまたいだ組み合わせ"""
+        wood_ids = list(Wood.objects.order_by("id").values_list("id", flat=True)[:2])
+        connector_ids = list(Connector.objects.order_by("id").values_list("id", flat=True)[:1])
+        usage_ids = list(Usage.objects.order_by("id").values_list("id", flat=True)[:1])
+        return {
+            "unfiltered": ([], [], [], "-id"),
+            "one wood": (wood_ids[:1], [], [], "name"),
+            "woods OR + connector + usage": (wood_ids, connector_ids, usage_ids, "-name"),
+        }
+
+    def handle(self, *args, **options):
+        view = ProductSearchAPIView()
+        engines = options["engine"] or sorted(QUERY_BUDGETS)
+        failures = []
+
+        for engine in engines:
+            search = getattr(view, f"search_{engine}")
+            # 索引の作成など初回だけの処理は測らない
+            search([], [], [], "-id")
+            for shape, args in self.shapes().items():
+                label = f"{engine} / {shape}"
+                timings, queries = [], 0
+                try:
+                    for _ in range(options["repeat"]):
+                        with query_budget(QUERY_BUDGETS[engine], label=label) as measured:
+                            data = search(*args, limit=PAGE_SIZE + 1)
+                        timings.append(measured.ms)
+                        queries = measured.queries
+                    median = statistics.median(timings)
+                    if options["max_ms"] is not None and median > options["max_ms"]:
+                        raise QueryBudgetExceeded(f"{label}: {median:.1f} ms (budget {options['max_ms']} ms)")
+                except QueryBudgetExceeded as e:
+                    failures.append(str(e))
+                    self.stdout.write(self.style.ERROR(f"✗ {label}"))
+                    continue
+                self.stdout.write(
+                    f"✓ {label}: {queries} queries, {median:.1f} ms, {len(data['results'])} results"
+                )
+
+        if failures:
+            raise CommandError("\n\n".join(failures))
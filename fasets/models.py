@@ -1,3 +1,6 @@
+from django.db import models
+
+
 class Base(models.Model):
     description1 = models.TextField()
     description2 = models.TextField()
@@ -14,3 +17,56 @@ class Child(Base):
     description1_value = models.TextField()
     description2_label = models.TextField()
     description2_value = models.TextField()
+
+
+# ---------------------------
+# 商品検索（ファセット）
+# ---------------------------
+class Wood(models.Model):
+    name = models.CharField(max_length=100)
+
+
+class Connector(models.Model):
+    name = models.CharField(max_length=100)
+
+
+class Usage(models.Model):
+    name = models.CharField(max_length=100)
+
+
+class Product(models.Model):
+    name = models.CharField(max_length=255)
+
+    woods = models.ManyToManyField(Wood, related_name="products")
+    connectors = models.ManyToManyField(Connector, related_name="products")
+    usages = models.ManyToManyField(Usage, related_name="products")
+
+
+class FacetCount(models.Model):
+    """
+    ファセット件数の集計表（facet_counts.py が差分更新、rebuild_facet_counts で作り直し）
+    filter_facet が空: 絞り込みなしの facet / value の件数
+    filter_facet / filter_value あり: その 1 値で絞り込んだときの各ファセット（同じファセットを含む）の件数
+    """
+    filter_facet = models.CharField(max_length=20, blank=True, default="")
+    filter_value = models.IntegerField(default=0)
+    facet = models.CharField(max_length=20)
+    value = models.IntegerField()
+    name = models.CharField(max_length=100)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["filter_facet", "filter_value", "facet", "value"], name="fasets_facetcount_key"
+            ),
+        ]
+
+
+class FacetCountBuild(models.Model):
+    """
+    集計表（FacetCount）を作り直した記録（rebuild_facet_counts が書く）
+    今の形式（facet_counts.FORMAT）で作り直した記録がなければ集計表は読まない
+    """
+    format = models.IntegerField()
+    built_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,112 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+
+# キーセット（カーソル）方式のページ分割
+#   - 並び順は必ず id を最後のキーにして全順序にする（"name" → (name, id)）
+#   - カーソルは直前のページの端の行のキーと向き（次 "n" / 前 "p"）と並び順
+#   - 前のページは並び順を逆にして「キーより後ろ」を取り、最後に反転する
+PAGE_SIZE = getattr(settings, "FASETS_PAGE_SIZE", 50)
+MAX_PAGE_SIZE = getattr(settings, "FASETS_MAX_PAGE_SIZE", 200)
+
+# カーソルのキーの型（並びの列 → 型）
+FIELD_TYPES = {
+    "id": int,
+    "name": str,
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def page_size_of(value):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+    return min(max(size, 1), MAX_PAGE_SIZE)
+
+
+def encode_cursor(key, direction, ordering):
+    raw = json.dumps({"k": key, "d": direction, "o": ordering}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, ordering):
+    """カーソル → (キー, 向き)。カーソルがなければ (None, "n")"""
+    if not cursor:
+        return None, "n"
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        key, direction = list(data["k"]), data["d"]
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor("invalid cursor")
+    if direction not in ("n", "p") or data.get("o") != ordering or len(key) != len(fields(ordering)):
+        raise InvalidCursor("cursor does not match this sort")
+    for field, value in zip(fields(ordering), key):
+        # bool は int のサブクラスなので別に弾く
+        if not isinstance(value, FIELD_TYPES[field]) or isinstance(value, bool):
+            raise InvalidCursor("invalid cursor")
+    return key, direction
+
+
+def fields(ordering):
+    """並び順のキーの列（id を最後に）"""
+    field = ordering.lstrip("-")
+    return ["id"] if field == "id" else [field, "id"]
+
+
+def flip(ordering):
+    return ordering[1:] if ordering.startswith("-") else f"-{ordering}"
+
+
+def traversal(ordering, direction):
+    """実際に読む向きの並び順（前のページは逆順に読む）"""
+    return flip(ordering) if direction == "p" else ordering
+
+
+def key_of(row, ordering):
+    return [row[field] for field in fields(ordering)]
+
+
+def paginate(rows, ordering, page_size, key, direction):
+    """
+    rows: traversal の順にキーより後ろを最大 page_size + 1 行読んだもの
+    (表示順の行, 次のカーソル, 前のカーソル) を返す
+    """
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == "p":
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+
+    has_next = more if direction == "n" else True
+    has_prev = more if direction == "p" else key is not None
+    return (
+        rows,
+        encode_cursor(key_of(rows[-1], ordering), "n", ordering) if has_next else None,
+        encode_cursor(key_of(rows[0], ordering), "p", ordering) if has_prev else None,
+    )
+
+
+# ---------------------------
+# ORM 用
+# ---------------------------
+def order_by(ordering):
+    prefix = "-" if ordering.startswith("-") else ""
+    return [f"{prefix}{field}" for field in fields(ordering)]
+
+
+def after_q(ordering, key):
+    """並び順でキーより後ろの行（(a, id) > (x, y) を a > x OR (a = x AND id > y) に展開）"""
+    op = "lt" if ordering.startswith("-") else "gt"
+    columns = fields(ordering)
+    q = Q()
+    for i, field in enumerate(columns):
+        equal = {columns[j]: key[j] for j in range(i)}
+        q |= Q(**equal, **{f"{field}__{op}": key[i]})
+    return q
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+# 検索結果のキャッシュ
+#   - キーは条件を正規化して作る（ID の順序・重複・パラメータの順序に依らない）
+#   - 商品・ファセットの値・M2M が変わると版数を上げる（signals.py）。版数の違うエントリは古いもの
+#   - 古いエントリは再計算中の他のリクエストにそのまま返す（stale-while-revalidate）
+#   - 再計算はキーごとに 1 リクエストだけ（cache.add のロック）。エントリがなければ終わるのを待つ
+PREFIX = "search"
+VERSION_KEY = f"{PREFIX}:version"
+
+# 新しいとみなす秒数と、古いエントリを残しておく秒数
+FRESH_SECONDS = getattr(settings, "FASETS_CACHE_FRESH_SECONDS", 60)
+STALE_SECONDS = getattr(settings, "FASETS_CACHE_STALE_SECONDS", 10 * 60)
+
+# 再計算のロックの期限と、エントリがないときに他のリクエストの再計算を待つ秒数
+LOCK_SECONDS = 30
+WAIT_SECONDS = 5
+POLL_SECONDS = 0.05
+
+
+def canonical_key(selected, ordering, page_size, after=None, direction="n"):
+    """selected: {ファセット: [値ID, ...]} → キャッシュキー"""
+    parts = {facet: sorted(set(ids)) for facet, ids in selected.items() if ids}
+    raw = json.dumps([parts, ordering, page_size, after, direction], sort_keys=True, separators=(",", ":"))
+    return f"{PREFIX}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+
+def _initial_version():
+    # 版数が追い出されても、以前の版数と重ならないように時刻から始める
+    return int(time.time() * 1000)
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, _initial_version(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    """データが変わったときに呼ぶ（それまでのエントリはすべて古いものになる）"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, _initial_version(), None)
+
+
+def _lock_key(key):
+    return f"{key}:lock"
+
+
+def get_or_compute(key, compute):
+    """キャッシュがあれば返し、なければ（古ければ）compute() で作り直す"""
+    version = current_version()
+    entry = cache.get(key)
+    if entry is not None and entry["version"] == version and entry["fresh_until"] > time.time():
+        return entry["data"]
+
+    if cache.add(_lock_key(key), 1, LOCK_SECONDS):
+        try:
+            data = compute()
+            # 計算中に版数が上がっていれば次のリクエストで作り直される
+            cache.set(key, {"version": version, "fresh_until": time.time() + FRESH_SECONDS, "data": data},
+                      STALE_SECONDS)
+            return data
+        finally:
+            cache.delete(_lock_key(key))
+
+    # 他のリクエストが再計算中
+    if entry is not None:
+        return entry["data"]
+
+    deadline = time.time() + WAIT_SECONDS
+    while time.time() < deadline:
+        time.sleep(POLL_SECONDS)
+        entry = cache.get(key)
+        if entry is not None and entry["version"] == version:
+            return entry["data"]
+    return compute()
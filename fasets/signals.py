@@ -0,0 +1,85 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+
+from . import facet_counts, facet_index, search_cache
+from .facet_index import FACETS
+from .models import Product
+
+# 変更をファセット索引の変更ログに記録し、検索キャッシュの版数を上げる
+# コミット前に記録すると他プロセスが古い内容を読んで版数だけ進めてしまうので、コミット後に記録する
+
+
+def _changed(kind, ids):
+    transaction.on_commit(partial(facet_index.record_change, kind, ids))
+    transaction.on_commit(search_cache.bump_version)
+
+
+def product_saved(sender, instance, **kwargs):
+    _changed("products", [instance.pk])
+
+
+def value_saved(sender, instance, facet, **kwargs):
+    _changed(facet, [instance.pk])
+
+
+# ---------------------------
+# 集計表（facet_counts.py）：変更と同じトランザクションで足し引きする
+# 削除は中間テーブルの行が消える前（pre_*）に数える
+# ---------------------------
+def product_deleting(sender, instance, **kwargs):
+    if facet_counts.ENABLED:
+        facet_counts.products_deleted([instance.pk])
+
+
+def value_renamed(sender, instance, facet, **kwargs):
+    if facet_counts.ENABLED:
+        facet_counts.value_renamed(facet, instance.pk, instance.name)
+
+
+def value_deleting(sender, instance, facet, **kwargs):
+    if facet_counts.ENABLED:
+        facet_counts.value_deleted(facet, instance.pk)
+
+
+def relation_counts(instance, action, reverse, facet, pk_set):
+    if action == "post_add":
+        pairs = [(pk, instance.pk) for pk in pk_set] if reverse else [(instance.pk, pk) for pk in pk_set]
+        facet_counts.relations_changed(facet, pairs, 1)
+    elif action in ("pre_remove", "pre_clear"):
+        ids = None if action == "pre_clear" else pk_set
+        if reverse:
+            pairs = facet_counts.existing_pairs(facet, product_ids=ids, value_ids=[instance.pk])
+        else:
+            pairs = facet_counts.existing_pairs(facet, product_ids=[instance.pk], value_ids=ids)
+        facet_counts.relations_changed(facet, pairs, -1)
+
+
+def relation_changed(sender, instance, action, reverse, facet, pk_set=None, **kwargs):
+    if facet_counts.ENABLED:
+        relation_counts(instance, action, reverse, facet, pk_set)
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        # wood.products.add(...) など：値の側から読み直す
+        _changed(facet, [instance.pk])
+    else:
+        _changed("products", [instance.pk])
+
+
+post_save.connect(product_saved, sender=Product, dispatch_uid="fasets.product_saved")
+post_delete.connect(product_saved, sender=Product, dispatch_uid="fasets.product_deleted")
+pre_delete.connect(product_deleting, sender=Product, dispatch_uid="fasets.product_deleting")
+
+for _facet, _model in FACETS.items():
+    post_save.connect(partial(value_saved, facet=_facet), sender=_model, weak=False,
+                      dispatch_uid=f"fasets.{_facet}_saved")
+    post_delete.connect(partial(value_saved, facet=_facet), sender=_model, weak=False,
+                        dispatch_uid=f"fasets.{_facet}_deleted")
+    post_save.connect(partial(value_renamed, facet=_facet), sender=_model, weak=False,
+                      dispatch_uid=f"fasets.{_facet}_renamed")
+    pre_delete.connect(partial(value_deleting, facet=_facet), sender=_model, weak=False,
+                       dispatch_uid=f"fasets.{_facet}_deleting")
+    m2m_changed.connect(partial(relation_changed, facet=_facet), sender=getattr(Product, _facet).through,
+                        weak=False, dispatch_uid=f"fasets.{_facet}_changed")
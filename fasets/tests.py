@@ -0,0 +1,215 @@
+import random
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory
+
+from . import facet_counts, facet_index, pagination, views
+from .management.commands.search_budget import QUERY_BUDGETS
+from .models import Connector, FacetCount, Product, Usage, Wood
+from .views import ProductSearchAPIView
+
+ENGINES = ("bitmap", "sql", "orm")
+ORDERINGS = ("name", "-name", "id", "-id")
+
+
+class SearchTestCase(TestCase):
+    """ランダムな商品とファセットの値（同じ名前の商品・値を持たない商品を含む）"""
+
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(1)
+        cls.woods = [Wood.objects.create(name=f"wood{i}") for i in range(6)]
+        cls.connectors = [Connector.objects.create(name=f"connector{i}") for i in range(5)]
+        cls.usages = [Usage.objects.create(name=f"usage{i}") for i in range(4)]
+        for _ in range(200):
+            product = Product.objects.create(name=f"product{rnd.randint(0, 40)}")
+            product.woods.set(rnd.sample(cls.woods, rnd.randint(0, 2)))
+            product.connectors.set(rnd.sample(cls.connectors, rnd.randint(0, 2)))
+            product.usages.set(rnd.sample(cls.usages, rnd.randint(0, 2)))
+
+    def setUp(self):
+        # テスト間でプロセス内の索引・キャッシュを持ち越さない
+        cache.clear()
+        facet_index._index = None
+        self.view = ProductSearchAPIView()
+
+    def selections(self, n=40, seed=2):
+        """条件なし・1 値・同じファセット内の OR・ファセットをまたいだ組み合わせ"""
+        rnd = random.Random(seed)
+        yield [], [], []
+        yield [self.woods[0].id], [], []
+        for _ in range(n):
+            yield tuple(
+                sorted(value.id for value in rnd.sample(values, rnd.randint(0, 2)))
+                for values in (self.woods, self.connectors, self.usages)
+            )
+
+    def search(self, engine, selected, ordering, after=None, limit=None):
+        return getattr(self.view, f"search_{engine}")(*selected, ordering, after, limit)
+
+
+class EngineParityTest(SearchTestCase):
+    """bitmap・sql・orm が同じ条件で同じ結果と件数を返す"""
+
+    def assertSameSearch(self, selected, ordering):
+        expected = self.search("orm", selected, ordering)
+        for engine in ENGINES:
+            data = self.search(engine, selected, ordering)
+            self.assertEqual(data["results"], expected["results"], (engine, selected, ordering))
+            self.assertEqual(data["facets"], expected["facets"], (engine, selected, ordering))
+
+    def test_filtered_counts(self):
+        for selected in self.selections():
+            for ordering in ORDERINGS:
+                self.assertSameSearch(selected, ordering)
+
+    def test_disjunctive_counts(self):
+        with mock.patch.object(facet_index, "FACET_COUNTS", "disjunctive"):
+            for selected in self.selections():
+                self.assertSameSearch(selected, "-id")
+
+    def test_filtered_counts_are_within_results(self):
+        """filtered（既定）の件数は結果の商品だけで数える"""
+        data = self.search("orm", ([self.woods[0].id], [], []), "-id")
+        result_ids = [row["id"] for row in data["results"]]
+        for value in data["facets"]["connectors"]:
+            count = Product.objects.filter(id__in=result_ids, connectors__id=value["id"]).count()
+            self.assertEqual(value["count"], count)
+        self.assertEqual([value["id"] for value in data["facets"]["woods"]][:1], [self.woods[0].id])
+
+
+class CursorParityTest(SearchTestCase):
+    """カーソルで前後のページをたどっても、どの検索方法でも同じページになる"""
+
+    PAGE_SIZE = 7
+
+    def walk(self, engine, selected, ordering):
+        """最後のページまで次へ進み、そこから最初のページまで前へ戻る → {"next": [ページ], "prev": [ページ]}"""
+        pages, after, direction = {"next": [], "prev": []}, None, "n"
+        with mock.patch.object(views, "FACET_ENGINE", engine), mock.patch.object(facet_counts, "ENABLED", False):
+            for step in ("next", "prev"):
+                while True:
+                    data = self.view.search(*selected, ordering, self.PAGE_SIZE, after, direction)
+                    pages[step].append(data)
+                    if data[step] is None:
+                        break
+                    after, direction = pagination.decode_cursor(data[step], ordering)
+        return pages
+
+    def test_pages(self):
+        for selected in self.selections(n=10, seed=3):
+            for ordering in ORDERINGS:
+                expected = self.walk("orm", selected, ordering)
+                rows = self.search("orm", selected, ordering)["results"]
+                self.assertEqual([row for page in expected["next"] for row in page["results"]], rows)
+                # 戻りは最後のページを読み直してから前へ
+                self.assertEqual([row for page in reversed(expected["prev"]) for row in page["results"]], rows)
+                for engine in ENGINES:
+                    self.assertEqual(self.walk(engine, selected, ordering), expected, (engine, selected, ordering))
+
+    def test_invalid_cursor(self):
+        """キーの型が違う・並び順の違うカーソルは 400"""
+        cursors = [
+            ("id_desc", pagination.encode_cursor(["abc"], "n", "-id")),
+            ("id_desc", pagination.encode_cursor([True], "n", "-id")),
+            ("id_desc", pagination.encode_cursor([1.5], "n", "-id")),
+            ("id_desc", pagination.encode_cursor([1, "product1"], "n", "-id")),
+            ("name_asc", pagination.encode_cursor([1, 1], "n", "name")),
+            ("name_asc", pagination.encode_cursor(["product1", "1"], "p", "name")),
+            ("name_desc", pagination.encode_cursor([None, 1], "n", "-name")),
+            ("name_asc", pagination.encode_cursor(["product1", 1], "n", "-name")),
+            ("name_asc", "not-a-cursor"),
+        ]
+        for engine in ENGINES:
+            with mock.patch.object(views, "FACET_ENGINE", engine):
+                for sort, cursor in cursors:
+                    request = APIRequestFactory().get("/", {"sort": sort, "cursor": cursor})
+                    response = ProductSearchAPIView.as_view()(request)
+                    self.assertEqual(response.status_code, 400, (engine, sort, cursor))
+
+
+class FacetCountTest(SearchTestCase):
+    """集計表（facet_counts.py）の差分更新"""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(facet_counts, "ENABLED", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def snapshot(self):
+        return {
+            (row.filter_facet, row.filter_value, row.facet, row.value): (row.name, row.count)
+            for row in FacetCount.objects.exclude(count=0)
+        }
+
+    def assertMatchesRebuild(self):
+        incremental = self.snapshot()
+        facet_counts.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_lookup_needs_rebuild(self):
+        self.assertIsNone(facet_counts.lookup({"woods": []}))
+        facet_counts.rebuild()
+        cache.clear()
+        self.assertIsNotNone(facet_counts.lookup({"woods": []}))
+
+    def test_incremental_matches_rebuild(self):
+        facet_counts.rebuild()
+        products = list(Product.objects.order_by("id")[:12])
+        woods, connectors = self.woods, self.connectors
+
+        # 追加（商品側・値の側）
+        products[0].woods.add(woods[0], woods[1], woods[2])
+        woods[3].products.add(*products[1:4])
+        self.assertMatchesRebuild()
+
+        # 削除（持っていない値を含む）
+        products[0].woods.remove(woods[1], woods[4])
+        connectors[0].products.remove(*products[4:8])
+        self.assertMatchesRebuild()
+
+        # 全削除・入れ替え
+        products[8].usages.clear()
+        woods[2].products.clear()
+        products[9].connectors.set([connectors[1], connectors[2]])
+        self.assertMatchesRebuild()
+
+        # 商品・値の削除と名前の変更
+        products[10].delete()
+        woods[5].delete()
+        connectors[3].name = "renamed"
+        connectors[3].save()
+        created = Product.objects.create(name="created")
+        created.woods.add(woods[0], woods[3])
+        created.usages.add(self.usages[0])
+        self.assertMatchesRebuild()
+
+    def test_lookup_matches_engines(self):
+        facet_counts.rebuild()
+        products = list(Product.objects.order_by("id")[:4])
+        products[0].woods.add(self.woods[1])
+        self.woods[0].products.remove(*products)
+        for mode in ("filtered", "disjunctive"):
+            with mock.patch.object(facet_index, "FACET_COUNTS", mode):
+                for selected in ([], [], []), ([self.woods[0].id], [], []), ([], [], [self.usages[1].id]):
+                    facets = facet_counts.lookup(dict(zip(("woods", "connectors", "usages"), selected)))
+                    self.assertEqual(facets, self.search("orm", selected, "-id")["facets"], (mode, selected))
+
+
+class QueryBudgetTest(SearchTestCase):
+    """検索 1 回あたりのクエリ数（search_budget コマンドと同じ上限）"""
+
+    def test_queries_per_search(self):
+        self.search("bitmap", ([], [], []), "-id")  # 索引の作成は数えない
+        for engine in ENGINES:
+            for selected in ([], [], []), ([self.woods[0].id, self.woods[1].id], [self.connectors[0].id], []):
+                with self.assertNumQueries(QUERY_BUDGETS[engine]):
+                    self.search(engine, selected, "-name", limit=21)
+
+    def test_search_budget_command(self):
+        call_command("search_budget", repeat=1, stdout=StringIO())
@@ -1,11 +1,19 @@
+from django.conf import settings
 from django.db.models import Count
-from django.core.cache import cache
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
+from . import facet_counts, facet_sql, pagination, search_cache
+from .facet_index import disjunctive, get_index
 from .models import Product
 
+# 検索・ファセット集計の方法
+#   "bitmap": プロセス内のビットマップ索引（facet_index.py）
+#   "sql": 結果とファセットを 1 回の SQL で集計（facet_sql.py）
+#   "orm": 毎回 DB で集計（結果＋ファセットごとに 1 クエリ）
+FACET_ENGINE = getattr(settings, "FASETS_FACET_ENGINE", "bitmap")
+
 
 class ProductSearchAPIView(APIView):
 
@@ -23,15 +31,110 @@ class ProductSearchAPIView(APIView):
         connector_ids = self.parse_ids(request.GET.get("connectors"))
         usage_ids = self.parse_ids(request.GET.get("usages"))
         sort = request.GET.get("sort")
+        ordering = self.SORT_MAP.get(sort, "-id")
+        page_size = pagination.page_size_of(request.GET.get("page_size"))
+        try:
+            after, direction = pagination.decode_cursor(request.GET.get("cursor"), ordering)
+        except pagination.InvalidCursor as e:
+            return Response({"error": str(e)}, status=400)
+
+        # ---------------------------
+        # キャッシュ（正規化したキー・版数つき・再計算は 1 リクエストだけ）
+        # ---------------------------
+        selected = {
+            "woods": wood_ids,
+            "connectors": connector_ids,
+            "usages": usage_ids,
+        }
+        cache_key = search_cache.canonical_key(selected, ordering, page_size, after, direction)
+        response_data = search_cache.get_or_compute(
+            cache_key, lambda: self.search(wood_ids, connector_ids, usage_ids, ordering, page_size, after, direction)
+        )
+
+        return Response(response_data)
 
+    def search(self, wood_ids, connector_ids, usage_ids, ordering, page_size, after, direction):
         # ---------------------------
-        # キャッシュ
+        # 検索（前のページは逆順に読み、1 行多く読んで続きの有無を判定）
         # ---------------------------
-        cache_key = f"search:{request.GET.urlencode()}"
-        cached = cache.get(cache_key)
-        if cached:
-            return Response(cached)
+        args = (wood_ids, connector_ids, usage_ids, pagination.traversal(ordering, direction), after, page_size + 1)
+        facets = None
+        if FACET_ENGINE != "bitmap" and facet_counts.ENABLED:
+            # 絞り込みなし・1 値の絞り込みは集計表から（組み合わせは None で通常の集計へ）
+            facets = facet_counts.lookup({
+                "woods": wood_ids,
+                "connectors": connector_ids,
+                "usages": usage_ids,
+            })
+
+        if facets is not None:
+            data = {"results": self.get_results(*args), "facets": facets}
+        elif FACET_ENGINE == "bitmap":
+            data = self.search_bitmap(*args)
+        elif FACET_ENGINE == "sql":
+            data = self.search_sql(*args)
+        else:
+            data = self.search_orm(*args)
+
+        results, next_cursor, prev_cursor = pagination.paginate(
+            data["results"], ordering, page_size, after, direction
+        )
+        return {
+            "results": results,
+            "facets": data["facets"],
+            "next": next_cursor,
+            "prev": prev_cursor,
+        }
+
+    # ---------------------------
+    # 検索：ビットマップ索引
+    # ---------------------------
+    def search_bitmap(self, wood_ids, connector_ids, usage_ids, ordering, after=None, limit=None):
+        index = get_index()
+        bits, facets = index.search({
+            "woods": wood_ids,
+            "connectors": connector_ids,
+            "usages": usage_ids,
+        })
+        return {
+            "results": index.results(bits, ordering, after, limit),
+            "facets": facets
+        }
+
+    # ---------------------------
+    # 検索：SQL 1 回
+    # ---------------------------
+    def search_sql(self, wood_ids, connector_ids, usage_ids, ordering, after=None, limit=None):
+        return facet_sql.search({
+            "woods": wood_ids,
+            "connectors": connector_ids,
+            "usages": usage_ids,
+        }, ordering, after, limit)
+
+    # ---------------------------
+    # 検索：ORM
+    # ---------------------------
+    def search_orm(self, wood_ids, connector_ids, usage_ids, ordering, after=None, limit=None):
+        results = self.get_results(wood_ids, connector_ids, usage_ids, ordering, after, limit)
+
+        # ---------------------------
+        # ファセット（IDベースで軽量化。disjunctive なら自ファセットの条件は除いた商品で数える）
+        # ---------------------------
+        def own(ids):
+            return [] if disjunctive() else ids
+
+        facets = {
+            "woods": self.get_wood_facets(self.base_ids(own(wood_ids), connector_ids, usage_ids)),
+            "connectors": self.get_connector_facets(self.base_ids(wood_ids, own(connector_ids), usage_ids)),
+            "usages": self.get_usage_facets(self.base_ids(wood_ids, connector_ids, own(usage_ids))),
+        }
+
+        return {
+            "results": results,
+            "facets": facets
+        }
 
+    def filter_products(self, wood_ids, connector_ids, usage_ids):
         # ---------------------------
         # ベースクエリ（JOIN削減：サブクエリ）
         # ---------------------------
@@ -52,44 +155,28 @@ class ProductSearchAPIView(APIView):
                 id__in=Product.objects.filter(usages__id__in=usage_ids).values("id")
             )
 
-        qs = qs.distinct()
+        return qs.distinct()
+
+    def base_ids(self, wood_ids, connector_ids, usage_ids):
+        return self.filter_products(wood_ids, connector_ids, usage_ids).values_list("id", flat=True)
+
+    def get_results(self, wood_ids, connector_ids, usage_ids, ordering, after=None, limit=None):
+        qs = self.filter_products(wood_ids, connector_ids, usage_ids)
 
         # ---------------------------
-        # ソート
+        # ソート・キーセット
         # ---------------------------
-        if sort in self.SORT_MAP:
-            qs = qs.order_by(self.SORT_MAP[sort])
-        else:
-            qs = qs.order_by("-id")
+        qs = qs.order_by(*pagination.order_by(ordering))
+        if after is not None:
+            qs = qs.filter(pagination.after_q(ordering, after))
 
         # ---------------------------
         # 結果
         # ---------------------------
-        results = list(
-            qs.values("id", "name")
+        return list(
+            qs.values("id", "name")[:limit]
         )
 
-        # ---------------------------
-        # ファセット（IDベースで軽量化）
-        # ---------------------------
-        base_ids = qs.values_list("id", flat=True)
-
-        facets = {
-            "woods": self.get_wood_facets(base_ids, connector_ids, usage_ids),
-            "connectors": self.get_connector_facets(base_ids, wood_ids, usage_ids),
-            "usages": self.get_usage_facets(base_ids, wood_ids, connector_ids),
-        }
-
-        response_data = {
-            "results": results,
-            "facets": facets
-        }
-
-        # キャッシュ保存（60秒）
-        cache.set(cache_key, response_data, 60)
-
-        return Response(response_data)
-
     # ---------------------------
     # ユーティリティ
     # ---------------------------
@@ -101,19 +188,13 @@ class ProductSearchAPIView(APIView):
     # ---------------------------
     # ファセット：wood
     # ---------------------------
-    def get_wood_facets(self, base_ids, connector_ids, usage_ids):
+    def get_wood_facets(self, base_ids):
         qs = Product.objects.filter(id__in=base_ids)
 
-        if connector_ids:
-            qs = qs.filter(connectors__id__in=connector_ids)
-
-        if usage_ids:
-            qs = qs.filter(usages__id__in=usage_ids)
-
         facets = (
             qs.values("woods__id", "woods__name")
             .annotate(count=Count("id", distinct=True))
-            .order_by("-count")
+            .order_by("-count", "woods__id")
         )
 
         return [
@@ -128,19 +209,13 @@ class ProductSearchAPIView(APIView):
     # ---------------------------
     # ファセット：connector
     # ---------------------------
-    def get_connector_facets(self, base_ids, wood_ids, usage_ids):
+    def get_connector_facets(self, base_ids):
         qs = Product.objects.filter(id__in=base_ids)
 
-        if wood_ids:
-            qs = qs.filter(woods__id__in=wood_ids)
-
-        if usage_ids:
-            qs = qs.filter(usages__id__in=usage_ids)
-
         facets = (
             qs.values("connectors__id", "connectors__name")
             .annotate(count=Count("id", distinct=True))
-            .order_by("-count")
+            .order_by("-count", "connectors__id")
         )
 
         return [
@@ -155,19 +230,13 @@ class ProductSearchAPIView(APIView):
     # ---------------------------
     # ファセット：usage
     # ---------------------------
-    def get_usage_facets(self, base_ids, wood_ids, connector_ids):
+    def get_usage_facets(self, base_ids):
         qs = Product.objects.filter(id__in=base_ids)
 
-        if wood_ids:
-            qs = qs.filter(woods__id__in=wood_ids)
-
-        if connector_ids:
-            qs = qs.filter(connectors__id__in=connector_ids)
-
         facets = (
             qs.values("usages__id", "usages__name")
             .annotate(count=Count("id", distinct=True))
-            .order_by("-count")
+            .order_by("-count", "usages__id")
         )
 
         return [
@@ -0,0 +1,7 @@
+# -----------------------------------------------------
+# ifcconvert / ifcconvert2 の分割スクリプトと backend で共有するモジュール
+#
+# backend からは docker-compose で /app/ifc_common にマウントして import する
+# （コンテナ外で動かすときは PYTHONPATH にリポジトリのルートを追加）。
+# 分割スクリプトは自分でリポジトリのルートを sys.path に追加する。
+# -----------------------------------------------------
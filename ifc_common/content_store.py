@@ -0,0 +1,171 @@
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+# キャッシュ対象ディレクトリの合計サイズ上限（超えたら古いものから削除）
+MAX_BYTES = getattr(settings, "IFC_CACHE_MAX_BYTES", 50 * 1024 ** 3)
+# 直近に使われたファイルは実行中のジョブが参照している可能性があるので消さない
+MIN_AGE = getattr(settings, "IFC_CACHE_MIN_AGE", 60 * 60)
+
+HASH_CHUNK = 1024 * 1024
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _group_of(name):
+    """
+    同じキーのファイル（<キー>.glb と <キー>.lod1.glb、<キー>.obj と <キー>.mtl など）をまとめる名前
+    一時ファイル（.tmp-*）はまとめない
+    """
+    return name if name.startswith(".") else name.split(".", 1)[0]
+
+
+class ContentStore:
+    """
+    MEDIA_ROOT 配下のコンテンツアドレス型ストレージ
+    ファイル名はキー（内容・オプションのハッシュ）なので同名アップロードでも衝突しない
+    同じキーで拡張子の違うファイルは一緒に使われるものとして、まとめて追い出す
+    """
+
+    def __init__(self, root=None, kinds=(), max_bytes=MAX_BYTES):
+        self.root = Path(root or settings.MEDIA_ROOT)
+        self.kinds = kinds
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*parts):
+        """キーの構成要素（ハッシュ・GlobalId・オプション・バージョン）から SHA-256 を作る"""
+        return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+    def path(self, kind, key, suffix=""):
+        directory = self.root / kind
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory / f"{key}{suffix}"
+
+    def url(self, path):
+        relative = Path(path).relative_to(self.root).as_posix()
+        return f"{settings.MEDIA_URL}{relative}"
+
+    def hit(self, path, companions=()):
+        """
+        存在すれば mtime を更新（LRU の最終利用時刻）して True
+        companions（一緒に使うファイル：LOD など）も渡すと、すべてあるときだけ True
+        """
+        try:
+            for p in (path, *companions):
+                os.utime(p)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def temp_path(self, kind, suffix=""):
+        """同じディレクトリに一時ファイルを作る（commit で os.replace できるように）"""
+        directory = self.root / kind
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=suffix)
+        os.close(fd)
+        return Path(tmp)
+
+    def commit(self, tmp_path, path):
+        os.replace(tmp_path, path)
+        return path
+
+    def open_stream(self, kind, suffix=""):
+        """チャンクを受け取るたびに書き込む StreamWriter（受信と同時にハッシュ計算）"""
+        return StreamWriter(self, kind, suffix)
+
+    def save_stream(self, chunks, kind, suffix=""):
+        """
+        チャンクを書き込みながらハッシュを計算し、内容のハッシュをファイル名にして保存
+        (ハッシュ, パス, サイズ) を返す。同じ内容が既にあれば書き込んだものは破棄する
+        """
+        writer = self.open_stream(kind, suffix)
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    def evict(self):
+        """
+        合計サイズが上限を超えていれば最終利用が古いものから削除し、削除したバイト数を返す
+        同じキーのファイルは最も新しい利用時刻でまとめて削除する（GLB だけ残って LOD が消えないように）
+        """
+        groups = {}
+        total = 0
+        for kind in self.kinds:
+            directory = self.root / kind
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory):
+                if entry.is_file():
+                    stat = entry.stat()
+                    group = groups.setdefault((kind, _group_of(entry.name)), [0, 0, []])
+                    group[0] = max(group[0], stat.st_mtime)
+                    group[1] += stat.st_size
+                    group[2].append(entry.path)
+                    total += stat.st_size
+
+        removed = 0
+        now = time.time()
+        for mtime, size, paths in sorted(groups.values(), key=lambda g: g[0]):
+            if total - removed <= self.max_bytes:
+                break
+            if now - mtime < MIN_AGE:
+                continue
+            for path in paths:
+                try:
+                    removed += os.path.getsize(path)
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        return removed
+
+
+class StreamWriter:
+    """ContentStore への書き込み途中のファイル（commit で内容のハッシュ名に確定、abort で破棄）"""
+
+    def __init__(self, store, kind, suffix=""):
+        self.store = store
+        self.kind = kind
+        self.suffix = suffix
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._tmp = store.temp_path(kind, suffix)
+        self._file = open(self._tmp, "wb")
+
+    def write(self, chunk):
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        self._file.write(chunk)
+
+    def commit(self):
+        """(ハッシュ, パス, サイズ) を返す。同じ内容が既にあれば書き込んだものは破棄する"""
+        self._file.close()
+        try:
+            digest = self._hash.hexdigest()
+            path = self.store.path(self.kind, digest, self.suffix)
+            if self.store.hit(path):
+                self._tmp.unlink()
+            else:
+                self.store.commit(self._tmp, path)
+        except BaseException:
+            self.abort()
+            raise
+        return digest, path, self.size
+
+    def abort(self):
+        self._file.close()
+        self._tmp.unlink(missing_ok=True)
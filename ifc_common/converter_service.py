@@ -0,0 +1,288 @@
+# -----------------------------------------------------
+# 常駐 IFC → GLB 変換サービス
+#
+# ifcopenshell とスキーマを読み込み済みのワーカープロセスを常駐させ、
+# Celery タスクからローカルソケット経由でジョブを受け付ける。
+# タスクごとの IfcConvert プロセス起動・スキーマ読み込みが不要になる。
+# 入力は IFC のパス（.gz / .ifczip は展開して読む）か、ジョブに載せた STEP のバイト列
+# （分割結果を中間ファイルに書かずに渡す）。
+#
+# 接続は IFC_CONVERTER_AUTHKEY（必須）で認証し、やり取りは JSON のヘッダーと
+# STEP のバイト列だけ（pickle は使わない）。既定では UNIX ソケットで待ち受ける。
+#
+# 起動方法
+# IFC_CONVERTER_AUTHKEY=... python -m ifc_common.converter_service --workers 4 --timeout 600
+# -----------------------------------------------------
+
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import zipfile
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from ifc_common import rss
+
+# UNIX ソケットのパス、または "host:port"（host を省略すると 127.0.0.1）
+ADDRESS = os.environ.get("IFC_CONVERTER_ADDRESS", "/tmp/ifc_converter.sock")
+# 接続の認証に使う共有鍵（未設定ならサービスは起動せず、クライアントも接続しない）
+AUTHKEY = os.environ.get("IFC_CONVERTER_AUTHKEY", "")
+WORKERS = int(os.environ.get("IFC_CONVERTER_WORKERS", multiprocessing.cpu_count()))
+TIMEOUT = float(os.environ.get("IFC_CONVERTER_TIMEOUT", 600))
+
+# ヘッダー（JSON）と STEP のバイト列の最大長
+HEADER_MAX_BYTES = 64 * 1024
+DATA_MAX_BYTES = int(os.environ.get("IFC_CONVERTER_DATA_MAX_BYTES", 2 * 1024 ** 3))
+
+# IfcConvert と同じく、空間・開口は形状にしない
+EXCLUDED_TYPES = ("IfcSpace", "IfcOpeningElement")
+
+
+class ConversionError(RuntimeError):
+    pass
+
+
+def parse_address(address):
+    """'host:port' → (host, port)、それ以外は UNIX ソケットのパス"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return address
+
+
+def get_authkey(authkey=None):
+    authkey = authkey or AUTHKEY
+    if not authkey:
+        raise ConversionError("IFC_CONVERTER_AUTHKEY is not set")
+    return authkey.encode("utf-8") if isinstance(authkey, str) else authkey
+
+
+def _send_json(conn, obj):
+    conn.send_bytes(json.dumps(obj).encode("utf-8"))
+
+
+def _recv_json(conn):
+    return json.loads(conn.recv_bytes(HEADER_MAX_BYTES))
+
+
+# ---------------------------
+# ワーカー（常駐プロセス）
+# ---------------------------
+def _open_model(job):
+    """ジョブの入力を開く（data があればメモリ上の STEP、.gz / .ifczip は展開して読む）"""
+    import ifcopenshell
+
+    data = job.get("data")
+    if data is None:
+        input_path = job["input"]
+        name = input_path.lower()
+        if name.endswith(".gz"):
+            with gzip.open(input_path, "rb") as f:
+                data = f.read()
+        elif name.endswith(".ifczip"):
+            with zipfile.ZipFile(input_path) as archive:
+                entry = next((n for n in archive.namelist() if n.lower().endswith(".ifc")), None)
+                if entry is None:
+                    raise ConversionError(f"No IFC entry in {input_path}")
+                data = archive.read(entry)
+        else:
+            return ifcopenshell.open(input_path)
+    return ifcopenshell.file.from_string(data.decode("utf-8", "replace"))
+
+
+def _convert_glb(model, output_path, threads):
+    """ifcopenshell の glTF シリアライザで GLB を書き出す"""
+    import ifcopenshell
+    import ifcopenshell.geom
+
+    settings = ifcopenshell.geom.settings()
+    settings.set(settings.APPLY_DEFAULT_MATERIALS, True)
+    serializer_settings = ifcopenshell.geom.serializer_settings()
+    serializer_settings.set(serializer_settings.USE_ELEMENT_GUIDS, True)
+
+    tmp_path = output_path + ".tmp.glb"
+    serializer = ifcopenshell.geom.serializers.gltf(tmp_path, settings, serializer_settings)
+    serializer.setFile(model)
+    serializer.writeHeader()
+
+    count = 0
+    iterator = ifcopenshell.geom.iterator(settings, model, threads, exclude=EXCLUDED_TYPES)
+    if iterator.initialize():
+        while True:
+            serializer.write(iterator.get())
+            count += 1
+            if not iterator.next():
+                break
+    serializer.finalize()
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def _worker_main(conn, threads):
+    import ifcopenshell
+    import ifcopenshell.geom  # noqa: F401
+
+    # スキーマを先に読み込んでおく
+    for schema in ("IFC2X3", "IFC4"):
+        ifcopenshell.ifcopenshell_wrapper.schema_by_name(schema)
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        t0 = time.perf_counter()
+        rss.reset_peak()
+        try:
+            if not job["output"].lower().endswith(".glb"):
+                raise ConversionError(f"Unsupported output: {job['output']}")
+            count = _convert_glb(_open_model(job), job["output"], threads)
+            conn.send(("ok", {
+                "output": job["output"],
+                "elements": count,
+                "seconds": time.perf_counter() - t0,
+                # このジョブの間の最大 RSS
+                "peak_rss": rss.peak(),
+            }))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+# ---------------------------
+# サービス本体
+# ---------------------------
+class ConverterService:
+    """常駐ワーカーのプール（同時実行数 = ワーカー数、ジョブごとにタイムアウト）"""
+
+    def __init__(self, workers=WORKERS, timeout=TIMEOUT, threads=1):
+        self.timeout = timeout
+        self.threads = threads
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        for _ in range(workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, args=(child_conn, self.threads), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _replace(self, worker):
+        process, conn = worker
+        process.kill()
+        process.join()
+        conn.close()
+        return self._spawn()
+
+    def run_job(self, job):
+        """空きワーカーにジョブを渡して結果を待つ（タイムアウト時はワーカーを入れ替える）"""
+        timeout = job.get("timeout") or self.timeout
+        worker = self._idle.get()
+        try:
+            process, conn = worker
+            conn.send(job)
+            if not conn.poll(timeout):
+                worker = self._replace(worker)
+                return ("error", f"Timed out after {timeout}s")
+            return conn.recv()
+        except (EOFError, OSError) as e:
+            worker = self._replace(worker)
+            return ("error", f"Worker died: {e}")
+        finally:
+            self._idle.put(worker)
+
+    def _handle(self, conn):
+        with conn:
+            try:
+                job = _read_job(conn)
+            except EOFError:
+                return
+            except (ValueError, TypeError, KeyError, OSError) as e:
+                _send_json(conn, ["error", f"Bad request: {e}"])
+                return
+            _send_json(conn, self.run_job(job))
+
+    def serve(self, address=ADDRESS, authkey=None):
+        authkey = get_authkey(authkey)
+        address = parse_address(address)
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)
+        with Listener(address, authkey=authkey) as listener:
+            if isinstance(address, str):
+                os.chmod(address, 0o660)
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, OSError, EOFError):
+                    # 認証に失敗した接続
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+
+def _read_job(conn):
+    """JSON のヘッダー（input / output / timeout / data のバイト数）と、あれば STEP のバイト列を受け取る"""
+    header = _recv_json(conn)
+    timeout = header.get("timeout")
+    if timeout is not None and not isinstance(timeout, (int, float)):
+        raise TypeError("timeout must be a number")
+    job = {"input": str(header["input"]), "output": str(header["output"]), "timeout": timeout, "data": None}
+    if header.get("data") is not None:
+        job["data"] = conn.recv_bytes(DATA_MAX_BYTES)
+    return job
+
+
+# ---------------------------
+# クライアント（Celery タスクから呼ぶ）
+# ---------------------------
+def convert(input_path, output_path, timeout=None, address=ADDRESS, authkey=None, data=None):
+    """
+    変換サービスにジョブを投げて結果を返す（失敗時は ConversionError）
+    data（STEP のバイト列）を渡すと input_path は読まず、接続経由でそのまま送る
+    """
+    wait = (timeout or TIMEOUT) * 2
+    with Client(parse_address(address), authkey=get_authkey(authkey)) as conn:
+        _send_json(conn, {
+            "input": str(input_path),
+            "output": str(output_path),
+            "timeout": timeout,
+            "data": None if data is None else len(data),
+        })
+        if data is not None:
+            conn.send_bytes(data)
+        # サービス側のタイムアウト＋空きワーカー待ちの猶予
+        if not conn.poll(wait):
+            raise ConversionError(f"No response from converter service within {wait}s")
+        status, payload = _recv_json(conn)
+
+    if status != "ok":
+        raise ConversionError(payload)
+    return payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常駐 IFC → GLB 変換サービス")
+    parser.add_argument("--address", default=ADDRESS)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="同時実行数")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT, help="ジョブごとのタイムアウト（秒）")
+    parser.add_argument("--threads", type=int, default=1, help="ワーカーあたりの三角形化スレッド数")
+    args = parser.parse_args()
+    if not AUTHKEY:
+        parser.error("IFC_CONVERTER_AUTHKEY を設定してください（クライアントと共有する認証用の鍵）")
+
+    service = ConverterService(args.workers, args.timeout, args.threads)
+    print(f"🔧 IFC converter service: {args.workers} workers on {args.address}")
+    service.serve(args.address)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+from django.core.cache import cache
+
+# ジョブ状態の保持期間
+JOB_TTL = 24 * 60 * 60
+
+
+def _job_key(job_id):
+    return f"ifcjob:{job_id}"
+
+
+def _storey_key(job_id, storey):
+    return f"ifcjob:{job_id}:storey:{storey}"
+
+
+def _done_key(job_id):
+    return f"ifcjob:{job_id}:done"
+
+
+def _version_key(job_id):
+    return f"ifcjob:{job_id}:version"
+
+
+def _result_key(job_id):
+    return f"ifcjob:{job_id}:result"
+
+
+def _bump(job_id):
+    """状態が変わるたびに版数を上げる（ポーリングの ETag に使う）"""
+    try:
+        cache.incr(_version_key(job_id))
+    except ValueError:
+        cache.set(_version_key(job_id), 1, JOB_TTL)
+
+
+def get_version(job_id):
+    """ジョブ状態の版数（ジョブがなければ None）。キー1つを読むだけ"""
+    return cache.get(_version_key(job_id))
+
+
+def create_job(job_id, **fields):
+    cache.set(_job_key(job_id), {"status": "queued", "storeys": [], **fields}, JOB_TTL)
+    cache.set(_version_key(job_id), 1, JOB_TTL)
+
+
+def update_job(job_id, **fields):
+    job = cache.get(_job_key(job_id)) or {"status": "queued", "storeys": []}
+    job.update(fields)
+    cache.set(_job_key(job_id), job, JOB_TTL)
+    _bump(job_id)
+
+
+def set_result(job_id, result):
+    """ジョブの成果物一覧（階層ごとの GLB・マニフェスト）を登録"""
+    cache.set(_result_key(job_id), result, JOB_TTL)
+    _bump(job_id)
+
+
+def get_result(job_id):
+    return cache.get(_result_key(job_id))
+
+
+def start_storeys(job_id, storeys):
+    """分割完了：変換対象の階層を登録（階層ごとの状態は別キーで持つ）"""
+    update_job(job_id, status="converting", storeys=list(storeys))
+    cache.set(_done_key(job_id), 0, JOB_TTL)
+    cache.set_many({_storey_key(job_id, s): {"status": "pending"} for s in storeys}, JOB_TTL)
+    _bump(job_id)
+
+
+def set_storey_status(job_id, storey, status, **extra):
+    """階層の状態を更新（終了状態になったら完了数を加算：redis の INCR で原子的）"""
+    cache.set(_storey_key(job_id, storey), {"status": status, **extra}, JOB_TTL)
+    if status in ("success", "failed"):
+        try:
+            cache.incr(_done_key(job_id))
+        except ValueError:
+            cache.set(_done_key(job_id), 1, JOB_TTL)
+    _bump(job_id)
+
+
+def get_job(job_id):
+    """ジョブ状態（階層ごとの状態と進捗率を含む）"""
+    job = cache.get(_job_key(job_id))
+    if job is None:
+        return None
+
+    storeys = job.get("storeys", [])
+    states = cache.get_many([_storey_key(job_id, s) for s in storeys])
+    done = cache.get(_done_key(job_id)) or 0
+
+    job["storeys"] = {
+        s: states.get(_storey_key(job_id, s), {"status": "pending"}) for s in storeys
+    }
+    if job["status"] in ("success", "partial", "failed"):
+        job["progress"] = 100
+    elif storeys:
+        job["progress"] = int(done * 100 / len(storeys))
+    else:
+        job["progress"] = 0
+    return job
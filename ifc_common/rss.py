@@ -0,0 +1,27 @@
+import resource
+
+# プロセスの最大 RSS（Linux）
+#   - ru_maxrss はプロセス起動からの最大値なので、常駐ワーカーでは最初の大きなジョブの値が残り続ける
+#   - /proc/self/clear_refs に "5" を書くと VmHWM（最大 RSS）が今の RSS に戻る（Linux 4.0 以降）
+#   - 測りたい処理の前に reset_peak() し、後で peak() を読む（入れ子にすると外側の最大値が消える）
+
+
+def reset_peak():
+    """最大 RSS（VmHWM）を今の RSS に戻す"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak():
+    """リセット後の最大 RSS（バイト。VmHWM が読めなければプロセス起動後の ru_maxrss。どちらも KiB）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -0,0 +1,695 @@
+# -----------------------------------------------------
+# STEP (IFC) ファイルの #ID → バイトオフセット索引
+#
+# mmap したファイルを1回だけ走査して索引を作り、サイドカー
+# （<input>.ifc.idx）に保存する。階層の抽出では参照クロージャに
+# 含まれる行だけを読み込んで新しい IFC を書き出すため、
+# モデル全体を ifcopenshell.open() する必要がない。
+# -----------------------------------------------------
+
+import bisect
+import gzip
+import heapq
+import json
+import mmap
+import os
+import re
+import tempfile
+import zipfile
+from array import array
+from contextlib import contextmanager
+
+# 2: エンティティの境界を行頭ではなく文字列外の ";" で判定
+INDEX_MAGIC = b"STEPIDX2"
+INDEX_SUFFIX = ".idx"
+
+# 1 エンティティ（前の空白・コメントから、文字列・コメントの外にある ";" まで）
+# 1行に複数のエンティティや、文字列内の改行・";" があっても正しく区切る
+ENTITY_RE = re.compile(
+    rb"(?:\s|/\*.*?\*/)*+#(\d+)\s*=\s*([A-Za-z0-9_]+)(?:[^';/]++|'[^']*+(?:''[^']*+)*+'|/\*.*?\*/|/)*+;",
+    re.S,
+)
+# 読めないエンティティを飛ばすための境界（境界のときだけグループ 1 が一致する）
+BOUNDARY_RE = re.compile(rb"'[^']*(?:''[^']*)*'|/\*.*?\*/|(;)", re.S)
+STRING_RE = re.compile(rb"'(?:[^']|'')*'")
+REF_RE = re.compile(rb"#(\d+)")
+
+# 逆参照でしか辿れない分解構造: 型名 → (親の引数位置, 子の引数位置)
+DECOMPOSITION_RELS = {
+    "IFCRELCONTAINEDINSPATIALSTRUCTURE": (5, 4),
+    "IFCRELAGGREGATES": (4, 5),
+    "IFCRELNESTS": (4, 5),
+    "IFCRELVOIDSELEMENT": (4, 5),
+    "IFCRELFILLSELEMENT": (4, 5),
+}
+
+# 要素 → 共有リソースの関連: 型名 → (要素リストの引数位置, 参照先の引数位置)
+ASSIGNMENT_RELS = {
+    "IFCRELDEFINESBYTYPE": (4, 5),
+    "IFCRELASSOCIATESMATERIAL": (4, 5),
+}
+
+
+def split_args(body):
+    """'TYPE(...)' のトップレベル引数を生のバイト列のリストで返す"""
+    start = body.index(b"(") + 1
+    args = []
+    depth = 0
+    in_string = False
+    arg_start = start
+    i = start
+    n = len(body)
+    while i < n:
+        c = body[i]
+        if in_string:
+            if c == 0x27:  # '
+                if i + 1 < n and body[i + 1] == 0x27:
+                    i += 1
+                else:
+                    in_string = False
+        elif c == 0x27:
+            in_string = True
+        elif c == 0x28:  # (
+            depth += 1
+        elif c == 0x29:  # )
+            if depth == 0:
+                args.append(body[arg_start:i].strip())
+                break
+            depth -= 1
+        elif c == 0x2C and depth == 0:  # ,
+            args.append(body[arg_start:i].strip())
+            arg_start = i + 1
+        i += 1
+    return args
+
+
+def refs_in(raw):
+    """文字列リテラルを除いた部分に含まれる #ID を列挙"""
+    return [int(m) for m in REF_RE.findall(STRING_RE.sub(b"''", raw))]
+
+
+def decode_string(raw):
+    """STEP の文字列リテラルを str に変換（\\X2\\ などのエンコードに対応）"""
+    if not raw or raw[:1] != b"'":
+        return None
+    s = raw[1:-1].replace(b"''", b"'").decode("latin-1")
+    out = []
+    i = 0
+    while i < len(s):
+        if s.startswith("\\X2\\", i) or s.startswith("\\X4\\", i):
+            width = 4 if s[i + 2] == "2" else 8
+            end = s.index("\\X0\\", i + 4)
+            hex_str = s[i + 4:end]
+            for j in range(0, len(hex_str), width):
+                out.append(chr(int(hex_str[j:j + width], 16)))
+            i = end + 4
+        elif s.startswith("\\X\\", i):
+            out.append(chr(int(s[i + 3:i + 5], 16)))
+            i += 5
+        elif s.startswith("\\S\\", i):
+            out.append(chr(ord(s[i + 3]) + 128))
+            i += 4
+        elif s.startswith("\\\\", i):
+            out.append("\\")
+            i += 2
+        else:
+            out.append(s[i])
+            i += 1
+    return "".join(out)
+
+
+def _next_boundary(data, pos, end):
+    """pos 以降で文字列・コメントの外にある ";" の直後（なければ end）"""
+    for m in BOUNDARY_RE.finditer(data, pos, end):
+        if m.lastindex is not None:
+            return m.end()
+    return end
+
+
+def sidecar_path(path):
+    return str(path) + INDEX_SUFFIX
+
+
+# ---------------------------
+# メモリ予算（大規模モデル用）
+# ---------------------------
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes():
+    """
+    プロセスの RSS のうちファイル mmap 以外の分（/proc/self/statm の resident - shared）
+    mmap した IFC のページはカーネルが回収できるので数えない。/proc がなければ 0
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            _, resident, shared = f.read().split()[:3]
+    except OSError:
+        return 0
+    return (int(resident) - int(shared)) * PAGE_SIZE
+
+
+class MemoryBudget:
+    """
+    RSS の上限。超えても例外にはせず、呼び出し側が退避・解放で対応する
+    exceeded は check_every 回に1回だけ /proc を読む
+    """
+
+    def __init__(self, limit, check_every=50000):
+        self.limit = limit
+        self.check_every = check_every
+        self.peak = 0
+        self._count = 0
+
+    def exceeded(self):
+        self._count += 1
+        if self.limit is None or self._count % self.check_every:
+            return False
+        return self.over()
+
+    def over(self):
+        """今の RSS が上限を超えているか（/proc をすぐに読む）"""
+        if self.limit is None:
+            return False
+        rss = rss_bytes()
+        self.peak = max(self.peak, rss)
+        return rss > self.limit
+
+
+class DiskIdSet:
+    """
+    ID の集合をディスク上のビットマップ（mmap した一時ファイル）で持つ
+    メモリ予算を超えたクロージャの退避先。反復は ID の昇順
+    """
+
+    SCAN_CHUNK = 1024 * 1024
+
+    def __init__(self, max_id, ids=()):
+        self._size = max_id // 8 + 1
+        self._file = tempfile.TemporaryFile(prefix="stepidx-")
+        self._file.truncate(self._size)
+        self._bits = mmap.mmap(self._file.fileno(), self._size)
+        self._len = 0
+        self.update(ids)
+
+    def add(self, entity_id):
+        pos, bit = entity_id >> 3, 1 << (entity_id & 7)
+        value = self._bits[pos]
+        if not value & bit:
+            self._bits[pos] = value | bit
+            self._len += 1
+
+    def update(self, ids):
+        for entity_id in ids:
+            self.add(entity_id)
+
+    def __contains__(self, entity_id):
+        pos = entity_id >> 3
+        return pos < self._size and bool(self._bits[pos] & (1 << (entity_id & 7)))
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        zero = bytes(self.SCAN_CHUNK)
+        for offset in range(0, self._size, self.SCAN_CHUNK):
+            block = self._bits[offset:offset + self.SCAN_CHUNK]
+            if block == zero[:len(block)]:
+                continue
+            for i, value in enumerate(block):
+                if value:
+                    base = (offset + i) << 3
+                    for bit in range(8):
+                        if value & (1 << bit):
+                            yield base + bit
+
+    def close(self):
+        self._bits.close()
+        self._file.close()
+
+
+# ---------------------------
+# 出力（圧縮）
+# ---------------------------
+# 圧縮形式 → 出力の拡張子
+COMPRESSION_SUFFIXES = {None: ".ifc", "gzip": ".ifc.gz", "ifczip": ".ifczip"}
+GZIP_LEVEL = 6
+# 同じ内容なら同じバイト列になるように、圧縮ファイル内の時刻は固定する
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def compression_of(path):
+    """拡張子から圧縮形式を判定（.gz → gzip、.ifczip → ifczip、それ以外は None）"""
+    name = str(path).lower()
+    if name.endswith(".gz"):
+        return "gzip"
+    if name.endswith(".ifczip"):
+        return "ifczip"
+    return None
+
+
+@contextmanager
+def open_output(output_path):
+    """
+    出力先を一時ファイルとして開き、書き終えたら置き換える
+    拡張子が .gz なら gzip、.ifczip なら IFC 1つだけの zip として圧縮する
+    """
+    output_path = str(output_path)
+    compression = compression_of(output_path)
+    tmp_path = output_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as raw:
+            if compression == "gzip":
+                with gzip.GzipFile("", "wb", GZIP_LEVEL, raw, mtime=0) as f:
+                    yield f
+            elif compression == "ifczip":
+                stem = os.path.basename(output_path)[:-len(".ifczip")]
+                info = zipfile.ZipInfo(f"{stem}.ifc", ZIP_DATE_TIME)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with zipfile.ZipFile(raw, "w") as archive, archive.open(info, "w", force_zip64=True) as f:
+                    yield f
+            else:
+                yield raw
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class StepIndex:
+    """#ID → (オフセット, 長さ, 型) の索引"""
+
+    def __init__(self, path, ids, starts, lengths, type_codes, type_names, data_start, data_end):
+        self.path = str(path)
+        self.ids = ids
+        self.starts = starts
+        self.lengths = lengths
+        self.type_codes = type_codes
+        self.type_names = type_names
+        self.data_start = data_start
+        self.data_end = data_end
+        self._fp = None
+        self._mm = None
+        self._by_type = None
+        self._inverse = None
+
+    # ---------------------------
+    # 作成・保存・読み込み
+    # ---------------------------
+    @classmethod
+    def build(cls, path):
+        """mmap したファイルを1回走査して索引を作成"""
+        ids = array("I")
+        starts = array("Q")
+        lengths = array("I")
+        type_codes = array("H")
+        type_names = []
+        type_lookup = {}
+
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data_start = mm.find(b"DATA;")
+            data_end = mm.rfind(b"ENDSEC;")
+            if data_start < 0 or data_end < data_start:
+                raise ValueError(f"Not a STEP file: {path}")
+
+            pos = data_start + len(b"DATA;")
+            while pos < data_end:
+                m = ENTITY_RE.match(mm, pos, data_end)
+                if m is None:
+                    pos = _next_boundary(mm, pos, data_end)
+                    continue
+                end = pos = m.end()
+
+                name = m.group(2).upper().decode("ascii")
+                code = type_lookup.get(name)
+                if code is None:
+                    code = type_lookup[name] = len(type_names)
+                    type_names.append(name)
+
+                start = m.start(1) - 1  # "#"
+                ids.append(int(m.group(1)))
+                starts.append(start)
+                lengths.append(end - start)
+                type_codes.append(code)
+
+        # ID 昇順でない出力（まれ）は並べ替える
+        if any(ids[i] > ids[i + 1] for i in range(len(ids) - 1)):
+            order = sorted(range(len(ids)), key=ids.__getitem__)
+            ids = array("I", (ids[i] for i in order))
+            starts = array("Q", (starts[i] for i in order))
+            lengths = array("I", (lengths[i] for i in order))
+            type_codes = array("H", (type_codes[i] for i in order))
+
+        return cls(path, ids, starts, lengths, type_codes, type_names, data_start, data_end)
+
+    def save(self, index_path=None):
+        index_path = index_path or sidecar_path(self.path)
+        stat = os.stat(self.path)
+        meta = json.dumps({
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "count": len(self.ids),
+            "types": self.type_names,
+            "data_start": self.data_start,
+            "data_end": self.data_end,
+        }).encode("utf-8")
+
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(INDEX_MAGIC)
+            f.write(len(meta).to_bytes(4, "little"))
+            f.write(meta)
+            for arr in (self.ids, self.starts, self.lengths, self.type_codes):
+                arr.tofile(f)
+        os.replace(tmp_path, index_path)
+        return index_path
+
+    @classmethod
+    def load(cls, path, index_path=None):
+        """サイドカーを読み込む（元ファイルが更新されていれば None）"""
+        index_path = index_path or sidecar_path(path)
+        try:
+            with open(index_path, "rb") as f:
+                if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    return None
+                meta_len = int.from_bytes(f.read(4), "little")
+                meta = json.loads(f.read(meta_len))
+
+                stat = os.stat(path)
+                if meta["size"] != stat.st_size or meta["mtime_ns"] != stat.st_mtime_ns:
+                    return None
+
+                count = meta["count"]
+                arrays = []
+                for typecode in ("I", "Q", "I", "H"):
+                    arr = array(typecode)
+                    arr.fromfile(f, count)
+                    arrays.append(arr)
+        except (OSError, ValueError, EOFError, KeyError):
+            return None
+
+        return cls(path, *arrays, meta["types"], meta["data_start"], meta["data_end"])
+
+    @classmethod
+    def open(cls, path):
+        """サイドカーがあれば読み込み、なければ作成して保存"""
+        index = cls.load(path)
+        if index is None:
+            index = cls.build(path)
+            try:
+                index.save()
+            except OSError:
+                pass
+        return index
+
+    # ---------------------------
+    # 参照
+    # ---------------------------
+    def _map(self):
+        if self._mm is None:
+            self._fp = open(self.path, "rb")
+            self._mm = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._fp.close()
+            self._mm = self._fp = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _position(self, entity_id):
+        pos = bisect.bisect_left(self.ids, entity_id)
+        if pos == len(self.ids) or self.ids[pos] != entity_id:
+            raise KeyError(f"#{entity_id} not found")
+        return pos
+
+    def line(self, entity_id):
+        """'#ID=TYPE(...);' の1行（前後の空白・改行を除く）"""
+        pos = self._position(entity_id)
+        start = self.starts[pos]
+        raw = self._map()[start:start + self.lengths[pos]].strip()
+        return raw.rstrip(b";").rstrip() + b";"
+
+    def body(self, entity_id):
+        """'TYPE(...)' の部分"""
+        line = self.line(entity_id)
+        return line[line.index(b"=") + 1:-1].strip()
+
+    def args(self, entity_id):
+        return split_args(self.body(entity_id))
+
+    def type_of(self, entity_id):
+        return self.type_names[self.type_codes[self._position(entity_id)]]
+
+    def ids_of_type(self, type_name):
+        """指定型（完全一致・大文字）のIDリスト"""
+        type_name = type_name.upper()
+        if self._by_type is None:
+            self._by_type = {}
+        if type_name not in self._by_type:
+            try:
+                code = self.type_names.index(type_name)
+            except ValueError:
+                return []
+            self._by_type[type_name] = [i for i, c in zip(self.ids, self.type_codes) if c == code]
+        return self._by_type[type_name]
+
+    def header(self):
+        """'ISO-10303-21;' 〜 HEADER の ENDSEC; まで"""
+        return self._map()[:self.data_start].rstrip() + b"\n"
+
+    def storeys(self):
+        """(ID, GlobalId, Name) のリスト"""
+        result = []
+        for entity_id in self.ids_of_type("IFCBUILDINGSTOREY"):
+            args = self.args(entity_id)
+            result.append((entity_id, decode_string(args[0]), decode_string(args[2])))
+        return result
+
+    def find_storey(self, name=None, global_id=None):
+        for entity_id, gid, storey_name in self.storeys():
+            if (global_id is not None and gid == global_id) or (global_id is None and storey_name == name):
+                return entity_id
+        return None
+
+    # ---------------------------
+    # 参照クロージャ
+    # ---------------------------
+    def _inverse_maps(self):
+        """分解構造・タイプ・材料・スタイルの逆参照表（関連行だけを読んで作成）"""
+        if self._inverse is not None:
+            return self._inverse
+
+        children = {}
+        rels_by_parent = {}
+        assignments = {}
+        styled = {}
+        material_reps = {}
+
+        for type_name, (parent_pos, child_pos) in DECOMPOSITION_RELS.items():
+            for rel_id in self.ids_of_type(type_name):
+                args = self.args(rel_id)
+                for parent in refs_in(args[parent_pos]):
+                    children.setdefault(parent, []).extend(refs_in(args[child_pos]))
+                    rels_by_parent.setdefault(parent, []).append(rel_id)
+
+        for type_name, (objects_pos, target_pos) in ASSIGNMENT_RELS.items():
+            for rel_id in self.ids_of_type(type_name):
+                args = self.args(rel_id)
+                for obj in refs_in(args[objects_pos]):
+                    assignments.setdefault(obj, []).append(rel_id)
+
+        for item_id in self.ids_of_type("IFCSTYLEDITEM"):
+            for ref in refs_in(self.args(item_id)[0]):
+                styled.setdefault(ref, []).append(item_id)
+
+        for rep_id in self.ids_of_type("IFCMATERIALDEFINITIONREPRESENTATION"):
+            for ref in refs_in(self.args(rep_id)[3]):
+                material_reps.setdefault(ref, []).append(rep_id)
+
+        self._inverse = {
+            "children": children,
+            "rels_by_parent": rels_by_parent,
+            "assignments": assignments,
+            "styled": styled,
+            "material_reps": material_reps,
+        }
+        return self._inverse
+
+    def spill(self, ids):
+        """ID集合をディスク上のビットマップに移す"""
+        if isinstance(ids, DiskIdSet):
+            return ids
+        spilled = DiskIdSet(self.ids[-1] if self.ids else 0, ids)
+        ids.clear()
+        return spilled
+
+    def spill_if_over(self, ids, budget):
+        """budget を超えていれば ID 集合をディスクに退避し、逆参照の表を手放す（次の collect で作り直す）"""
+        if budget is not None and budget.over():
+            ids = self.spill(ids)
+            self._inverse = None
+        return ids
+
+    def forward_closure(self, seeds, ids=None, budget=None):
+        """
+        seeds から前方参照で到達できるIDを ids に追加して返す
+        budget を超えたら ids をディスクに退避する（戻り値は退避後の集合）
+        """
+        ids = set() if ids is None else ids
+        stack = list(seeds)
+        while stack:
+            entity_id = stack.pop()
+            if entity_id in ids:
+                continue
+            ids.add(entity_id)
+            # 辿り済みの参照は積まない（スタックが参照の数だけ伸びないように）
+            stack.extend(r for r in refs_in(self.body(entity_id)) if r not in ids)
+            if budget is not None and isinstance(ids, set) and budget.exceeded():
+                ids = self.spill(ids)
+        return ids
+
+    def collect(self, storey_id, element_ids=None, budget=None):
+        """
+        階層の抽出に必要なIDと、書き換えが必要な関連行を返す
+        element_ids を省略すると階層の分解構造すべてを対象にする
+        budget（MemoryBudget）を超えるとIDの集合はディスクに退避される
+        """
+        inverse = self._inverse_maps()
+        children = inverse["children"]
+
+        # 分解構造（逆参照）を辿って対象の製品を決める
+        if element_ids is None:
+            roots = [storey_id]
+        else:
+            roots = list(element_ids)
+        products = set()
+        stack = list(roots)
+        while stack:
+            entity_id = stack.pop()
+            if entity_id in products:
+                continue
+            products.add(entity_id)
+            stack.extend(children.get(entity_id, []))
+        products.add(storey_id)
+
+        # 前方参照のクロージャ（IfcProject の単位・コンテキストも含める）
+        seeds = set(products) | set(self.ids_of_type("IFCPROJECT"))
+        for product in products:
+            for rel_id in inverse["assignments"].get(product, []):
+                seeds.update(refs_in(self.args(rel_id)[-1]))
+        ids = self.forward_closure(seeds, budget=budget)
+
+        # 材料の表現とスタイル（逆参照）
+        extra = set()
+        for entity_id in ids:
+            extra.update(inverse["material_reps"].get(entity_id, []))
+        ids = self.forward_closure(extra, ids, budget)
+        extra = set()
+        for entity_id in ids:
+            extra.update(inverse["styled"].get(entity_id, []))
+        ids = self.forward_closure(extra, ids, budget)
+
+        # 関連エンティティ：参照先がすべて含まれるものはそのまま、
+        # 要素リストだけが他階層にまたがるものは書き換える
+        rewritten = {}
+        for parent in products:
+            for rel_id in inverse["rels_by_parent"].get(parent, []):
+                if all(r in ids for r in refs_in(self.body(rel_id))):
+                    ids.add(rel_id)
+                elif element_ids is not None:
+                    # 要素の一部だけを抽出する場合は子のリストを書き換える
+                    args = self.args(rel_id)
+                    _, child_pos = DECOMPOSITION_RELS[self.type_of(rel_id)]
+                    kept = [r for r in refs_in(args[child_pos]) if r in ids]
+                    others = [r for i, a in enumerate(args) if i != child_pos for r in refs_in(a)]
+                    if kept and all(r in ids for r in others) and args[child_pos].startswith(b"("):
+                        args[child_pos] = b"(" + b",".join(b"#%d" % r for r in kept) + b")"
+                        rewritten[rel_id] = args
+        for product in products:
+            for rel_id in inverse["assignments"].get(product, []):
+                if rel_id in rewritten:
+                    continue
+                args = self.args(rel_id)
+                objects_pos = ASSIGNMENT_RELS[self.type_of(rel_id)][0]
+                kept = [r for r in refs_in(args[objects_pos]) if r in ids]
+                others = [r for i, a in enumerate(args) if i != objects_pos for r in refs_in(a)]
+                if kept and all(r in ids for r in others):
+                    args[objects_pos] = b"(" + b",".join(b"#%d" % r for r in kept) + b")"
+                    rewritten[rel_id] = args
+
+        return ids, rewritten
+
+    def write_stream(self, ids, f, rewritten=None):
+        """
+        ID集合を IFC として f（バイナリの書き込み先：ファイル・パイプ・BytesIO）に書き、バイト数を返す
+        行はIDの昇順（ファイル内の順）に読むので、ディスクに退避した集合もそのまま渡せる
+        """
+        rewritten = rewritten or {}
+        ordered = ids if isinstance(ids, DiskIdSet) else sorted(ids)
+        written = 0
+        last = None
+        for chunk in (self.header(), b"DATA;\n"):
+            written += f.write(chunk)
+        for entity_id in heapq.merge(ordered, sorted(rewritten)):
+            if entity_id == last:
+                continue
+            last = entity_id
+            if entity_id in rewritten:
+                line = b"#%d=%s(%s);" % (entity_id, self.type_of(entity_id).encode("ascii"), b",".join(rewritten[entity_id]))
+            else:
+                line = self.line(entity_id)
+            written += f.write(line + b"\n")
+        written += f.write(b"ENDSEC;\nEND-ISO-10303-21;\n")
+        return written
+
+    def write(self, ids, output_path, rewritten=None):
+        """
+        ID集合を新しい IFC として書き出し、書き込んだバイト数（圧縮前）を返す
+        拡張子が .gz / .ifczip なら圧縮して書く（open_output）
+        """
+        with open_output(output_path) as f:
+            return self.write_stream(ids, f, rewritten)
+
+    def extract_storey(self, storey_id, output, element_ids=None, budget=None):
+        """
+        1階層分を抽出して output（パス、またはバイナリの書き込み先）に書き、
+        (エンティティ数, 書き込んだバイト数（圧縮前）) を返す
+        budget を超えていれば書き出しの前に ID 集合をディスクに退避し、逆参照の表を手放す
+        （並べ替えたコピーを作らずに書け、逆参照の表は次の階層で作り直す）。予算超過で失敗はしない
+        """
+        ids, rewritten = self.collect(storey_id, element_ids, budget)
+        ids = self.spill_if_over(ids, budget)
+        try:
+            count = len(ids) + sum(1 for r in rewritten if r not in ids)
+            if hasattr(output, "write"):
+                written = self.write_stream(ids, output, rewritten)
+            else:
+                written = self.write(ids, output, rewritten)
+            return count, written
+        finally:
+            if isinstance(ids, DiskIdSet):
+                ids.close()
+
+
+def is_subtype(schema, type_name, parent):
+    """スキーマ定義から型の継承関係を判定（ファイルを開かずに使う）"""
+    import ifcopenshell.ifcopenshell_wrapper as wrapper
+
+    declaration = wrapper.schema_by_name(schema).declaration_by_name(type_name)
+    parent = parent.upper()
+    while declaration is not None:
+        if declaration.name().upper() == parent:
+            return True
+        declaration = declaration.supertype()
+    return False
+
+
+def schema_of(index):
+    """FILE_SCHEMA から スキーマ名を取得"""
+    m = re.search(rb"FILE_SCHEMA\s*\(\s*\(\s*'([^']+)'", index.header())
+    return m.group(1).decode("ascii").upper() if m else "IFC4"
@@ -0,0 +1,221 @@
+import json
+import math
+import multiprocessing
+import os
+import struct
+from array import array
+
+import ifcopenshell
+import ifcopenshell.geom
+
+# IfcConvert と同じく、空間・開口は形状にしない
+EXCLUDED_TYPES = ("IfcSpace", "IfcOpeningElement")
+
+
+class Mesh:
+    """1要素分の三角形メッシュ（ワールド座標・Z-up）"""
+
+    __slots__ = ("guid", "name", "ifc_type", "verts", "normals", "faces", "material_ids", "materials")
+
+    def __init__(self, guid, name, ifc_type, verts, normals, faces, material_ids, materials):
+        self.guid = guid
+        self.name = name
+        self.ifc_type = ifc_type
+        self.verts = verts
+        self.normals = normals
+        self.faces = faces
+        self.material_ids = material_ids
+        self.materials = materials
+
+
+def _material(m):
+    """ifcopenshell の material → (名前, RGBA)"""
+    r, g, b = m.diffuse if m.has_diffuse else (0.8, 0.8, 0.8)
+    alpha = 1.0
+    if m.has_transparency and not math.isnan(m.transparency):
+        alpha = 1.0 - m.transparency
+    return (m.name, (r, g, b, alpha))
+
+
+def tessellate(ifc_path, threads=None):
+    """
+    ifcopenshell.geom のイテレータで全要素を1回だけ三角形化する
+    （マルチスレッド）。結果は各フォーマットの書き出しで共有する
+    """
+    model = ifcopenshell.open(ifc_path)
+    settings = ifcopenshell.geom.settings()
+    settings.set(settings.USE_WORLD_COORDS, True)
+
+    meshes = []
+    iterator = ifcopenshell.geom.iterator(
+        settings, model, threads or multiprocessing.cpu_count(), exclude=EXCLUDED_TYPES
+    )
+    if iterator.initialize():
+        while True:
+            shape = iterator.get()
+            geom = shape.geometry
+            element = model.by_id(shape.id)
+            meshes.append(Mesh(
+                guid=shape.guid,
+                name=shape.name or element.is_a(),
+                ifc_type=shape.type,
+                verts=array("f", geom.verts),
+                normals=array("f", geom.normals),
+                faces=array("I", geom.faces),
+                material_ids=list(geom.material_ids),
+                materials=[_material(m) for m in geom.materials],
+            ))
+            if not iterator.next():
+                break
+    return meshes
+
+
+def _faces_by_material(mesh):
+    """マテリアルごとに三角形（頂点インデックス）をまとめる"""
+    groups = {}
+    for i, mat_id in enumerate(mesh.material_ids):
+        groups.setdefault(mat_id, array("I")).extend(mesh.faces[i * 3:i * 3 + 3])
+    if not mesh.material_ids and mesh.faces:
+        groups[-1] = array("I", mesh.faces)
+    return groups
+
+
+# ---------------------------
+# glTF (GLB)
+# ---------------------------
+def _to_y_up(values):
+    """Z-up → Y-up（glTF の座標系）"""
+    out = array("f", values)
+    out[1::3], out[2::3] = values[2::3], array("f", (-v for v in values[1::3]))
+    return out
+
+
+def write_glb(meshes, path):
+    """メッシュ一覧を GLB として保存し、書き込んだバイト数を返す"""
+    buffer = bytearray()
+    buffer_views, accessors, gltf_meshes, nodes, materials = [], [], [], [], []
+    material_index = {}
+
+    def add_view(data, target):
+        while len(buffer) % 4:
+            buffer.append(0)
+        buffer_views.append({"buffer": 0, "byteOffset": len(buffer), "byteLength": len(data), "target": target})
+        buffer.extend(data)
+        return len(buffer_views) - 1
+
+    def add_accessor(view, component_type, count, type_, **extra):
+        accessors.append({"bufferView": view, "componentType": component_type, "count": count, "type": type_, **extra})
+        return len(accessors) - 1
+
+    def get_material(material):
+        key = (material[0], tuple(material[1]))
+        if key not in material_index:
+            rgba = list(material[1])
+            entry = {
+                "name": material[0] or f"Material_{len(materials)}",
+                "pbrMetallicRoughness": {"baseColorFactor": rgba, "metallicFactor": 0.0, "roughnessFactor": 1.0},
+                "doubleSided": True,
+            }
+            if rgba[3] < 1.0:
+                entry["alphaMode"] = "BLEND"
+            materials.append(entry)
+            material_index[key] = len(materials) - 1
+        return material_index[key]
+
+    for mesh in meshes:
+        if not mesh.faces:
+            continue
+        positions = _to_y_up(mesh.verts)
+        xs, ys, zs = positions[0::3], positions[1::3], positions[2::3]
+        position_accessor = add_accessor(
+            add_view(positions.tobytes(), 34962), 5126, len(positions) // 3, "VEC3",
+            min=[min(xs), min(ys), min(zs)], max=[max(xs), max(ys), max(zs)],
+        )
+        attributes = {"POSITION": position_accessor}
+        if len(mesh.normals) == len(mesh.verts):
+            normals = _to_y_up(mesh.normals)
+            attributes["NORMAL"] = add_accessor(add_view(normals.tobytes(), 34962), 5126, len(normals) // 3, "VEC3")
+
+        primitives = []
+        for mat_id, indices in _faces_by_material(mesh).items():
+            primitive = {
+                "attributes": attributes,
+                "indices": add_accessor(add_view(indices.tobytes(), 34963), 5125, len(indices), "SCALAR"),
+            }
+            if 0 <= mat_id < len(mesh.materials):
+                primitive["material"] = get_material(mesh.materials[mat_id])
+            primitives.append(primitive)
+
+        gltf_meshes.append({"name": mesh.guid, "primitives": primitives})
+        nodes.append({"name": mesh.name, "mesh": len(gltf_meshes) - 1, "extras": {"guid": mesh.guid, "type": mesh.ifc_type}})
+
+    while len(buffer) % 4:
+        buffer.append(0)
+
+    gltf = {
+        "asset": {"version": "2.0", "generator": "ifcconvert mesh_export"},
+        "scene": 0,
+        "scenes": [{"nodes": list(range(len(nodes)))}],
+        "nodes": nodes,
+        "meshes": gltf_meshes,
+        "materials": materials,
+        "accessors": accessors,
+        "bufferViews": buffer_views,
+        "buffers": [{"byteLength": len(buffer)}],
+    }
+    json_chunk = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+    json_chunk += b" " * (-len(json_chunk) % 4)
+
+    total = 12 + 8 + len(json_chunk) + 8 + len(buffer)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<4sII", b"glTF", 2, total))
+        f.write(struct.pack("<I4s", len(json_chunk), b"JSON"))
+        f.write(json_chunk)
+        f.write(struct.pack("<I4s", len(buffer), b"BIN\0"))
+        f.write(buffer)
+    return total
+
+
+# ---------------------------
+# OBJ (+ MTL)
+# ---------------------------
+def write_obj(meshes, path):
+    """メッシュ一覧を OBJ / MTL として保存し、書き込んだバイト数を返す"""
+    mtl_path = os.path.splitext(path)[0] + ".mtl"
+    material_names = {}
+
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        written += f.write(f"mtllib {os.path.basename(mtl_path)}\n")
+        offset = 1
+        for mesh in meshes:
+            if not mesh.faces:
+                continue
+            written += f.write(f"o {mesh.guid}\n")
+            v = mesh.verts
+            written += f.write("".join(f"v {v[i]:.6f} {v[i + 1]:.6f} {v[i + 2]:.6f}\n" for i in range(0, len(v), 3)))
+
+            for mat_id, indices in _faces_by_material(mesh).items():
+                if 0 <= mat_id < len(mesh.materials):
+                    material = mesh.materials[mat_id]
+                    key = (material[0], tuple(material[1]))
+                    if key not in material_names:
+                        material_names[key] = f"mat_{len(material_names)}"
+                    written += f.write(f"usemtl {material_names[key]}\n")
+                written += f.write("".join(
+                    f"f {indices[i] + offset} {indices[i + 1] + offset} {indices[i + 2] + offset}\n"
+                    for i in range(0, len(indices), 3)
+                ))
+            offset += len(v) // 3
+
+    with open(mtl_path, "w", encoding="utf-8") as f:
+        for (_, (r, g, b, a)), name in material_names.items():
+            written += f.write(f"newmtl {name}\nKd {r:.4f} {g:.4f} {b:.4f}\nd {a:.4f}\n\n")
+    return written
+
+
+# キャッシュ済みメッシュから書き出せるフォーマット
+WRITERS = {
+    "glb": write_glb,
+    "obj": write_obj,
+}
@@ -0,0 +1,110 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+# 変換ジョブの投入制御（ワーカー間で共有するため Django キャッシュ＝Redis に置く）
+#   - 同じ内容・オプションの実行中ジョブには相乗りする
+#   - 小さいジョブ・対話的な要求を先に処理する（Celery の Redis 優先度：0 が最優先）
+#   - テナントごとに同時実行ジョブ数を制限する（空きがなければタスクを後で再試行）
+#   - 実行中ジョブの階層タスクを新しいジョブより先に処理する
+PREFIX = "ifcsched"
+
+# 実行中ジョブの登録の保持期間（ワーカーが落ちても登録が残り続けないように）
+INFLIGHT_TTL = getattr(settings, "IFC_SCHED_INFLIGHT_TTL", 6 * 60 * 60)
+
+# テナントあたりの同時実行ジョブ数と、空きがないときの再試行間隔（秒）
+TENANT_MAX_JOBS = getattr(settings, "IFC_TENANT_MAX_JOBS", 2)
+TENANT_RETRY_SECONDS = getattr(settings, "IFC_TENANT_RETRY_SECONDS", 15)
+
+# ファイルサイズ → 優先度（小さいほど先）
+PRIORITY_STEPS = (
+    (10 * 1024 ** 2, 2),
+    (100 * 1024 ** 2, 4),
+    (1024 ** 3, 6),
+)
+LOWEST_PRIORITY = 8
+# 対話的な要求（画面からの変換）は一段上げる
+INTERACTIVE_BOOST = 1
+# 実行中ジョブの階層タスクは同じ大きさの新しいジョブより先に
+STOREY_BOOST = 2
+
+
+def job_key(content_key, **options):
+    """内容（ハッシュなど）と変換オプションから、相乗りの判定に使うキーを作る"""
+    parts = [str(content_key)] + [f"{name}={options[name]}" for name in sorted(options)]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _inflight_key(key):
+    return f"{PREFIX}:inflight:{key}"
+
+
+def _tenant_key(tenant):
+    return f"{PREFIX}:tenant:{tenant}:running"
+
+
+def claim(key, job_id):
+    """
+    job_id を key の実行中ジョブとして登録する
+    すでに実行中のジョブがあればそのジョブID を返す（登録できたら None）
+    """
+    while not cache.add(_inflight_key(key), job_id, INFLIGHT_TTL):
+        existing = cache.get(_inflight_key(key))
+        if existing is not None:
+            return existing
+    return None
+
+
+def release(key, job_id):
+    """ジョブ終了時に登録を消す（別のジョブに置き換わっていれば消さない）"""
+    if key and cache.get(_inflight_key(key)) == job_id:
+        cache.delete(_inflight_key(key))
+
+
+def tenant_of(request):
+    """ログインユーザー、なければ接続元アドレスをテナントとする"""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return f"addr:{request.META.get('REMOTE_ADDR', 'unknown')}"
+
+
+def priority_for(size, interactive=True):
+    priority = LOWEST_PRIORITY
+    for max_size, step in PRIORITY_STEPS:
+        if size < max_size:
+            priority = step
+            break
+    return max(priority - (INTERACTIVE_BOOST if interactive else 0), 0)
+
+
+def storey_priority(priority):
+    return max(priority - STOREY_BOOST, 0)
+
+
+def acquire_slot(tenant, max_jobs=TENANT_MAX_JOBS):
+    """テナントの実行枠を1つ取る（redis の INCR で原子的。上限を超えたら戻して False）"""
+    if not tenant:
+        return True
+    key = _tenant_key(tenant)
+    cache.add(key, 0, INFLIGHT_TTL)
+    try:
+        running = cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, INFLIGHT_TTL)
+        running = 1
+    if running > max_jobs:
+        cache.decr(key)
+        return False
+    return True
+
+
+def release_slot(tenant):
+    if not tenant:
+        return
+    try:
+        if cache.decr(_tenant_key(tenant)) < 0:
+            cache.set(_tenant_key(tenant), 0, INFLIGHT_TTL)
+    except ValueError:
+        pass
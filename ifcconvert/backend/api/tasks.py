@@ -1,32 +1,114 @@
 import os
+import shutil
 import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import ifcopenshell
 from celery import shared_task
 from django.conf import settings
+from ifc_common.content_store import ContentStore
+from .mesh_export import WRITERS, tessellate
+from . import scheduler
 
-@shared_task
-def convert_ifc_task(ifc_path, output_basename):
+SUPPORTED_FORMATS = ("glb", "obj", "fbx")
+# 指定がないときのフォーマット
+# fbx はキャッシュ済みメッシュから書き出せず IfcConvert でもう一度三角形化するので、明示したときだけ
+DEFAULT_FORMATS = ("glb", "obj")
+
+# 変換結果のキャッシュキーに含めるバージョン
+CONVERTER_VERSION = f"ifcopenshell-{ifcopenshell.version}/mesh_export-2"
+
+# アップロードと変換結果をハッシュをキーに保存
+content_store = ContentStore(kinds=("uploads", "converted"))
+
+
+def output_basename_for(file_hash):
+    """変換結果のファイル名：(ファイルハッシュ, 変換バージョン) のハッシュ"""
+    return content_store.key(file_hash, CONVERTER_VERSION)
+
+
+def output_urls(output_basename, formats):
+    result = {}
+    for fmt in formats:
+        key = "gltf" if fmt == "glb" else fmt
+        result[key] = f"/media/converted/{output_basename}.{fmt}"
+    return result
+
+# 三角形化のスレッド数（未設定なら CPU 数）
+TESSELLATION_THREADS = getattr(settings, "IFC_TESSELLATION_THREADS", None)
+
+
+def _run_ifcconvert(ifc_path, output_name, fmt):
+    """キャッシュ済みメッシュから書き出せないフォーマット（fbx）は IfcConvert で変換"""
+    cmd = [
+        "docker", "exec", "ifcopenshell", "IfcConvert",
+        f"/media/{ifc_path}", f"/media/converted/{output_name}.{fmt}",
+    ]
+    subprocess.run(cmd, check=True)
+
+
+@shared_task(bind=True)
+def convert_ifc_task(self, ifc_path, output_basename, formats=DEFAULT_FORMATS, tenant=None, job_key=None):
+    """
+    テナントの実行枠が空くまで待ち（再試行）、変換後に実行中ジョブの登録を消す
+    同じ job_key の要求はこのタスクの完了まで相乗りする
+    """
+    if not scheduler.acquire_slot(tenant):
+        raise self.retry(countdown=scheduler.TENANT_RETRY_SECONDS, max_retries=None)
+    try:
+        return _convert_ifc(ifc_path, output_basename, formats)
+    finally:
+        scheduler.release_slot(tenant)
+        scheduler.release(job_key, self.request.id)
+
+
+def _convert_ifc(ifc_path, output_basename, formats):
+    """
+    形状の三角形化は1回だけ行い、指定フォーマットをまとめて書き出す
+    書き出しは一時ディレクトリで行い、完成したファイルだけをキャッシュに置く
+    """
     media_dir = settings.MEDIA_ROOT
     output_dir = os.path.join(media_dir, "converted")
     os.makedirs(output_dir, exist_ok=True)
 
     ifc_full = os.path.join(media_dir, ifc_path)
+    formats = [f for f in SUPPORTED_FORMATS if f in formats]
+    timings = {}
+    work_dir = tempfile.mkdtemp(dir=output_dir, prefix=".tmp-")
+    work_name = os.path.basename(work_dir)
 
-    gltf_path = os.path.join(output_dir, f"{output_basename}.glb")
-    obj_path = os.path.join(output_dir, f"{output_basename}.obj")
-    fbx_path = os.path.join(output_dir, f"{output_basename}.fbx")
-
-    docker_cmd = "docker exec ifcopenshell IfcConvert"
+    def run_ifcconvert(fmt):
+        t0 = time.perf_counter()
+        _run_ifcconvert(ifc_path, f"{work_name}/{output_basename}", fmt)
+        timings[fmt] = time.perf_counter() - t0
 
     try:
-        subprocess.run(f"{docker_cmd} /media/{ifc_path} /media/converted/{output_basename}.glb", shell=True, check=True)
-        subprocess.run(f"{docker_cmd} /media/{ifc_path} /media/converted/{output_basename}.obj", shell=True, check=True)
-        subprocess.run(f"{docker_cmd} /media/{ifc_path} /media/converted/{output_basename}.fbx", shell=True, check=True)
-    except subprocess.CalledProcessError as e:
+        # IfcConvert（別プロセス）で書くフォーマットは先に始めて、三角形化・書き出しと並行して待つ
+        # glb / obj の書き出しは Python の処理（GIL）なのでスレッドに分けず順に行う
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            external = [pool.submit(run_ifcconvert, fmt) for fmt in formats if fmt not in WRITERS]
+
+            if any(f in WRITERS for f in formats):
+                t0 = time.perf_counter()
+                meshes = tessellate(ifc_full, TESSELLATION_THREADS)
+                timings["tessellate"] = time.perf_counter() - t0
+
+            for fmt in formats:
+                if fmt in WRITERS:
+                    t0 = time.perf_counter()
+                    WRITERS[fmt](meshes, os.path.join(work_dir, f"{output_basename}.{fmt}"))
+                    timings[fmt] = time.perf_counter() - t0
+
+            for future in external:
+                future.result()
+
+        for name in os.listdir(work_dir):
+            os.replace(os.path.join(work_dir, name), os.path.join(output_dir, name))
+    except (subprocess.CalledProcessError, RuntimeError, OSError) as e:
         return {"status": "error", "message": str(e)}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
-    return {
-        "status": "success",
-        "gltf": f"/media/converted/{output_basename}.glb",
-        "obj": f"/media/converted/{output_basename}.obj",
-        "fbx": f"/media/converted/{output_basename}.fbx",
-    }
+    content_store.evict()
+    return {"status": "success", "timings": timings, **output_urls(output_basename, formats)}
@@ -1,8 +1,16 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.core.files.storage import default_storage
-from .tasks import convert_ifc_task
+from .tasks import (
+    DEFAULT_FORMATS,
+    SUPPORTED_FORMATS,
+    content_store,
+    convert_ifc_task,
+    output_basename_for,
+    output_urls,
+)
+from . import scheduler
 import os
+import uuid
 
 class ConvertIFCView(APIView):
     def post(self, request):
@@ -10,8 +18,41 @@ class ConvertIFCView(APIView):
         if not ifc_file:
             return Response({"error": "No IFC file provided"}, status=400)
 
-        filename = default_storage.save(f"uploads/{ifc_file.name}", ifc_file)
-        basename, _ = os.path.splitext(os.path.basename(filename))
+        # 出力フォーマットの指定（例: formats=glb,obj,fbx）。未指定なら glb・obj
+        formats = request.data.get("formats")
+        formats = [f.strip().lower() for f in formats.split(",")] if formats else list(DEFAULT_FORMATS)
+        unknown = [f for f in formats if f not in SUPPORTED_FORMATS]
+        if unknown:
+            return Response({"error": f"Unsupported formats: {', '.join(unknown)}"}, status=400)
 
-        task = convert_ifc_task.delay(filename, basename)
-        return Response({"task_id": task.id}, status=202)
+        # 受信しながらハッシュを計算し、内容のハッシュをファイル名にして保存
+        file_hash, upload_path, _ = content_store.save_stream(ifc_file.chunks(), "uploads", ".ifc")
+        filename = os.path.relpath(upload_path, content_store.root)
+        basename = output_basename_for(file_hash)
+
+        # 変換済みのフォーマットはそのまま返し、足りないものだけ変換する
+        missing = [
+            fmt for fmt in formats
+            if not content_store.hit(content_store.path("converted", basename, f".{fmt}"))
+        ]
+        if not missing:
+            return Response({"status": "success", "cached": True, **output_urls(basename, formats)})
+
+        cached = [f for f in formats if f not in missing]
+
+        # 同じ内容・同じフォーマットの変換が実行中ならそのタスクに相乗りする
+        key = scheduler.job_key(file_hash, formats=",".join(sorted(missing)))
+        task_id = uuid.uuid4().hex
+        existing = scheduler.claim(key, task_id)
+        if existing is not None:
+            return Response({"task_id": existing, "coalesced": True, "cached": cached}, status=202)
+
+        # 小さいファイル・画面からの要求を先に（batch=1 はまとめて流す変換）
+        interactive = not request.data.get("batch")
+        convert_ifc_task.apply_async(
+            (filename, basename, missing),
+            {"tenant": scheduler.tenant_of(request), "job_key": key},
+            task_id=task_id,
+            priority=scheduler.priority_for(ifc_file.size, interactive),
+        )
+        return Response({"task_id": task_id, "cached": cached}, status=202)
@@ -1,39 +1,30 @@
 # ifc_splitter.py
-import ifcopenshell
-import ifcopenshell.api
 from pathlib import Path
+from ifc_common.step_index import StepIndex
 
 def split_ifc_by_storey(ifc_path: str, output_dir: str):
     """
     IFCを階層ごとに自動分割する
     例: floor1.ifc, floor2.ifc, floor3.ifc
+    オフセット索引から各階層の参照クロージャに含まれる行だけを読み込む
     """
-    file = ifcopenshell.open(ifc_path)
-    storeys = file.by_type("IfcBuildingStorey")
+    index = StepIndex.open(ifc_path)
 
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
     output_files = []
 
-    for storey in storeys:
-        storey_name = storey.Name or "UnknownStorey"
-        storey_name = storey_name.replace(" ", "_")
-        new_file = ifcopenshell.file(schema=file.schema)
-
-        # Storey内の要素を取得
-        related_elements = []
-        for rel in file.get_inverse(storey):
-            if rel.is_a("IfcRelContainedInSpatialStructure"):
-                related_elements.extend(rel.RelatedElements)
-
-        # Storey自体とその要素をコピー
-        new_file.add(storey)
-        for elem in related_elements:
-            new_file.add(elem)
-
-        output_path = output_dir / f"{storey_name}.ifc"
-        new_file.write(str(output_path))
-        output_files.append(str(output_path))
+    try:
+        for storey_id, _, storey_name in index.storeys():
+            storey_name = storey_name or "UnknownStorey"
+            storey_name = storey_name.replace(" ", "_")
+
+            # Storey自体とその要素（分解構造・タイプ・材料・スタイル）をコピー
+            output_path = output_dir / f"{storey_name}.ifc"
+            index.extract_storey(storey_id, output_path)
+            output_files.append(str(output_path))
+    finally:
+        index.close()
 
     return output_files
@@ -0,0 +1,84 @@
+# model_cache.py
+import os
+import threading
+from collections import OrderedDict
+
+import ifcopenshell
+from django.conf import settings
+
+# パース済みモデルのメモリ見積もり（ファイルサイズ × 係数）
+MEMORY_FACTOR = getattr(settings, "IFC_MODEL_CACHE_MEMORY_FACTOR", 8)
+# ワーカープロセスあたりのキャッシュ上限
+MAX_BYTES = getattr(settings, "IFC_MODEL_CACHE_MAX_BYTES", 4 * 1024 ** 3)
+
+
+class ModelCache:
+    """
+    ワーカープロセス単位の LRU キャッシュ（パス + mtime + サイズ がキー）
+    同じワーカーに来た同一ファイルの階層タスクで1回のパースを共有する
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, memory_factor=MEMORY_FACTOR):
+        self.max_bytes = max_bytes
+        self.memory_factor = memory_factor
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(path):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path):
+        """(model, {GlobalId: storey}) を返す"""
+        key = self.make_key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["model"], entry["storeys"]
+            self.misses += 1
+
+        model = ifcopenshell.open(path)
+        storeys = {s.GlobalId: s for s in model.by_type("IfcBuildingStorey")}
+        size = key[2] * self.memory_factor
+
+        with self._lock:
+            # 同じパスの古いリビジョンは破棄
+            for old_key in [k for k in self._entries if k[0] == key[0]]:
+                self._evict(old_key)
+            if size <= self.max_bytes:
+                while self._entries and self.current_bytes + size > self.max_bytes:
+                    self._evict(next(iter(self._entries)))
+                self._entries[key] = {"model": model, "storeys": storeys, "size": size}
+                self.current_bytes += size
+        return model, storeys
+
+    def _evict(self, key):
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry["size"]
+        self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        return {
+            "pid": os.getpid(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+        }
+
+
+# ワーカープロセスごとに1つ（prefork の子プロセスはそれぞれ空の状態から始まる）
+model_cache = ModelCache()
@@ -0,0 +1,180 @@
+import json
+import os
+import struct
+import tempfile
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+
+# IfcBuildingStorey の Elevation 属性の位置
+ELEVATION_POS = 9
+
+# glTF のプリミティブモード（TRIANGLES）
+TRIANGLES = 4
+
+IDENTITY = (1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0)
+
+
+def media_url(path):
+    relative = Path(path).relative_to(settings.MEDIA_ROOT).as_posix()
+    return f"{settings.MEDIA_URL}{relative}"
+
+
+# ---------------------------
+# 分割時：索引から分かる情報
+# ---------------------------
+def storey_summary(index, storey_id):
+    """階層の標高と、分解構造に含まれる要素数（型ごと）"""
+    args = index.args(storey_id)
+    try:
+        elevation = float(args[ELEVATION_POS])
+    except (IndexError, ValueError):
+        elevation = None
+
+    children = index._inverse_maps()["children"]
+    counts = Counter()
+    seen = {storey_id}
+    stack = list(children.get(storey_id, []))
+    while stack:
+        entity_id = stack.pop()
+        if entity_id in seen:
+            continue
+        seen.add(entity_id)
+        counts[index.type_of(entity_id)] += 1
+        stack.extend(children.get(entity_id, []))
+
+    return {"elevation": elevation, "elements": sum(counts.values()), "element_counts": dict(counts)}
+
+
+def storey_summaries(index):
+    """{GlobalId: {"storey"（階層名）, "elevation", "elements", "element_counts"}}（階層名は重複しうる）"""
+    return {
+        global_id: {"storey": name, **storey_summary(index, storey_id)}
+        for storey_id, global_id, name in index.storeys()
+    }
+
+
+# ---------------------------
+# 変換後：GLB から分かる情報
+# ---------------------------
+def read_glb_json(path):
+    """GLB の JSON チャンクだけを読む（バイナリ部分は読まない）"""
+    with open(path, "rb") as f:
+        magic, _, _ = struct.unpack("<4sII", f.read(12))
+        if magic != b"glTF":
+            raise ValueError(f"Not a GLB file: {path}")
+        length, chunk_type = struct.unpack("<I4s", f.read(8))
+        if chunk_type != b"JSON":
+            raise ValueError(f"GLB without JSON chunk: {path}")
+        return json.loads(f.read(length))
+
+
+def _multiply(a, b):
+    """列優先 4x4 行列の積 a * b"""
+    return tuple(
+        sum(a[k * 4 + row] * b[col * 4 + k] for k in range(4))
+        for col in range(4) for row in range(4)
+    )
+
+
+def _node_matrix(node):
+    if "matrix" in node:
+        return tuple(node["matrix"])
+    tx, ty, tz = node.get("translation", (0.0, 0.0, 0.0))
+    x, y, z, w = node.get("rotation", (0.0, 0.0, 0.0, 1.0))
+    sx, sy, sz = node.get("scale", (1.0, 1.0, 1.0))
+    return (
+        (1 - 2 * (y * y + z * z)) * sx, (2 * (x * y + z * w)) * sx, (2 * (x * z - y * w)) * sx, 0.0,
+        (2 * (x * y - z * w)) * sy, (1 - 2 * (x * x + z * z)) * sy, (2 * (y * z + x * w)) * sy, 0.0,
+        (2 * (x * z + y * w)) * sz, (2 * (y * z - x * w)) * sz, (1 - 2 * (x * x + y * y)) * sz, 0.0,
+        tx, ty, tz, 1.0,
+    )
+
+
+def _transform(m, p):
+    x, y, z = p
+    return (
+        m[0] * x + m[4] * y + m[8] * z + m[12],
+        m[1] * x + m[5] * y + m[9] * z + m[13],
+        m[2] * x + m[6] * y + m[10] * z + m[14],
+    )
+
+
+def glb_stats(path):
+    """
+    GLB のワールド座標のバウンディングボックス（glTF の Y-up）・三角形数・バイト数
+    POSITION アクセサの min/max をノードの変換で移して合成する
+    """
+    gltf = read_glb_json(path)
+    nodes = gltf.get("nodes", [])
+    meshes = gltf.get("meshes", [])
+    accessors = gltf.get("accessors", [])
+
+    lo = [float("inf")] * 3
+    hi = [float("-inf")] * 3
+    triangles = 0
+
+    scenes = gltf.get("scenes")
+    roots = scenes[gltf.get("scene", 0)].get("nodes", []) if scenes else range(len(nodes))
+    stack = [(n, IDENTITY) for n in roots]
+    while stack:
+        node_index, parent = stack.pop()
+        node = nodes[node_index]
+        matrix = _multiply(parent, _node_matrix(node))
+        stack.extend((child, matrix) for child in node.get("children", []))
+        if "mesh" not in node:
+            continue
+
+        for primitive in meshes[node["mesh"]].get("primitives", []):
+            position = accessors[primitive["attributes"]["POSITION"]]
+            if primitive.get("mode", TRIANGLES) == TRIANGLES:
+                count = accessors[primitive["indices"]]["count"] if "indices" in primitive else position["count"]
+                triangles += count // 3
+            if "min" not in position or "max" not in position:
+                continue
+            (x0, y0, z0), (x1, y1, z1) = position["min"], position["max"]
+            for corner in ((x, y, z) for x in (x0, x1) for y in (y0, y1) for z in (z0, z1)):
+                for axis, value in enumerate(_transform(matrix, corner)):
+                    lo[axis] = min(lo[axis], value)
+                    hi[axis] = max(hi[axis], value)
+
+    bbox = {"min": lo, "max": hi} if lo[0] <= hi[0] else None
+    return {"bbox": bbox, "triangles": triangles, "bytes": os.path.getsize(path)}
+
+
+# ---------------------------
+# マニフェスト
+# ---------------------------
+def manifest_path(output_dir, job_id):
+    return Path(output_dir) / f"{job_id}.manifest.json"
+
+
+def write_manifest(path, manifest):
+    """一時ファイルに書いてから置き換える（読み込み中の閲覧側が壊れたJSONを見ないように）"""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return path
+
+
+def build_manifest(job_id, summaries, results=None, status="converting"):
+    """
+    階層ごとのマニフェスト（標高の低い順）
+    results（変換結果）があれば GLB の URL・バウンディングボックス・三角形数・バイト数を含める
+    """
+    results = {r["global_id"]: r for r in results or []}
+    storeys = []
+    for global_id, summary in summaries.items():
+        result = results.get(global_id, {})
+        entry = {"global_id": global_id, **summary, "status": "pending", "glb": None}
+        if result.get("glb"):
+            entry.update(status="success", glb=media_url(result["glb"]), **result.get("stats", {}))
+        elif result:
+            entry.update(status="failed", error=result.get("error"))
+        storeys.append(entry)
+
+    storeys.sort(key=lambda s: (s["elevation"] is None, s["elevation"] or 0.0, s["storey"] or "", s["global_id"]))
+    return {"job_id": job_id, "status": status, "storeys": storeys}
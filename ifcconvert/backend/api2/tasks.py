@@ -1,54 +1,220 @@
-from celery import shared_task, group
+from celery import shared_task, group, chord
+from django.conf import settings
 import ifcopenshell
-import subprocess
+import ifcopenshell.util.element
+import io
 import os
 from pathlib import Path
+from ifc_common.step_index import MemoryBudget, StepIndex
+from .model_cache import model_cache
+from .storey_manifest import build_manifest, glb_stats, manifest_path, media_url, storey_summaries, write_manifest
+from ifc_common import converter_service, progress
+from api import scheduler
 
+# このサイズ以上の IFC は全体を開かず、オフセット索引から部分抽出する
+PARTIAL_READ_MIN_BYTES = getattr(settings, "IFC_PARTIAL_READ_MIN_BYTES", 100 * 1024 * 1024)
 
-@shared_task
-def convert_storey(ifc_path, storey_name, output_dir):
+# 大規模モデル：このサイズ以上のジョブは heavy キュー（1ジョブごとにプロセスを入れ替えるワーカー）で処理する
+LARGE_MODEL_MIN_BYTES = getattr(settings, "IFC_LARGE_MODEL_MIN_BYTES", 1024 ** 3)
+HEAVY_QUEUE = getattr(settings, "IFC_HEAVY_QUEUE", "heavy")
+
+# 元の IFC がこのサイズ未満なら、階層 IFC をファイルに書かずにメモリ上で変換サービスに渡す
+IN_MEMORY_HANDOFF_MAX_BYTES = getattr(settings, "IFC_IN_MEMORY_HANDOFF_MAX_BYTES", 512 * 1024 * 1024)
+
+# 抽出中の RSS の上限（超えたらクロージャをディスクに退避する。超えても失敗にはしない）
+MEMORY_BUDGET_BYTES = getattr(settings, "IFC_MEMORY_BUDGET_BYTES", 4 * 1024 ** 3)
+
+
+def routing_options(ifc_path):
+    """アップロードのサイズで投入先キューを決める（大きいジョブで小さいジョブを待たせない）"""
+    if os.path.getsize(ifc_path) >= LARGE_MODEL_MIN_BYTES:
+        return {"queue": HEAVY_QUEUE}
+    return {}
+
+
+def extract_storey_partial(ifc_path, storey_name, output, global_id=None):
     """
-    特定の階層(IFC BuildingStorey)を部分変換
+    オフセット索引から指定階層の参照クロージャだけを読み込んで output（パスまたは書き込み先）に書く
+    global_id を指定すると階層名ではなく GlobalId で選ぶ
     """
-    model = ifcopenshell.open(ifc_path)
-    storeys = model.by_type("IfcBuildingStorey")
-    target = next((s for s in storeys if s.Name == storey_name), None)
+    index = StepIndex.open(ifc_path)
+    try:
+        storey_id = index.find_storey(name=storey_name, global_id=global_id)
+        if storey_id is None:
+            raise ValueError(f"Storey '{global_id or storey_name}' not found in IFC")
+        index.extract_storey(storey_id, output, budget=MemoryBudget(MEMORY_BUDGET_BYTES))
+    finally:
+        index.close()
+
+
+def extract_storey_full(ifc_path, storey_name, output, global_id=None):
+    """IFC 全体を開いて指定階層を output（パスまたは書き込み先）に書く（パース結果はワーカー内でキャッシュ）"""
+    model, storeys = model_cache.get(ifc_path)
+    if global_id is not None:
+        target = storeys.get(global_id)
+    else:
+        target = next((s for s in storeys.values() if s.Name == storey_name), None)
     if not target:
-        raise ValueError(f"Storey '{storey_name}' not found in IFC")
+        raise ValueError(f"Storey '{global_id or storey_name}' not found in IFC")
 
     # 新しい IFCファイルを作成
     new_model = ifcopenshell.file(schema=model.schema)
-    related = model.get_decomposition(target)
+    new_model.add(target)
+    related = ifcopenshell.util.element.get_decomposition(target)
     for e in related:
         new_model.add(e)
 
-    tmp_ifc = Path(output_dir) / f"{storey_name}.ifc"
-    new_model.write(str(tmp_ifc))
+    if hasattr(output, "write"):
+        output.write(new_model.to_string().encode("utf-8"))
+    else:
+        new_model.write(str(output))
 
-    # IfcConvert 実行
+
+def _convert_storey(ifc_path, storey_name, output_dir, global_id=None):
+    """
+    階層を抽出して常駐変換サービスで GLB に変換し、(GLB のパス, 受け渡しの情報) を返す
+    小さいモデルは中間 IFC をディスクに書かず、バイト列のまま変換サービスに送る
+    global_id を指定すると GlobalId で階層を選び、出力のファイル名にも使う（同名の階層があっても上書きしない）
+    """
+    tmp_ifc = Path(output_dir) / f"{global_id or storey_name}.ifc"
     glb_path = tmp_ifc.with_suffix(".glb")
-    cmd = ["IfcConvert", str(tmp_ifc), str(glb_path)]
-    subprocess.run(cmd, check=True)
+    size = os.path.getsize(ifc_path)
+    extract = extract_storey_partial if size >= PARTIAL_READ_MIN_BYTES else extract_storey_full
+
+    if size < IN_MEMORY_HANDOFF_MAX_BYTES:
+        buffer = io.BytesIO()
+        extract(ifc_path, storey_name, buffer, global_id)
+        data = buffer.getvalue()
+        converter_service.convert(tmp_ifc, glb_path, data=data)
+        # 中間ファイルに書かずに済んだバイト数（変換側の読み直しも不要）
+        return str(glb_path), {"mode": "memory", "ifc_bytes": len(data), "disk_bytes_saved": len(data)}
+
+    extract(ifc_path, storey_name, tmp_ifc, global_id)
+    converter_service.convert(tmp_ifc, glb_path)
+    return str(glb_path), {"mode": "file", "ifc_bytes": tmp_ifc.stat().st_size, "disk_bytes_saved": 0}
+
+
+@shared_task
+def convert_storey(ifc_path, storey_name, output_dir, job_id=None, global_id=None):
+    """
+    特定の階層(IFC BuildingStorey)を部分変換
+    job_id 付きの場合は失敗しても例外にせず、chord の集約タスクに結果を渡す
+    ジョブの階層は GlobalId（global_id）で選び、進捗・結果も GlobalId で記録する
+    """
+    if job_id is None:
+        glb_path, handoff = _convert_storey(ifc_path, storey_name, output_dir, global_id)
+        return {"glb": glb_path, "handoff": handoff, "model_cache": model_cache.stats()}
+
+    key = global_id or storey_name
+    progress.set_storey_status(job_id, key, "running", storey=storey_name)
+    try:
+        glb_path, handoff = _convert_storey(ifc_path, storey_name, output_dir, global_id)
+        # 閲覧側が表示範囲・優先度で読み込む階層を選べるように
+        stats = glb_stats(glb_path)
+    except Exception as e:
+        progress.set_storey_status(job_id, key, "failed", storey=storey_name, error=str(e))
+        return {"global_id": key, "storey": storey_name, "glb": None, "error": str(e)}
+
+    progress.set_storey_status(job_id, key, "success", storey=storey_name, glb=media_url(glb_path), handoff=handoff,
+                               **stats)
+    return {
+        "global_id": key, "storey": storey_name, "glb": glb_path, "stats": stats, "handoff": handoff,
+        "model_cache": model_cache.stats(),
+    }
+
 
-    return str(glb_path)
+def _finish(job_id, tenant, job_key):
+    """テナントの実行枠を返し、実行中ジョブの登録を消す"""
+    scheduler.release_slot(tenant)
+    scheduler.release(job_key, job_id)
 
 
 @shared_task
-def split_and_convert_all(ifc_path, output_dir):
+def finalize_conversion(results, job_id, output_dir, summaries, tenant=None, job_key=None):
     """
-    IFCを階層ごとに分割 → 各階層を並列変換
+    chord の集約タスク：全階層の変換結果をまとめてジョブを完了にする
+    分割時に書いたマニフェストに GLB の情報を加えて書き直す
     """
+    glb_files = [r["glb"] for r in results if r.get("glb")]
+    failed = [r["global_id"] for r in results if not r.get("glb")]
+    disk_bytes_saved = sum(r["handoff"]["disk_bytes_saved"] for r in results if r.get("handoff"))
+
+    if not failed:
+        status = "success"
+    elif glb_files:
+        status = "partial"
+    else:
+        status = "failed"
+
+    try:
+        manifest = build_manifest(job_id, summaries, results, status)
+        write_manifest(manifest_path(output_dir, job_id), manifest)
+        progress.set_result(job_id, manifest)
+        progress.update_job(job_id, status=status, glb_files=glb_files, failed=failed, disk_bytes_saved=disk_bytes_saved)
+    finally:
+        _finish(job_id, tenant, job_key)
+    return {"job_id": job_id, "status": status, "glb_files": glb_files, "failed": failed}
+
+
+@shared_task
+def abort_conversion(request, exc, traceback, job_id, tenant=None, job_key=None):
+    """
+    chord の errback：階層タスクのワーカーが落ちる・時間切れなどで集約タスクが呼ばれないとき
+    ジョブを失敗にして、テナントの実行枠と実行中ジョブの登録を返す
+    """
+    progress.update_job(job_id, status="failed", error=str(exc))
+    _finish(job_id, tenant, job_key)
+
+
+@shared_task(bind=True)
+def split_and_convert_all(self, ifc_path, output_dir, job_id=None, tenant=None, job_key=None, priority=None):
+    """
+    IFCを階層ごとに分割 → 各階層を並列変換 → 集約（chord）
+    どのタスクも他のタスクの完了を待たない
+    テナントの実行枠が空くまでは再試行で待ち、階層タスクは新しいジョブより高い優先度で投入する
+    """
+    job_id = job_id or self.request.id
+    if not scheduler.acquire_slot(tenant):
+        raise self.retry(countdown=scheduler.TENANT_RETRY_SECONDS, max_retries=None)
+
     Path(output_dir).mkdir(parents=True, exist_ok=True)
-    model = ifcopenshell.open(ifc_path)
-    storeys = model.by_type("IfcBuildingStorey")
+    progress.update_job(job_id, status="splitting")
+
+    # 階層一覧・標高・要素数は索引から取得（サイドカーは各タスクで再利用される）
+    try:
+        index = StepIndex.open(ifc_path)
+        try:
+            summaries = storey_summaries(index)
+        finally:
+            index.close()
+        storeys = list(summaries)
+        # GLB ができる前から階層の配置・規模が分かるように、先にマニフェストを書く
+        manifest = build_manifest(job_id, summaries)
+        manifest_file = write_manifest(manifest_path(output_dir, job_id), manifest)
+    except Exception as e:
+        progress.update_job(job_id, status="failed", error=str(e))
+        _finish(job_id, tenant, job_key)
+        raise
+
+    if not storeys:
+        progress.update_job(job_id, status="failed", error="No IfcBuildingStorey found")
+        _finish(job_id, tenant, job_key)
+        return {"job_id": job_id, "status": "failed"}
 
-    # 各階層をCeleryタスクとして並列実行
-    tasks = [
-        convert_storey.s(ifc_path, storey.Name, output_dir)
-        for storey in storeys
-    ]
+    progress.start_storeys(job_id, storeys)
+    progress.set_result(job_id, manifest)
+    progress.update_job(job_id, manifest_url=media_url(manifest_file))
 
-    job = group(tasks)
-    result = job.apply_async()
+    # 各階層をCeleryタスクとして並列実行し、完了後に集約タスクを呼ぶ
+    options = routing_options(ifc_path)
+    if priority is not None:
+        options["priority"] = scheduler.storey_priority(priority)
+    header = group(
+        convert_storey.s(ifc_path, summaries[global_id]["storey"], output_dir, job_id, global_id).set(**options)
+        for global_id in storeys
+    )
+    body = finalize_conversion.s(job_id, output_dir, summaries, tenant, job_key)
+    body.link_error(abort_conversion.s(job_id, tenant, job_key))
+    chord(header)(body)
 
-    return result.get()  # GLBパスのリストを返す
+    return {"job_id": job_id, "status": "converting", "storeys": storeys}
@@ -1,29 +1,68 @@
 from django.http import JsonResponse
 from django.conf import settings
+from django.views.decorators.http import condition
 from pathlib import Path
-from .tasks import convert_ifc_to_glb
+from .tasks import routing_options, split_and_convert_all
+from ifc_common import progress
+from api import scheduler
 import os
+import uuid
 
 def start_ifc_conversion(request):
     ifc_path = Path(settings.MEDIA_ROOT) / "uploads" / "example.ifc"
     output_dir = Path(settings.MEDIA_ROOT) / "converted"
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    # 仮：IFCを階層ごとに分割してリスト化
-    storeys = ["floor1", "floor2", "floor3"]
+    # 同じファイル（パス + mtime + サイズ）・同じ出力先の変換が実行中ならそのジョブに相乗りする
+    stat = os.stat(ifc_path)
+    key = scheduler.job_key(f"{ifc_path}:{stat.st_mtime_ns}:{stat.st_size}", output=str(output_dir))
+    job_id = uuid.uuid4().hex
+    existing = scheduler.claim(key, job_id)
+    if existing is not None:
+        return JsonResponse({"status": "started", "job_id": existing, "coalesced": True}, status=202)
 
-    # Celery並列変換
-    for storey in storeys:
-        convert_ifc_to_glb.delay(str(ifc_path), str(output_dir), storey)
+    # 分割 → 並列変換 → 集約 のパイプラインを投入（リクエスト内では待たない）
+    # 小さいファイル・画面からの要求を先に（batch=1 はまとめて流す変換）
+    priority = scheduler.priority_for(stat.st_size, interactive=not request.GET.get("batch"))
+    progress.create_job(job_id)
+    split_and_convert_all.apply_async(
+        (str(ifc_path), str(output_dir), job_id),
+        {"tenant": scheduler.tenant_of(request), "job_key": key, "priority": priority},
+        task_id=job_id, priority=priority, **routing_options(ifc_path),
+    )
 
-    return JsonResponse({"status": "started"})
+    return JsonResponse({"status": "started", "job_id": job_id}, status=202)
 
 
+def job_etag(request):
+    """ジョブ状態の版数から ETag を作る（変化がなければ 304 を返し、状態は読まない）"""
+    job_id = request.GET.get("job_id")
+    version = progress.get_version(job_id) if job_id else None
+    return f"{job_id}-{version}" if version is not None else None
+
+
+@condition(etag_func=job_etag)
+def conversion_progress(request):
+    job_id = request.GET.get("job_id")
+    job = progress.get_job(job_id) if job_id else None
+    if job is None:
+        return JsonResponse({"error": "job not found"}, status=404)
+    return JsonResponse({"job_id": job_id, **job})
+
+
+@condition(etag_func=job_etag)
 def conversion_result(request):
-    output_dir = Path(settings.MEDIA_ROOT) / "converted"
-    glb_files = [
-        os.path.join(settings.MEDIA_URL, f.name)
-        for f in sorted(output_dir.glob("*.glb"))
-    ]
-    return JsonResponse({"glb_files": glb_files})
-  
+    # ジョブの成果物はジョブIDをキーにした登録情報から返す（出力ディレクトリは走査しない）
+    job_id = request.GET.get("job_id")
+    if not job_id:
+        return JsonResponse({"error": "job_id required"}, status=400)
+
+    result = progress.get_result(job_id)
+    if result is None:
+        job = progress.get_job(job_id)
+        if job is None:
+            return JsonResponse({"error": "job not found"}, status=404)
+        return JsonResponse({"job_id": job_id, "status": job["status"], "storeys": [], "glb_files": []}, status=202)
+
+    glb_files = [s["glb"] for s in result["storeys"] if s["glb"]]
+    return JsonResponse({**result, "glb_files": glb_files})
@@ -18,3 +18,23 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # Celery 設定
 CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0")
 CELERY_RESULT_BACKEND = CELERY_BROKER_URL
+# 1タスク後の RSS がこれ（KiB）を超えたワーカープロセスは入れ替える
+CELERY_WORKER_MAX_MEMORY_PER_CHILD = int(os.environ.get("CELERY_WORKER_MAX_MEMORY_PER_CHILD", 6 * 1024 * 1024))
+# タスクの優先度（0 が最優先）を Redis ブローカーで有効にし、先読みは1件にして優先度の逆転を防ぐ
+CELERY_BROKER_TRANSPORT_OPTIONS = {"queue_order_strategy": "priority", "priority_steps": list(range(10)), "sep": ":"}
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# 変換ジョブの投入制御（テナントあたりの同時実行ジョブ数）
+IFC_TENANT_MAX_JOBS = int(os.environ.get("IFC_TENANT_MAX_JOBS", 2))
+
+# 大規模モデル（heavy キューへの振り分けとメモリ予算）
+IFC_LARGE_MODEL_MIN_BYTES = int(os.environ.get("IFC_LARGE_MODEL_MIN_BYTES", 1024 ** 3))
+IFC_MEMORY_BUDGET_BYTES = int(os.environ.get("IFC_MEMORY_BUDGET_BYTES", 4 * 1024 ** 3))
+
+# ジョブ進捗（ワーカー間で共有するため Redis を使用）
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ.get("CACHE_URL", CELERY_BROKER_URL),
+    }
+}
@@ -0,0 +1,604 @@
+# -----------------------------------------------------
+# 変換後の GLB の最適化
+#
+# ifcopenshell の glTF シリアライザは要素ごとにノード・メッシュを書くため、
+# 建具の多い階層では描画呼び出しが数千になる。変換後に次を行う。
+#   1. 平行移動だけ異なる同一形状を EXT_mesh_gpu_instancing のインスタンスにまとめる
+#   2. 残りのメッシュをマテリアルごとに1つに結合する（要素の範囲は extras に残す）
+#   3. 頂点クラスタリングで簡略化した LOD を <名前>.lod1.glb, .lod2.glb … に書き出す
+#   4. KHR_mesh_quantization で位置を SHORT、法線を BYTE に量子化する
+#
+# 実行方法（分割スクリプトの target / other を変換した GLB など）
+# python -m api.glb_optimize storey_target.glb
+# python -m api.glb_optimize output_dir/ --lods 3
+# -----------------------------------------------------
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+# 変換結果のキャッシュキーに含めるバージョン
+OPTIMIZER_VERSION = "glbopt-1"
+
+# LOD ごとのクラスタの大きさ（モデルの対角線長に対する比）
+LOD_CELLS = (0.01, 0.03, 0.08)
+# この数以上同じ形状があればインスタンス化する
+INSTANCE_MIN = 2
+# 同一形状とみなす位置の誤差（m）
+INSTANCE_TOLERANCE = 1e-4
+
+TRIANGLES = 4
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+# componentType → (array の型コード, バイト数)
+COMPONENT_TYPES = {5120: ("b", 1), 5121: ("B", 1), 5122: ("h", 2), 5123: ("H", 2), 5125: ("I", 4), 5126: ("f", 4)}
+# 正規化整数の最大値
+NORMALIZED_MAX = {5120: 127.0, 5121: 255.0, 5122: 32767.0, 5123: 65535.0}
+TYPE_SIZES = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4, "MAT4": 16}
+
+IDENTITY = (1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0)
+
+
+class Part:
+    """1要素の1プリミティブ分の三角形（ワールド座標）"""
+
+    __slots__ = ("name", "extras", "material", "mode", "positions", "normals", "indices")
+
+    def __init__(self, name, extras, material, mode, positions, normals, indices):
+        self.name = name
+        self.extras = extras
+        self.material = material
+        self.mode = mode
+        self.positions = positions
+        self.normals = normals
+        self.indices = indices
+
+
+# ---------------------------
+# GLB の読み書き
+# ---------------------------
+def read_glb(path):
+    """GLB → (glTF の JSON, BIN チャンク)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, _ = struct.unpack_from("<4sII", data)
+    if magic != b"glTF" or version != 2:
+        raise ValueError(f"Not a glTF 2.0 GLB file: {path}")
+
+    gltf, binary = None, b""
+    offset = 12
+    while offset < len(data):
+        length, chunk_type = struct.unpack_from("<I4s", data, offset)
+        chunk = data[offset + 8:offset + 8 + length]
+        if chunk_type == b"JSON":
+            gltf = json.loads(chunk)
+        elif chunk_type == b"BIN\0":
+            binary = chunk
+        offset += 8 + length
+    if gltf is None:
+        raise ValueError(f"GLB without JSON chunk: {path}")
+    return gltf, binary
+
+
+def write_glb(gltf, binary, path):
+    """一時ファイルに書いてから置き換え、書き込んだバイト数を返す"""
+    binary = bytes(binary) + b"\0" * (-len(binary) % 4)
+    gltf["buffers"] = [{"byteLength": len(binary)}] if binary else []
+    json_chunk = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+    json_chunk += b" " * (-len(json_chunk) % 4)
+
+    total = 12 + 8 + len(json_chunk) + (8 + len(binary) if binary else 0)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<4sII", b"glTF", 2, total))
+        f.write(struct.pack("<I4s", len(json_chunk), b"JSON"))
+        f.write(json_chunk)
+        if binary:
+            f.write(struct.pack("<I4s", len(binary), b"BIN\0"))
+            f.write(binary)
+    os.replace(tmp_path, path)
+    return total
+
+
+def read_accessor(gltf, binary, index):
+    """アクセサの値を float / int の array で返す（正規化整数は実数に戻す）"""
+    accessor = gltf["accessors"][index]
+    code, size = COMPONENT_TYPES[accessor["componentType"]]
+    components = TYPE_SIZES[accessor["type"]]
+    count = accessor["count"]
+    if "bufferView" not in accessor:
+        return array("f" if code == "f" else "I", bytes(4 * count * components))
+
+    view = gltf["bufferViews"][accessor["bufferView"]]
+    start = view.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+    element = size * components
+    stride = view.get("byteStride") or element
+
+    values = array(code)
+    if stride == element:
+        values.frombytes(binary[start:start + element * count])
+    else:
+        for i in range(count):
+            offset = start + i * stride
+            values.frombytes(binary[offset:offset + element])
+
+    if accessor.get("normalized"):
+        scale = NORMALIZED_MAX[accessor["componentType"]]
+        return array("f", (max(v / scale, -1.0) for v in values))
+    if code != "f" and accessor["type"] != "SCALAR":
+        return array("f", values)
+    return values
+
+
+# ---------------------------
+# シーンの平坦化
+# ---------------------------
+def _multiply(a, b):
+    """列優先 4x4 行列の積 a * b"""
+    return tuple(
+        sum(a[k * 4 + row] * b[col * 4 + k] for k in range(4))
+        for col in range(4) for row in range(4)
+    )
+
+
+def _node_matrix(node):
+    if "matrix" in node:
+        return tuple(node["matrix"])
+    tx, ty, tz = node.get("translation", (0.0, 0.0, 0.0))
+    x, y, z, w = node.get("rotation", (0.0, 0.0, 0.0, 1.0))
+    sx, sy, sz = node.get("scale", (1.0, 1.0, 1.0))
+    return (
+        (1 - 2 * (y * y + z * z)) * sx, (2 * (x * y + z * w)) * sx, (2 * (x * z - y * w)) * sx, 0.0,
+        (2 * (x * y - z * w)) * sy, (1 - 2 * (x * x + z * z)) * sy, (2 * (y * z + x * w)) * sy, 0.0,
+        (2 * (x * z + y * w)) * sz, (2 * (y * z - x * w)) * sz, (1 - 2 * (x * x + y * y)) * sz, 0.0,
+        tx, ty, tz, 1.0,
+    )
+
+
+def _transform_positions(m, values):
+    if m == IDENTITY:
+        return array("f", values)
+    out = array("f", bytes(4 * len(values)))
+    for i in range(0, len(values), 3):
+        x, y, z = values[i], values[i + 1], values[i + 2]
+        out[i] = m[0] * x + m[4] * y + m[8] * z + m[12]
+        out[i + 1] = m[1] * x + m[5] * y + m[9] * z + m[13]
+        out[i + 2] = m[2] * x + m[6] * y + m[10] * z + m[14]
+    return out
+
+
+def _transform_normals(m, values):
+    """回転と一様スケールを想定（変換後に正規化する）"""
+    if m == IDENTITY:
+        return array("f", values)
+    out = array("f", bytes(4 * len(values)))
+    for i in range(0, len(values), 3):
+        x, y, z = values[i], values[i + 1], values[i + 2]
+        nx = m[0] * x + m[4] * y + m[8] * z
+        ny = m[1] * x + m[5] * y + m[9] * z
+        nz = m[2] * x + m[6] * y + m[10] * z
+        length = math.sqrt(nx * nx + ny * ny + nz * nz) or 1.0
+        out[i], out[i + 1], out[i + 2] = nx / length, ny / length, nz / length
+    return out
+
+
+def extract_parts(gltf, binary):
+    """シーンのノードをたどり、プリミティブごとにワールド座標の Part にする"""
+    nodes = gltf.get("nodes", [])
+    meshes = gltf.get("meshes", [])
+    scenes = gltf.get("scenes")
+    roots = scenes[gltf.get("scene", 0)].get("nodes", []) if scenes else range(len(nodes))
+
+    parts = []
+    stack = [(n, IDENTITY) for n in reversed(list(roots))]
+    while stack:
+        node_index, parent = stack.pop()
+        node = nodes[node_index]
+        matrix = _multiply(parent, _node_matrix(node))
+        stack.extend((child, matrix) for child in reversed(node.get("children", [])))
+        if "mesh" not in node:
+            continue
+
+        mesh = meshes[node["mesh"]]
+        name = node.get("name") or mesh.get("name")
+        extras = node.get("extras") or mesh.get("extras") or {}
+        for primitive in mesh.get("primitives", []):
+            attributes = primitive["attributes"]
+            positions = _transform_positions(matrix, read_accessor(gltf, binary, attributes["POSITION"]))
+            normals = None
+            if "NORMAL" in attributes:
+                normals = _transform_normals(matrix, read_accessor(gltf, binary, attributes["NORMAL"]))
+            if "indices" in primitive:
+                indices = array("I", read_accessor(gltf, binary, primitive["indices"]))
+            else:
+                indices = array("I", range(len(positions) // 3))
+            parts.append(Part(
+                name, extras, primitive.get("material"), primitive.get("mode", TRIANGLES),
+                positions, normals, indices,
+            ))
+    return parts
+
+
+# ---------------------------
+# インスタンス化・結合
+# ---------------------------
+def _bounds(values):
+    if not values:
+        return [0.0, 0.0, 0.0], [0.0, 0.0, 0.0]
+    xs, ys, zs = values[0::3], values[1::3], values[2::3]
+    return [min(xs), min(ys), min(zs)], [max(xs), max(ys), max(zs)]
+
+
+def _geometry_key(part, origin):
+    """原点からの相対位置（誤差の範囲で丸める）・インデックス・マテリアルのハッシュ"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(struct.pack("<iq", part.mode, -1 if part.material is None else part.material))
+    h.update(part.indices.tobytes())
+    quantized = array("q", (round((v - origin[i % 3]) / INSTANCE_TOLERANCE) for i, v in enumerate(part.positions)))
+    h.update(quantized.tobytes())
+    return h.digest()
+
+
+def plan(parts):
+    """
+    Part を (インスタンス化するグループ, マテリアルごとに結合するグループ) に分ける
+    インスタンス: {"prototype": Part（相対座標）, "translations": [...], "elements": [...]}
+    結合:         {(マテリアル, モード): [Part, ...]}
+    """
+    by_key = {}
+    for part in parts:
+        if part.mode != TRIANGLES or not part.indices:
+            continue
+        origin, _ = _bounds(part.positions)
+        by_key.setdefault(_geometry_key(part, origin), []).append((part, origin))
+
+    instanced = []
+    shared = set()
+    for group in by_key.values():
+        if len(group) < INSTANCE_MIN:
+            continue
+        part, origin = group[0]
+        relative = array("f", (v - origin[i % 3] for i, v in enumerate(part.positions)))
+        prototype = Part(part.name, {}, part.material, part.mode, relative, part.normals, part.indices)
+        instanced.append({
+            "prototype": prototype,
+            "translations": [origin for _, origin in group],
+            "elements": [_element(p) for p, _ in group],
+        })
+        shared.update(id(p) for p, _ in group)
+
+    merged = {}
+    for part in parts:
+        if id(part) not in shared and part.indices:
+            merged.setdefault((part.material, part.mode), []).append(part)
+    return instanced, merged
+
+
+def _element(part):
+    element = {"name": part.name}
+    for key in ("guid", "type"):
+        if key in part.extras:
+            element[key] = part.extras[key]
+    return element
+
+
+def merge(parts):
+    """Part を1つに結合し、要素ごとのインデックス範囲を返す"""
+    positions, normals, indices = array("f"), array("f"), array("I")
+    with_normals = all(p.normals is not None and len(p.normals) == len(p.positions) for p in parts)
+    elements = []
+    for part in parts:
+        base = len(positions) // 3
+        elements.append({**_element(part), "first": len(indices), "count": len(part.indices)})
+        positions.extend(part.positions)
+        if with_normals:
+            normals.extend(part.normals)
+        indices.extend(i + base for i in part.indices)
+    merged = Part(None, {}, parts[0].material, parts[0].mode, positions, normals if with_normals else None, indices)
+    return merged, elements
+
+
+# ---------------------------
+# LOD（頂点クラスタリング）
+# ---------------------------
+def simplify(part, cell):
+    """
+    頂点を cell 間隔の格子でまとめ（位置・法線は平均）、つぶれた三角形を捨てる
+    要素の範囲（first / count）を保つため、三角形ごとの残す/捨てるも返す
+    """
+    clusters = {}
+    remap = array("I", bytes(4 * (len(part.positions) // 3)))
+    sums = []
+    p, n = part.positions, part.normals
+    for v in range(len(p) // 3):
+        x, y, z = p[v * 3], p[v * 3 + 1], p[v * 3 + 2]
+        key = (math.floor(x / cell), math.floor(y / cell), math.floor(z / cell))
+        cluster = clusters.get(key)
+        if cluster is None:
+            cluster = clusters[key] = len(sums)
+            sums.append([0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0])
+        s = sums[cluster]
+        s[0] += x
+        s[1] += y
+        s[2] += z
+        if n is not None:
+            s[3] += n[v * 3]
+            s[4] += n[v * 3 + 1]
+            s[5] += n[v * 3 + 2]
+        s[6] += 1
+        remap[v] = cluster
+
+    positions = array("f")
+    normals = array("f") if n is not None else None
+    for s in sums:
+        positions.extend((s[0] / s[6], s[1] / s[6], s[2] / s[6]))
+        if normals is not None:
+            length = math.sqrt(s[3] * s[3] + s[4] * s[4] + s[5] * s[5]) or 1.0
+            normals.extend((s[3] / length, s[4] / length, s[5] / length))
+
+    indices = array("I")
+    kept = array("B")
+    seen = set()
+    source = part.indices
+    for t in range(0, len(source), 3):
+        a, b, c = remap[source[t]], remap[source[t + 1]], remap[source[t + 2]]
+        triangle = (a, b, c)
+        keep = a != b and b != c and a != c and triangle not in seen
+        kept.append(keep)
+        if keep:
+            seen.add(triangle)
+            indices.extend(triangle)
+    return Part(part.name, part.extras, part.material, part.mode, positions, normals, indices), kept
+
+
+def _simplify_merged(part, elements, cell):
+    simplified, kept = simplify(part, cell)
+    ranges = []
+    first = 0
+    for element in elements:
+        count = 3 * sum(kept[element["first"] // 3:(element["first"] + element["count"]) // 3])
+        if count:
+            ranges.append({**element, "first": first, "count": count})
+        first += count
+    return simplified, ranges
+
+
+# ---------------------------
+# glTF の組み立て
+# ---------------------------
+class GltfBuilder:
+    """バッファ・アクセサ・メッシュ・ノードを追加していく（KHR_mesh_quantization は任意）"""
+
+    def __init__(self, source, quantize=True):
+        self.quantize = quantize
+        self.buffer = bytearray()
+        self.gltf = {
+            "asset": {"version": "2.0", "generator": f"ifcconvert {OPTIMIZER_VERSION}"},
+            "scene": 0,
+            "scenes": [{"nodes": []}],
+            "nodes": [],
+            "meshes": [],
+            "accessors": [],
+            "bufferViews": [],
+        }
+        for key in ("materials", "textures", "images", "samplers"):
+            if source.get(key):
+                self.gltf[key] = source[key]
+        self.extensions = set()
+        self.required = set()
+
+    def view(self, data, target=None, stride=None):
+        while len(self.buffer) % 4:
+            self.buffer.append(0)
+        view = {"buffer": 0, "byteOffset": len(self.buffer), "byteLength": len(data)}
+        if target:
+            view["target"] = target
+        if stride:
+            view["byteStride"] = stride
+        self.buffer.extend(data)
+        self.gltf["bufferViews"].append(view)
+        return len(self.gltf["bufferViews"]) - 1
+
+    def accessor(self, view, component_type, count, type_, **extra):
+        self.gltf["accessors"].append({
+            "bufferView": view, "componentType": component_type, "count": count, "type": type_, **extra,
+        })
+        return len(self.gltf["accessors"]) - 1
+
+    def primitive(self, part):
+        """
+        Part → プリミティブと、ノードに掛ける (平行移動, 一様スケール)
+        量子化時は SHORT の位置を center + q * scale で戻す
+        """
+        lo, hi = _bounds(part.positions)
+        count = len(part.positions) // 3
+        if self.quantize and count:
+            center = [(lo[i] + hi[i]) / 2 for i in range(3)]
+            scale = max(hi[i] - lo[i] for i in range(3)) / 2 / 32767 or 1.0
+            quantized = array("h", bytes(8 * count))
+            for v in range(count):
+                for axis in range(3):
+                    quantized[v * 4 + axis] = round((part.positions[v * 3 + axis] - center[axis]) / scale)
+            q_lo, q_hi = _bounds(array("f", (q for i, q in enumerate(quantized) if i % 4 != 3)))
+            position = self.accessor(
+                self.view(quantized.tobytes(), ARRAY_BUFFER, stride=8), 5122, count, "VEC3",
+                min=[int(v) for v in q_lo], max=[int(v) for v in q_hi],
+            )
+            self.extensions.add("KHR_mesh_quantization")
+            self.required.add("KHR_mesh_quantization")
+        else:
+            center, scale = [0.0, 0.0, 0.0], 1.0
+            position = self.accessor(self.view(part.positions.tobytes(), ARRAY_BUFFER), 5126, count, "VEC3", min=lo, max=hi)
+
+        attributes = {"POSITION": position}
+        if part.normals is not None and len(part.normals) == len(part.positions):
+            if self.quantize:
+                normals = array("b", bytes(4 * count))
+                for v in range(count):
+                    for axis in range(3):
+                        normals[v * 4 + axis] = round(part.normals[v * 3 + axis] * 127)
+                attributes["NORMAL"] = self.accessor(
+                    self.view(normals.tobytes(), ARRAY_BUFFER, stride=4), 5120, count, "VEC3", normalized=True,
+                )
+            else:
+                attributes["NORMAL"] = self.accessor(self.view(part.normals.tobytes(), ARRAY_BUFFER), 5126, count, "VEC3")
+
+        indices = part.indices if count > 65535 else array("H", part.indices)
+        primitive = {
+            "attributes": attributes,
+            "indices": self.accessor(
+                self.view(indices.tobytes(), ELEMENT_ARRAY_BUFFER), 5125 if indices.typecode == "I" else 5123,
+                len(indices), "SCALAR",
+            ),
+            "mode": part.mode,
+        }
+        if part.material is not None:
+            primitive["material"] = part.material
+        return primitive, center, scale
+
+    def node(self, name, primitive, **fields):
+        self.gltf["meshes"].append({"name": name, "primitives": [primitive]})
+        self.gltf["nodes"].append({"name": name, "mesh": len(self.gltf["meshes"]) - 1, **fields})
+        self.gltf["scenes"][0]["nodes"].append(len(self.gltf["nodes"]) - 1)
+
+    def add_merged(self, part, elements):
+        primitive, center, scale = self.primitive(part)
+        fields = {"extras": {"elements": elements}}
+        if self.quantize:
+            fields.update(translation=center, scale=[scale] * 3)
+        self.node(f"merged_{part.material}", primitive, **fields)
+
+    def add_instanced(self, prototype, translations, elements):
+        """EXT_mesh_gpu_instancing（量子化の戻しはインスタンスの TRANSLATION / SCALE に含める）"""
+        primitive, center, scale = self.primitive(prototype)
+        values = array("f")
+        for t in translations:
+            values.extend(t[i] + center[i] for i in range(3))
+        attributes = {
+            "TRANSLATION": self.accessor(self.view(values.tobytes()), 5126, len(translations), "VEC3"),
+        }
+        if scale != 1.0:
+            scales = array("f", [scale]) * (3 * len(translations))
+            attributes["SCALE"] = self.accessor(self.view(scales.tobytes()), 5126, len(translations), "VEC3")
+        self.extensions.add("EXT_mesh_gpu_instancing")
+        self.node(
+            prototype.name or "instanced", primitive,
+            extensions={"EXT_mesh_gpu_instancing": {"attributes": attributes}},
+            extras={"elements": elements},
+        )
+
+    def build(self):
+        if self.extensions:
+            self.gltf["extensionsUsed"] = sorted(self.extensions)
+        if self.required:
+            self.gltf["extensionsRequired"] = sorted(self.required)
+        return self.gltf, self.buffer
+
+
+# ---------------------------
+# 最適化
+# ---------------------------
+def lod_path(path, level):
+    path = Path(path)
+    return path.with_name(f"{path.stem}.lod{level}{path.suffix}")
+
+
+def _draw_calls(gltf):
+    nodes = gltf.get("nodes", [])
+    meshes = gltf.get("meshes", [])
+    return sum(len(meshes[n["mesh"]].get("primitives", [])) for n in nodes if "mesh" in n)
+
+
+def optimize_glb(input_path, output_path=None, lods=2, quantize=True):
+    """
+    GLB をインスタンス化・結合・量子化して output_path（省略時は上書き）に書き、
+    lods 段の簡略化モデルを <名前>.lod1.glb … に書く
+    """
+    output_path = output_path or input_path
+    gltf, binary = read_glb(input_path)
+    input_bytes = os.path.getsize(input_path)
+    draw_calls_in = _draw_calls(gltf)
+
+    parts = extract_parts(gltf, binary)
+    instanced, merged_groups = plan(parts)
+    merged = [merge(group) for group in merged_groups.values()]
+
+    positions = array("f")
+    for part in parts:
+        positions.extend(part.positions)
+    lo, hi = _bounds(positions)
+    diagonal = math.dist(lo, hi)
+
+    stats = {"input_bytes": input_bytes, "draw_calls_in": draw_calls_in, "instanced_elements": 0}
+    lod_files = []
+    for level in range(lods + 1):
+        builder = GltfBuilder(gltf, quantize)
+        cell = diagonal * LOD_CELLS[min(level, len(LOD_CELLS)) - 1] if level else None
+        for group in instanced:
+            prototype = group["prototype"]
+            if cell:
+                prototype, _ = simplify(prototype, cell)
+                if not prototype.indices:
+                    continue
+            builder.add_instanced(prototype, group["translations"], group["elements"])
+        for part, elements in merged:
+            if cell and part.mode == TRIANGLES:
+                part, elements = _simplify_merged(part, elements, cell)
+                if not part.indices:
+                    continue
+            builder.add_merged(part, elements)
+
+        out_gltf, out_binary = builder.build()
+        if level == 0:
+            stats["bytes"] = write_glb(out_gltf, out_binary, output_path)
+            stats["draw_calls"] = _draw_calls(out_gltf)
+            stats["instanced_elements"] = sum(len(g["translations"]) for g in instanced)
+        else:
+            path = lod_path(output_path, level)
+            write_glb(out_gltf, out_binary, path)
+            lod_files.append(str(path))
+
+    stats["lods"] = lod_files
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GLB のインスタンス化・マテリアル結合・LOD 生成・量子化")
+    parser.add_argument("inputs", nargs="+", help="GLB ファイルまたはディレクトリ（*.glb を処理）")
+    parser.add_argument("--output-dir", default=None, help="出力先（省略時は上書き）")
+    parser.add_argument("--lods", type=int, default=2, help="LOD の段数")
+    parser.add_argument("--no-quantize", action="store_true", help="KHR_mesh_quantization を使わない")
+    args = parser.parse_args()
+
+    paths = []
+    for item in args.inputs:
+        if os.path.isdir(item):
+            paths += sorted(p for p in Path(item).glob("*.glb") if ".lod" not in p.stem)
+        else:
+            paths.append(Path(item))
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    for path in paths:
+        output = Path(args.output_dir) / path.name if args.output_dir else path
+        try:
+            stats = optimize_glb(path, output, lods=args.lods, quantize=not args.no_quantize)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"❌ {path.name}: {e}", file=sys.stderr)
+            continue
+        print(
+            f"✅ {path.name}: {stats['draw_calls_in']} → {stats['draw_calls']} draw calls, "
+            f"{stats['input_bytes'] / 1024:.0f} → {stats['bytes'] / 1024:.0f} KB, "
+            f"{stats['instanced_elements']} instanced, {len(stats['lods'])} LODs"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,130 @@
-import ifcopenshell
+import json
+from collections import Counter
 from pathlib import Path
+from . import metrics
+from .split_strategies import plan_chunks
+from ifc_common.step_index import COMPRESSION_SUFFIXES, DiskIdSet, StepIndex
 
 def split_ifc_by_storey(ifc_path: str, output_dir: str):
-    file = ifcopenshell.open(ifc_path)
-    storeys = file.by_type("IfcBuildingStorey")
+    # モデル全体は開かず、オフセット索引から階層ごとに部分抽出する
+    index = StepIndex.open(ifc_path)
 
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
     output_files = []
 
-    for storey in storeys:
-        storey_name = storey.Name or "UnknownStorey"
-        storey_name = storey_name.replace(" ", "_")
+    try:
+        for storey_id, _, storey_name in index.storeys():
+            storey_name = storey_name or "UnknownStorey"
+            storey_name = storey_name.replace(" ", "_")
 
-        new_file = ifcopenshell.file(schema=file.schema)
-        new_file.add(storey)
+            output_path = output_dir / f"{storey_name}.ifc"
+            index.extract_storey(storey_id, output_path)
+            output_files.append(str(output_path))
+    finally:
+        index.close()
 
-        for rel in file.get_inverse(storey):
-            if rel.is_a("IfcRelContainedInSpatialStructure"):
-                for elem in rel.RelatedElements:
-                    new_file.add(elem)
+    return output_files
 
-        output_path = output_dir / f"{storey_name}.ifc"
-        new_file.write(str(output_path))
-        output_files.append(str(output_path))
 
-    return output_files
+# 分割処理のバージョン（出力内容が変わる変更をしたら上げる）
+SPLITTER_VERSION = "stepindex-2"
+
+
+def split_ifc_by_storey_cached(ifc_path: str, file_hash: str, store, global_ids=None, strategy="storey", workers=1,
+                               compression=None, closures=None, budget=None, peaks=None):
+    """
+    split_ifc_by_storey のキャッシュ版
+    出力は (ファイルハッシュ, 階層 GlobalId, チャンクの要素, 分割オプション) をキーに保存し、あれば再利用する
+    global_ids を指定した場合はその階層だけ抽出する（それ以外は "ifc": None）
+    strategy で分け方を選ぶ（split_strategies.STRATEGIES）。重い階層は複数のチャンクになる
+    抽出したチャンクには "metrics"（収集・書き出しの時間と最大 RSS、出力バイト数、オブジェクト数）を付ける
+    compression（"gzip" / "ifczip"）を指定すると圧縮して保存し、圧縮で減ったバイト数も metrics に入れる
+    closures（{階層ID: (ids, rewritten)}、storey_fingerprints で収集したもの）があれば、
+    階層全体のチャンクはクロージャを収集し直さずに使う（その階層のチャンクに来たら取り除く）
+    budget（MemoryBudget）を超えたら書き出しの前に ID 集合をディスクに退避する（extract_storey と同じ）
+    peaks（dict）を渡すと open / collect / write の最大 RSS（"<段階>_peak_rss"）をチャンク全体の最大値で入れる
+    """
+    closures = {} if closures is None else closures
+    peaks = {} if peaks is None else peaks
+    suffix = COMPRESSION_SUFFIXES[compression]
+    with metrics.timed("open"), metrics.peak_rss("open", peaks):
+        index = StepIndex.open(ifc_path)
+
+    parts = []
+    seen = set()
+
+    try:
+        chunks = plan_chunks(index, strategy, workers)
+        chunk_counts = Counter(c["storey_id"] for c in chunks)
+        chunk_numbers = Counter()
+
+        for chunk in chunks:
+            storey_id, global_id = chunk["storey_id"], chunk["global_id"]
+            storey_name = chunk["storey"] or "UnknownStorey"
+            storey_name = storey_name.replace(" ", "_")
+            if chunk_counts[storey_id] > 1:
+                chunk_numbers[storey_id] += 1
+                storey_name = f"{storey_name}_part{chunk_numbers[storey_id]}"
+            if storey_name in seen:
+                storey_name = f"{storey_name}_{storey_id}"
+            seen.add(storey_name)
+
+            part = {"storey": storey_name, "global_id": global_id, "ifc": None, "cost": chunk["cost"]}
+            parts.append(part)
+            # 使わない（キャッシュにある・複数チャンクに分かれた）クロージャもここで手放す
+            closure = closures.pop(storey_id, None)
+            if global_ids is not None and global_id not in global_ids:
+                continue
+
+            element_ids = chunk["element_ids"]
+            key = store.key(file_hash, global_id, element_ids, SPLITTER_VERSION, compression)
+            output_path = store.path("split", key, suffix)
+            if not store.hit(output_path):
+                timings = {}
+                tmp_path = store.temp_path("split", suffix)
+                with metrics.timed("collect", timings), metrics.peak_rss("collect", timings, peaks):
+                    if element_ids is None and closure is not None:
+                        ids, rewritten = closure
+                    else:
+                        ids, rewritten = index.collect(storey_id, element_ids, budget)
+                    ids = index.spill_if_over(ids, budget)
+                closure = None
+                objects = len(ids) + len(rewritten)
+                try:
+                    with metrics.timed("write", timings), metrics.peak_rss("write", timings, peaks):
+                        written = index.write(ids, tmp_path, rewritten)
+                finally:
+                    if isinstance(ids, DiskIdSet):
+                        ids.close()
+                stored = tmp_path.stat().st_size
+                store.commit(tmp_path, output_path)
+                metrics.add_bytes("write", "out", stored)
+                part["metrics"] = {
+                    **timings, "bytes_out": stored, "bytes_saved": written - stored,
+                    "objects": objects,
+                }
+            part["ifc"] = str(output_path)
+    finally:
+        index.close()
+
+    return parts
+
+
+def write_chunk_manifest(parts, file_hash, strategy, workers, store):
+    """チャンクの割り当て（どの階層・どのコストか）を JSON で保存してパスを返す"""
+    manifest = {
+        "file_hash": file_hash,
+        "strategy": strategy,
+        "workers": workers,
+        "splitter_version": SPLITTER_VERSION,
+        "chunks": [
+            {"name": p["storey"], "global_id": p["global_id"], "cost": p["cost"], "ifc": p["ifc"] and store.url(p["ifc"])}
+            for p in parts
+        ],
+    }
+    path = store.path("split", store.key(file_hash, strategy, workers, SPLITTER_VERSION), ".json")
+    tmp_path = store.temp_path("split", ".json")
+    tmp_path.write_text(json.dumps(manifest))
+    return store.commit(tmp_path, path)
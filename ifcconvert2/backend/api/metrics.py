@@ -0,0 +1,129 @@
+import math
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from ifc_common import rss
+
+# ワーカー間で集計するため、値は Django キャッシュ（Redis）に整数で加算する
+PREFIX = "ifcmetrics"
+
+# パイプラインの段階
+#   open: 索引の作成/読み込み  fingerprint: リビジョン比較  collect: 参照クロージャの収集
+#   write: 分割 IFC の書き出し  queue_wait: 変換タスクの待ち時間  convert: 三角形化・GLB 書き出し
+#   optimize: GLB のインスタンス化・結合・LOD 生成  job: アップロードから集約まで
+STAGES = ("open", "fingerprint", "collect", "write", "queue_wait", "convert", "optimize", "job")
+BYTE_STAGES = (("upload", "in"), ("write", "out"), ("convert", "in"), ("convert", "out"))
+JOB_STATUSES = ("success", "partial", "failed")
+
+# 秒のヒストグラムのバケット
+BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, math.inf)
+
+
+def _incr(key, delta=1):
+    """キーがなければ作ってから加算（redis の INCRBY で原子的）"""
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.set(key, delta, None)
+
+
+def peak_rss_bytes():
+    """直前の rss.reset_peak() からのこのプロセスの最大 RSS（常駐ワーカーでも段階・ジョブごとの値になる）"""
+    return rss.peak()
+
+
+def observe(stage, seconds):
+    _incr(f"{PREFIX}:seconds:{stage}:count")
+    _incr(f"{PREFIX}:seconds:{stage}:sum_ms", int(seconds * 1000))
+    for bound in BUCKETS:
+        if seconds <= bound:
+            _incr(f"{PREFIX}:seconds:{stage}:le:{bound}")
+
+
+def add_bytes(stage, direction, n):
+    _incr(f"{PREFIX}:bytes:{stage}:{direction}", int(n))
+
+
+def record_peak_rss(stage, value=None):
+    """段階ごとの最大 RSS（ゲージ。複数ワーカーの最大値を残す）"""
+    value = peak_rss_bytes() if value is None else int(value)
+    key = f"{PREFIX}:rss:{stage}"
+    if value > (cache.get(key) or 0):
+        cache.set(key, value, None)
+    return value
+
+
+def job_finished(status, seconds=None):
+    _incr(f"{PREFIX}:jobs:{status}")
+    if seconds is not None:
+        observe("job", seconds)
+
+
+@contextmanager
+def timed(stage, timings=None):
+    """処理時間を stage のヒストグラムに記録し、timings があれば "<stage>_seconds" に入れる"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        observe(stage, seconds)
+        if timings is not None:
+            timings[f"{stage}_seconds"] = round(seconds, 3)
+
+
+@contextmanager
+def peak_rss(stage, *peaks):
+    """
+    ブロック内の最大 RSS を stage のゲージに記録し、peaks（dict）に "<stage>_peak_rss" として入れる（大きい方を残す）
+    開始時に最大 RSS をリセットするので入れ子にはしない
+    """
+    rss.reset_peak()
+    try:
+        yield
+    finally:
+        value = record_peak_rss(stage)
+        for target in peaks:
+            key = f"{stage}_peak_rss"
+            target[key] = max(target.get(key, 0), value)
+
+
+def render():
+    """Prometheus のテキスト形式"""
+    keys = []
+    for stage in STAGES:
+        keys += [f"{PREFIX}:seconds:{stage}:count", f"{PREFIX}:seconds:{stage}:sum_ms", f"{PREFIX}:rss:{stage}"]
+        keys += [f"{PREFIX}:seconds:{stage}:le:{bound}" for bound in BUCKETS]
+    keys += [f"{PREFIX}:bytes:{stage}:{direction}" for stage, direction in BYTE_STAGES]
+    keys += [f"{PREFIX}:jobs:{status}" for status in JOB_STATUSES]
+    values = cache.get_many(keys)
+
+    def get(key):
+        return values.get(key) or 0
+
+    lines = [
+        "# HELP ifc_stage_seconds Time spent in each conversion pipeline stage",
+        "# TYPE ifc_stage_seconds histogram",
+    ]
+    for stage in STAGES:
+        for bound in BUCKETS:
+            le = "+Inf" if bound == math.inf else str(bound)
+            lines.append(f'ifc_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {get(f"{PREFIX}:seconds:{stage}:le:{bound}")}')
+        lines.append(f'ifc_stage_seconds_sum{{stage="{stage}"}} {get(f"{PREFIX}:seconds:{stage}:sum_ms") / 1000}')
+        lines.append(f'ifc_stage_seconds_count{{stage="{stage}"}} {get(f"{PREFIX}:seconds:{stage}:count")}')
+
+    lines += ["# HELP ifc_stage_bytes_total Bytes read or written by each stage", "# TYPE ifc_stage_bytes_total counter"]
+    for stage, direction in BYTE_STAGES:
+        lines.append(f'ifc_stage_bytes_total{{stage="{stage}",direction="{direction}"}} {get(f"{PREFIX}:bytes:{stage}:{direction}")}')
+
+    lines += ["# HELP ifc_stage_peak_rss_bytes Peak RSS observed in each stage", "# TYPE ifc_stage_peak_rss_bytes gauge"]
+    for stage in STAGES:
+        lines.append(f'ifc_stage_peak_rss_bytes{{stage="{stage}"}} {get(f"{PREFIX}:rss:{stage}")}')
+
+    lines += ["# HELP ifc_jobs_total Finished conversion jobs by status", "# TYPE ifc_jobs_total counter"]
+    for status in JOB_STATUSES:
+        lines.append(f'ifc_jobs_total{{status="{status}"}} {get(f"{PREFIX}:jobs:{status}")}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import re
+
+from ifc_common.step_index import DiskIdSet, StepIndex, STRING_RE
+
+# 書き出しのたびに変わるだけで形状に関係しないエンティティ（指紋から除外）
+IGNORED_TYPES = {"IFCOWNERHISTORY"}
+
+REF_TOKEN_RE = re.compile(rb"#(\d+)")
+
+
+class Fingerprinter:
+    """
+    エンティティ内容の指紋（#ID の振り直しに影響されない）
+    参照先 #ID を参照先の指紋に置き換えてハッシュするため、同じ内容なら
+    リビジョン間で ID が変わっても同じ指紋になる
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.memo = {}
+
+    def _body_with_placeholders(self, entity_id):
+        """参照の位置で分割した本体と、参照先のIDリスト"""
+        body = self.index.body(entity_id)
+        refs = []
+        parts = []
+        last = 0
+        # 文字列リテラル内の '#' は参照ではない
+        masked = STRING_RE.sub(lambda m: b"'" + b"_" * (len(m.group(0)) - 2) + b"'", body)
+        for m in REF_TOKEN_RE.finditer(masked):
+            parts.append(body[last:m.start()])
+            refs.append(int(m.group(1)))
+            last = m.end()
+        parts.append(body[last:])
+        return parts, refs
+
+    def fingerprint(self, entity_id):
+        """エンティティの指紋（参照先の指紋を含む Merkle ハッシュ）"""
+        if entity_id in self.memo:
+            return self.memo[entity_id]
+
+        # 再帰を避けて後順で計算する
+        stack = [(entity_id, False)]
+        in_progress = set()
+        while stack:
+            current, expanded = stack.pop()
+            if current in self.memo:
+                continue
+            if self.index.type_of(current) in IGNORED_TYPES:
+                self.memo[current] = b"ignored"
+                continue
+
+            parts, refs = self._body_with_placeholders(current)
+            if not expanded:
+                in_progress.add(current)
+                stack.append((current, True))
+                # 循環参照は ID をそのまま使う
+                stack.extend((r, False) for r in refs if r not in self.memo and r not in in_progress)
+                continue
+
+            h = hashlib.blake2b(digest_size=16)
+            h.update(parts[0])
+            for ref, part in zip(refs, parts[1:]):
+                h.update(self.memo.get(ref, b"#%d" % ref))
+                h.update(part)
+            self.memo[current] = h.digest()
+            in_progress.discard(current)
+
+        return self.memo[entity_id]
+
+    def storey_fingerprint(self, storey_id, budget=None):
+        """階層の参照クロージャ全体の指紋と、収集した (ids, rewritten) を返す"""
+        ids, rewritten = self.index.collect(storey_id, budget=budget)
+        h = hashlib.sha256()
+        for digest in sorted(self.fingerprint(i) for i in ids):
+            h.update(digest)
+        return h.hexdigest(), (ids, rewritten)
+
+
+def storey_fingerprints(ifc_path, previous=None, closures=None, budget=None):
+    """
+    {GlobalId: {"storey_id", "name", "fingerprint"}}
+    closures（dict）を渡すと、前回リビジョン previous から変わった階層のクロージャだけを階層IDで入れる
+    （分割で収集し直さないように）。変わらない階層・budget（MemoryBudget）を超えたあとの階層の
+    クロージャは指紋を比べたらすぐに手放し、分割で必要なら収集し直す
+    """
+    previous = {} if previous is None else previous
+    index = StepIndex.open(ifc_path)
+    try:
+        fingerprinter = Fingerprinter(index)
+        fingerprints = {}
+        for storey_id, global_id, name in index.storeys():
+            fingerprint, (ids, rewritten) = fingerprinter.storey_fingerprint(storey_id, budget)
+            fingerprints[global_id] = {"storey_id": storey_id, "name": name, "fingerprint": fingerprint}
+            keep = (
+                closures is not None and not isinstance(ids, DiskIdSet)
+                and not is_unchanged(previous.get(global_id), fingerprint)
+                and (budget is None or not budget.over())
+            )
+            if keep:
+                closures[storey_id] = (ids, rewritten)
+            elif isinstance(ids, DiskIdSet):
+                ids.close()
+            # 次の階層を収集する間に残らないように
+            del ids, rewritten
+        return fingerprints
+    finally:
+        index.close()
+
+
+def is_unchanged(prev, fingerprint):
+    """前回リビジョンの記録 prev と同じ指紋で、再利用できる出力があるか"""
+    return bool(prev and prev.get("fingerprint") == fingerprint and prev.get("parts"))
+
+
+def diff_revisions(previous, current):
+    """
+    前回リビジョンの記録と今回の指紋を比べ、(再変換が必要な GlobalId, 再利用できる GlobalId) を返す
+    previous: {GlobalId: {"fingerprint", "parts": [{"storey", "glb"}]}}
+    """
+    changed = set()
+    unchanged = set()
+    for global_id, info in current.items():
+        if is_unchanged(previous.get(global_id), info["fingerprint"]):
+            unchanged.add(global_id)
+        else:
+            changed.add(global_id)
+    return changed, unchanged
+
+
+def load_revision(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
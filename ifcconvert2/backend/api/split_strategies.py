@@ -0,0 +1,142 @@
+import heapq
+import math
+
+from ifc_common.step_index import refs_in
+
+# 形状コストの見積もり（三角形化の重さの目安）
+# 表現アイテム1つあたりの固定コスト（押し出し・ブーリアン等は頂点数に比べて重い）
+ITEM_COST = 50
+# 頂点1つあたりのコスト
+VERTEX_COST = 1
+
+# IfcProduct の Representation 属性の位置
+REPRESENTATION_POS = 6
+
+
+class CostEstimator:
+    """
+    オフセット索引から要素ごとの形状コストを見積もる（モデルは開かない）
+    表現（IfcProductDefinitionShape）単位でメモ化するので共有形状は一度だけ数える
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.memo = {}
+
+    def _representation_cost(self, shape_id):
+        if shape_id in self.memo:
+            return self.memo[shape_id]
+
+        cost = 0
+        for entity_id in self.index.forward_closure([shape_id]):
+            type_name = self.index.type_of(entity_id)
+            if type_name == "IFCSHAPEREPRESENTATION":
+                cost += ITEM_COST * len(refs_in(self.index.args(entity_id)[3]))
+            elif type_name == "IFCCARTESIANPOINT":
+                cost += VERTEX_COST
+            elif type_name == "IFCCARTESIANPOINTLIST3D":
+                # ((x,y,z),(x,y,z),...) の組の数
+                cost += VERTEX_COST * max(self.index.args(entity_id)[0].count(b"(") - 1, 0)
+        self.memo[shape_id] = cost
+        return cost
+
+    def element_cost(self, element_id):
+        """要素と分解構造（子要素）の形状コストの合計"""
+        children = self.index._inverse_maps()["children"]
+        cost = 0
+        stack = [element_id]
+        seen = set()
+        while stack:
+            entity_id = stack.pop()
+            if entity_id in seen:
+                continue
+            seen.add(entity_id)
+            args = self.index.args(entity_id)
+            if len(args) > REPRESENTATION_POS:
+                for shape_id in refs_in(args[REPRESENTATION_POS]):
+                    cost += self._representation_cost(shape_id)
+            stack.extend(children.get(entity_id, []))
+        return cost
+
+
+def pack(units, bins):
+    """
+    LPT（大きい順に最も軽いチャンクへ）で units [(コスト, キー, [要素ID])] を bins 個に詰める
+    空のチャンクは返さない
+    """
+    heap = [(0, i, []) for i in range(bins)]
+    for cost, _, element_ids in sorted(units, key=lambda u: (-u[0], u[1])):
+        total, i, chunk = heapq.heappop(heap)
+        chunk.extend(element_ids)
+        heapq.heappush(heap, (total + cost, i, chunk))
+    return [(total, chunk) for total, _, chunk in sorted(heap, key=lambda c: c[1]) if chunk]
+
+
+def _units(index, estimator, element_ids, group_by):
+    """詰める単位：要素ごと、または IFC 型ごと（目標より重い型は要素に戻す）"""
+    units = [(estimator.element_cost(e), e, [e]) for e in element_ids]
+    if group_by != "type":
+        return units
+
+    by_type = {}
+    for cost, element_id, ids in units:
+        entry = by_type.setdefault(index.type_of(element_id), [0, []])
+        entry[0] += cost
+        entry[1].append((cost, element_id, ids))
+    return [(cost, type_name, [e for _, e, _ in members]) for type_name, (cost, members) in by_type.items()]
+
+
+def plan_storey_chunks(index):
+    """従来どおり1階層1チャンク"""
+    return [
+        {"storey_id": storey_id, "global_id": global_id, "storey": name, "element_ids": None, "cost": None}
+        for storey_id, global_id, name in index.storeys()
+    ]
+
+
+def plan_balanced_chunks(index, workers, group_by="element"):
+    """
+    コストがほぼ均等なチャンクに分ける
+    目標コスト（総コスト / ワーカー数）以下の階層はそのまま、重い階層だけ階層内で分割する
+    """
+    children = index._inverse_maps()["children"]
+    estimator = CostEstimator(index)
+
+    storeys = []
+    for storey_id, global_id, name in index.storeys():
+        element_ids = children.get(storey_id, [])
+        cost = sum(estimator.element_cost(e) for e in element_ids)
+        storeys.append((storey_id, global_id, name, element_ids, cost))
+
+    total = sum(s[4] for s in storeys)
+    target = max(total / max(workers, 1), 1)
+
+    chunks = []
+    for storey_id, global_id, name, element_ids, cost in storeys:
+        bins = min(math.ceil(cost / target), len(element_ids))
+        if bins <= 1:
+            chunks.append({"storey_id": storey_id, "global_id": global_id, "storey": name, "element_ids": None, "cost": cost})
+            continue
+
+        units = _units(index, estimator, element_ids, group_by)
+        # 型でまとめた単位が目標より重ければ要素単位に戻す
+        if group_by == "type" and any(u[0] > target for u in units):
+            units = _units(index, estimator, element_ids, "element")
+        for chunk_cost, chunk_ids in pack(units, bins):
+            chunks.append({"storey_id": storey_id, "global_id": global_id, "storey": name, "element_ids": sorted(chunk_ids), "cost": chunk_cost})
+    return chunks
+
+
+STRATEGIES = {
+    "storey": lambda index, workers: plan_storey_chunks(index),
+    "balanced": lambda index, workers: plan_balanced_chunks(index, workers),
+    "balanced_by_type": lambda index, workers: plan_balanced_chunks(index, workers, group_by="type"),
+}
+
+
+def plan_chunks(index, strategy="storey", workers=1):
+    try:
+        planner = STRATEGIES[strategy]
+    except KeyError:
+        raise ValueError(f"Unknown split strategy: {strategy}") from None
+    return planner(index, workers)
@@ -1,8 +1,276 @@
-from celery import shared_task
-import subprocess
+from celery import shared_task, group, chord
+from django.conf import settings
+import ifcopenshell
+import json
+import os
+import time
+from ifc_common.content_store import ContentStore, hash_file
+from ifc_common.step_index import MemoryBudget
+from .ifc_splitter import SPLITTER_VERSION, split_ifc_by_storey_cached, write_chunk_manifest
+from .revision_diff import diff_revisions, load_revision, storey_fingerprints
+from .glb_optimize import OPTIMIZER_VERSION, lod_path, optimize_glb
+from ifc_common import converter_service, progress
+from . import metrics
+
+# 変換後の GLB をインスタンス化・結合・量子化し、LOD を何段作るか
+# 最適化は Python で全頂点を処理して階層ごとの変換より重くなりうるので、必要なときだけ有効にする
+GLB_OPTIMIZE = getattr(settings, "IFC_GLB_OPTIMIZE", False)
+GLB_LODS = getattr(settings, "IFC_GLB_LODS", 2)
+
+# 変換結果のキャッシュキーに含めるバージョン
+CONVERTER_VERSION = f"ifcopenshell-{ifcopenshell.version}"
+if GLB_OPTIMIZE:
+    CONVERTER_VERSION += f"+{OPTIMIZER_VERSION}-lod{GLB_LODS}"
+
+# 変換タスクの分け方（split_strategies.STRATEGIES）と、コストをならす並列数
+SPLIT_STRATEGY = getattr(settings, "IFC_SPLIT_STRATEGY", "balanced")
+SPLIT_WORKERS = getattr(settings, "IFC_SPLIT_WORKERS", converter_service.WORKERS)
+# 分割 IFC の圧縮（None / "gzip" / "ifczip"）。変換サービスは展開して読む
+SPLIT_COMPRESSION = getattr(settings, "IFC_SPLIT_COMPRESSION", None)
+# 指紋の計算・分割で保持する ID 集合のメモリ予算（超えたらディスクに退避し、クロージャは使い回さない）
+MEMORY_BUDGET_BYTES = getattr(settings, "IFC_MEMORY_BUDGET_BYTES", 4 * 1024 ** 3)
+
+# アップロード・分割 IFC・GLB・ジョブ結果をハッシュをキーに保存
+content_store = ContentStore(kinds=("uploads", "split", "glb", "jobs"))
+
+
+def glb_hit(glb_path):
+    """GLB（最適化する場合は LOD も）がキャッシュにあれば最終利用時刻を更新して True"""
+    lods = [lod_path(glb_path, level) for level in range(1, GLB_LODS + 1)] if GLB_OPTIMIZE else []
+    return content_store.hit(glb_path, lods)
+
+
+def job_manifest_path(file_hash):
+    """同じファイル・同じ分割/変換オプションのジョブ結果"""
+    key = content_store.key(file_hash, SPLITTER_VERSION, CONVERTER_VERSION, SPLIT_STRATEGY, SPLIT_WORKERS)
+    return content_store.path("jobs", key, ".json")
+
+
+def load_job_manifest(file_hash):
+    """完了済みジョブの結果（GLB がすべて残っている場合のみ）"""
+    path = job_manifest_path(file_hash)
+    if not content_store.hit(path):
+        return None
+    manifest = json.loads(path.read_text())
+    if not all(glb_hit(p) for p in manifest["paths"]):
+        return None
+    return manifest
+
+
+def revision_path(project):
+    """プロジェクトの最新リビジョン（階層 GlobalId → 指紋・チャンクごとの GLB）"""
+    key = content_store.key(project, SPLITTER_VERSION, CONVERTER_VERSION)
+    return content_store.path("revisions", key, ".json")
+
+
+def save_revision(project, parts, done):
+    """全チャンクを変換できた階層だけ記録し、次のリビジョンで再利用できるようにする"""
+    revision = {}
+    for p in parts:
+        if p.get("fingerprint"):
+            entry = revision.setdefault(p["global_id"], {"fingerprint": p["fingerprint"], "parts": []})
+            entry["parts"].append({"storey": p["storey"], "glb": p["glb"]})
+    revision = {
+        global_id: entry for global_id, entry in revision.items()
+        if all(r["storey"] in done for r in entry["parts"])
+    }
+    tmp_path = content_store.temp_path("revisions", ".json")
+    tmp_path.write_text(json.dumps(revision))
+    content_store.commit(tmp_path, revision_path(project))
+
+
+def _convert(ifc_path, output_path, stats):
+    """
+    常駐変換サービス（ifcopenshell 読み込み済みのワーカー）に投げ、時間・バイト数・RSS を stats に記録
+    GLB を最適化した場合は LOD の URL（lod1, lod2 … の順に粗くなる）を返す
+    """
+    stats["bytes_in"] = os.path.getsize(ifc_path)
+    metrics.add_bytes("convert", "in", stats["bytes_in"])
+    with metrics.timed("convert", stats):
+        result = converter_service.convert(ifc_path, output_path)
+    stats["elements"] = result["elements"]
+    stats["peak_rss"] = metrics.record_peak_rss("convert", result["peak_rss"])
+    if GLB_OPTIMIZE:
+        with metrics.timed("optimize", stats):
+            optimized = optimize_glb(output_path, lods=GLB_LODS)
+        stats["draw_calls"] = optimized["draw_calls"]
+        stats["draw_calls_in"] = optimized["draw_calls_in"]
+    stats["bytes_out"] = os.path.getsize(output_path)
+    metrics.add_bytes("convert", "out", stats["bytes_out"])
+    return [content_store.url(p) for p in optimized["lods"]] if GLB_OPTIMIZE else []
+
+
+@shared_task
+def convert_ifc_to_glb(ifc_path, output_path, job_id=None, storey=None, enqueued_at=None):
+    stats = {}
+    if enqueued_at is not None:
+        stats["queue_wait_seconds"] = round(time.time() - enqueued_at, 3)
+        metrics.observe("queue_wait", stats["queue_wait_seconds"])
+
+    if job_id is None:
+        _convert(ifc_path, output_path, stats)
+        return output_path
+
+    # パイプライン内では失敗を結果として集約タスクに渡す
+    progress.set_storey_status(job_id, storey, "running")
+    try:
+        lods = _convert(ifc_path, output_path, stats)
+    except Exception as e:
+        progress.set_storey_status(job_id, storey, "failed", error=str(e))
+        return {"storey": storey, "glb": None, "error": str(e), "metrics": stats}
+
+    progress.set_storey_status(job_id, storey, "success", glb=output_path, lods=lods, metrics=stats)
+    return {"storey": storey, "glb": output_path, "lods": lods, "metrics": stats}
+
+
+def job_metrics(parts, results):
+    """階層ごとの分割・変換の計測値と、ジョブ全体の合計（RSS は最大）"""
+    storeys = {}
+    for entry in list(parts) + list(results):
+        if entry.get("metrics"):
+            storeys.setdefault(entry["storey"], {}).update(entry["metrics"])
+
+    totals = {}
+    for values in storeys.values():
+        for name, value in values.items():
+            if value is None:
+                continue
+            if name.endswith("peak_rss"):
+                totals[name] = max(totals.get(name, 0), value)
+            else:
+                totals[name] = round(totals.get(name, 0) + value, 3)
+    return {"storeys": storeys, "totals": totals}
+
 
 @shared_task
-def convert_ifc_to_glb(ifc_path, output_path):
-    cmd = ["IfcConvert", ifc_path, output_path]
-    subprocess.run(cmd, check=True)
-    return output_path
+def collect_glbs(results, job_id, parts, cached, file_hash, project=None):
+    """chord の集約タスク：全階層の変換結果（キャッシュ済みを含む）をまとめる"""
+    results = list(results) + list(cached)
+    done = {r["storey"] for r in results if r.get("glb")}
+    failed = [r["storey"] for r in results if not r.get("glb")]
+    glb_files = [p["url"] for p in parts if p["storey"] in done]
+
+    if not failed:
+        status = "success"
+    elif glb_files:
+        status = "partial"
+    else:
+        status = "failed"
+
+    # 全階層そろったジョブは次回の同一アップロードでそのまま返す
+    if status == "success":
+        manifest = {"glb_files": glb_files, "paths": [p["glb"] for p in parts]}
+        tmp_path = content_store.temp_path("jobs", ".json")
+        tmp_path.write_text(json.dumps(manifest))
+        content_store.commit(tmp_path, job_manifest_path(file_hash))
+    if project and glb_files:
+        save_revision(project, parts, done)
+
+    job = progress.get_job(job_id) or {}
+    stats = job_metrics(parts, results)
+    if job.get("split_metrics"):
+        stats["totals"].update(job["split_metrics"])
+    if job.get("created_at"):
+        stats["totals"]["job_seconds"] = round(time.time() - job["created_at"], 3)
+    metrics.job_finished(status, stats["totals"].get("job_seconds"))
+
+    progress.update_job(job_id, status=status, glb_files=glb_files, failed=failed, metrics=stats)
+    content_store.evict()
+    return {"job_id": job_id, "status": status, "glb_files": glb_files, "metrics": stats}
+
+
+@shared_task
+def split_and_convert(ifc_path, file_hash, job_id, project=None):
+    """
+    分割 → 階層ごとの GLB 変換（並列）→ 集約 のパイプライン
+    分割はリクエスト外（ワーカー）で行い、どのタスクも他を待たない
+    分割 IFC・GLB はキャッシュにあれば再利用する
+    project を指定した場合は前回リビジョンと階層ごとの指紋を比べ、変わった階層だけ分割・変換する
+    """
+    progress.update_job(job_id, status="splitting")
+    fingerprints = {}
+    reused = {}
+    # 指紋の計算で収集した、変わった階層のクロージャ（分割で使ったら手放す）
+    closures = {}
+    split_metrics = {}
+    budget = MemoryBudget(MEMORY_BUDGET_BYTES)
+    try:
+        if project:
+            previous = load_revision(revision_path(project))
+            with metrics.timed("fingerprint", split_metrics), metrics.peak_rss("fingerprint", split_metrics):
+                fingerprints = storey_fingerprints(ifc_path, previous, closures, budget)
+            changed, unchanged = diff_revisions(previous, fingerprints)
+            for global_id in unchanged:
+                # 前回の GLB が削除済みなら変わった階層として扱う
+                if all(glb_hit(r["glb"]) for r in previous[global_id]["parts"]):
+                    reused[global_id] = previous[global_id]["parts"]
+                else:
+                    changed.add(global_id)
+            progress.update_job(job_id, changed_storeys=len(changed), reused_storeys=len(reused))
+
+        parts = split_ifc_by_storey_cached(
+            ifc_path, file_hash, content_store,
+            global_ids=set(fingerprints) - set(reused) if project else None,
+            strategy=SPLIT_STRATEGY, workers=SPLIT_WORKERS, compression=SPLIT_COMPRESSION, closures=closures,
+            budget=budget, peaks=split_metrics,
+        )
+        closures.clear()
+        manifest_path = write_chunk_manifest(parts, file_hash, SPLIT_STRATEGY, SPLIT_WORKERS, content_store)
+    except Exception as e:
+        progress.update_job(job_id, status="failed", error=str(e))
+        metrics.job_finished("failed")
+        raise
+
+    if not parts:
+        progress.update_job(job_id, status="failed", error="No IfcBuildingStorey found")
+        return {"job_id": job_id, "status": "failed"}
+
+    # 変わらない階層は今回の分け方に関係なく前回のチャンク（GLB）をそのまま使う
+    if reused:
+        merged = []
+        for part in parts:
+            global_id = part["global_id"]
+            if global_id not in reused:
+                merged.append(part)
+            elif not any(p["global_id"] == global_id for p in merged):
+                merged.extend(
+                    {"storey": r["storey"], "global_id": global_id, "ifc": None, "cost": None, "glb": r["glb"]}
+                    for r in reused[global_id]
+                )
+        parts = merged
+
+    progress.start_storeys(job_id, [p["storey"] for p in parts])
+    # このジョブの分割中の最大 RSS（段階ごとにリセットして測った値の最大）
+    split_metrics["split_peak_rss"] = max(
+        (value for key, value in split_metrics.items() if key.endswith("_peak_rss")), default=0
+    )
+    progress.update_job(job_id, chunk_manifest=content_store.url(manifest_path), split_metrics=split_metrics)
+
+    # GLB は (分割 IFC のハッシュ, 変換バージョン) がキー
+    cached = []
+    tasks = []
+    for part in parts:
+        if part["global_id"] in fingerprints:
+            part["fingerprint"] = fingerprints[part["global_id"]]["fingerprint"]
+
+        if part.get("glb"):
+            glb_path = part["glb"]
+        else:
+            glb_key = content_store.key(hash_file(part["ifc"]), CONVERTER_VERSION)
+            glb_path = content_store.path("glb", glb_key, ".glb")
+        part["glb"] = str(glb_path)
+        part["url"] = content_store.url(glb_path)
+
+        if part["global_id"] in reused or glb_hit(glb_path):
+            progress.set_storey_status(job_id, part["storey"], "success", glb=part["glb"], cached=True)
+            cached.append({"storey": part["storey"], "glb": part["glb"]})
+        else:
+            tasks.append(convert_ifc_to_glb.s(part["ifc"], part["glb"], job_id, part["storey"], time.time()))
+
+    callback = collect_glbs.s(job_id, parts, cached, file_hash, project)
+    if tasks:
+        chord(group(tasks))(callback)
+    else:
+        callback.delay([])
+
+    return {"job_id": job_id, "status": "converting", "storeys": [p["storey"] for p in parts], "cached": len(cached)}
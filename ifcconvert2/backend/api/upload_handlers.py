@@ -0,0 +1,176 @@
+import struct
+import zlib
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+# 展開後の IFC のサイズ上限（ifczip の展開後も含む）
+MAX_BYTES = getattr(settings, "IFC_UPLOAD_MAX_BYTES", 4 * 1024 ** 3)
+
+IFC_MAGIC = b"ISO-10303-21"
+ZIP_MAGIC = b"PK\x03\x04"
+ZIP_HEADER = struct.Struct("<4sHHHHHIIIHH")
+ZIP_DEFLATED = 8
+ZIP_STORED = 0
+
+
+class UploadRejected(Exception):
+    pass
+
+
+class IfcZipStream:
+    """
+    ifczip（先頭エントリが IFC の zip）を先頭から順に展開する
+    ローカルファイルヘッダーだけを読むので、全体を受信する前から書き出せる
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._decompressor = None
+        self._remaining = None
+        self.done = False
+
+    def _read_header(self):
+        if len(self._buffer) < ZIP_HEADER.size:
+            return False
+        (_, _, flags, method, _, _, _, compressed_size, _, name_len, extra_len) = ZIP_HEADER.unpack_from(self._buffer)
+        end = ZIP_HEADER.size + name_len + extra_len
+        if len(self._buffer) < end:
+            return False
+
+        name = self._buffer[ZIP_HEADER.size:ZIP_HEADER.size + name_len].decode("utf-8", "replace")
+        if not name.lower().endswith(".ifc"):
+            raise UploadRejected(f"ifczip entry is not an IFC file: {name}")
+        if method == ZIP_DEFLATED:
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        elif method == ZIP_STORED and not flags & 0x08:
+            self._remaining = compressed_size
+        else:
+            raise UploadRejected(f"Unsupported ifczip compression method: {method}")
+        self._buffer = self._buffer[end:]
+        return True
+
+    def feed(self, chunk):
+        """受信したチャンクを渡し、展開できたバイト列を返す"""
+        if self.done:
+            return b""
+        self._buffer += chunk
+        if self._decompressor is None and self._remaining is None and not self._read_header():
+            return b""
+
+        data, self._buffer = self._buffer, b""
+        if self._decompressor is not None:
+            out = self._decompressor.decompress(data)
+            self.done = self._decompressor.eof
+            return out
+
+        out = data[:self._remaining]
+        self._remaining -= len(out)
+        self.done = self._remaining == 0
+        return out
+
+
+class StoredUpload(UploadedFile):
+    """ContentStore に保存済みのアップロード（ファイルの中身は持たない）"""
+
+    def __init__(self, name, path, file_hash, size, compressed_size, content_type=None):
+        super().__init__(file=None, name=name, content_type=content_type, size=size)
+        self.path = path
+        self.file_hash = file_hash
+        self.compressed_size = compressed_size
+
+
+class IfcIngestUploadHandler(FileUploadHandler):
+    """
+    受信中に IFC をそのまま ContentStore に書き込む（一時ファイルへの二重書き込みをしない）
+    書き込みと同時に SHA-256 を計算し、サイズ上限を確認し、ifczip なら展開する
+    """
+
+    def __init__(self, request, store, field_name="ifc_file", kind="uploads", max_bytes=MAX_BYTES):
+        super().__init__(request)
+        self.store = store
+        self.field = field_name
+        self.kind = kind
+        self.max_bytes = max_bytes
+        self.error = None
+        self.status = None
+        self._writer = None
+        self._unzip = None
+        self._received = 0
+        self._checked = False
+        self._head = b""
+
+    def check_length(self, content_length):
+        """
+        リクエストの Content-Length が上限を超えていれば 413 として記録し、False を返す
+        request.FILES に触れる前にビューから呼ぶ（handle_raw_input で StopUpload を投げると 500 になる）
+        """
+        if content_length and content_length > self.max_bytes:
+            self.error, self.status = f"Upload exceeds {self.max_bytes} bytes", 413
+        return self.error is None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # 記録だけして例外は投げない（new_file で書き込みを始めない）
+        self.check_length(content_length)
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        if field_name != self.field or self.error:
+            return
+        self._writer = self.store.open_stream(self.kind, ".ifc")
+        self._unzip = IfcZipStream() if file_name.lower().endswith(".ifczip") else None
+        self._received = 0
+        self._checked = False
+        self._head = b""
+
+    def _reject(self, message, status=400):
+        self.error, self.status = message, status
+        self._writer.abort()
+        self._writer = None
+        raise StopUpload(connection_reset=True)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self._writer is None:
+            # 対象外のファイルフィールドは読み捨てる
+            return None
+
+        self._received += len(raw_data)
+        if not self._checked and self._unzip is None and raw_data.startswith(ZIP_MAGIC):
+            self._unzip = IfcZipStream()
+        try:
+            data = self._unzip.feed(raw_data) if self._unzip is not None else raw_data
+        except (UploadRejected, zlib.error) as e:
+            self._reject(str(e))
+
+        if self._writer.size + len(self._head) + len(data) > self.max_bytes:
+            self._reject(f"IFC exceeds {self.max_bytes} bytes", 413)
+        if not self._checked:
+            # 展開直後のチャンクは短いことがあるので、先頭の空白を除いて IFC_MAGIC の長さまで溜めてから判定する
+            self._head += data
+            if len(self._head.lstrip()) < len(IFC_MAGIC):
+                return None
+            data, self._head = self._head, b""
+            self._checked = True
+            if not data.lstrip().startswith(IFC_MAGIC):
+                self._reject("Not an IFC (STEP) file")
+        if data:
+            self._writer.write(data)
+        return None
+
+    def file_complete(self, file_size):
+        if self._writer is None:
+            return None
+        writer, self._writer = self._writer, None
+        if not self._checked or (self._unzip is not None and not self._unzip.done):
+            writer.abort()
+            self.error, self.status = "Empty or truncated IFC upload", 400
+            return None
+
+        file_hash, path, size = writer.commit()
+        return StoredUpload(self.file_name, path, file_hash, size, self._received, self.content_type)
+
+    def upload_interrupted(self):
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
@@ -1,6 +1,8 @@
 from django.urls import path
-from .views import convert_ifc
+from .views import convert_ifc, conversion_status, metrics_view
 
 urlpatterns = [
     path("convert_ifc/", convert_ifc, name="convert_ifc"),
+    path("convert_ifc/<str:job_id>/", conversion_status, name="conversion_status"),
+    path("metrics/", metrics_view, name="metrics"),
 ]
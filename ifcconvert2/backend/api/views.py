@@ -1,36 +1,66 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.conf import settings
-from pathlib import Path
-from .ifc_splitter import split_ifc_by_storey
-from .tasks import convert_ifc_to_glb
-import os
+from django.views.decorators.http import condition
+from .tasks import content_store, load_job_manifest, split_and_convert
+from .upload_handlers import IfcIngestUploadHandler
+from ifc_common import progress
+from . import metrics
+import time
+import uuid
 
 @csrf_exempt
 def convert_ifc(request):
     if request.method != "POST":
         return JsonResponse({"error": "POST required"}, status=400)
 
-    uploaded_file = request.FILES["ifc_file"]
-    input_path = Path(settings.MEDIA_ROOT) / "uploads" / uploaded_file.name
-    input_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(input_path, "wb") as f:
-        for chunk in uploaded_file.chunks():
-            f.write(chunk)
-
-    # 階層ごとに分割
-    split_dir = Path(settings.MEDIA_ROOT) / "split"
-    split_files = split_ifc_by_storey(str(input_path), str(split_dir))
-
-    # GLB変換をCeleryで並列実行
-    glb_urls = []
-    glb_dir = Path(settings.MEDIA_ROOT) / "converted"
-    glb_dir.mkdir(parents=True, exist_ok=True)
-
-    for split_file in split_files:
-        name = Path(split_file).stem
-        glb_path = glb_dir / f"{name}.glb"
-        convert_ifc_to_glb.delay(str(split_file), str(glb_path))
-        glb_urls.append(os.path.join(settings.MEDIA_URL, "converted", f"{name}.glb"))
-
-    return JsonResponse({"glb_files": glb_urls})
+    # 受信しながらハッシュ計算・サイズ確認・ifczip 展開を行い、内容のハッシュをファイル名にして保存
+    # （request.POST / FILES に触れる前にハンドラーを差し替える）
+    handler = IfcIngestUploadHandler(request, content_store)
+    try:
+        content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        content_length = 0
+    if not handler.check_length(content_length):
+        return JsonResponse({"error": handler.error}, status=handler.status)
+    request.upload_handlers = [handler]
+    uploaded_file = request.FILES.get("ifc_file")
+    if handler.error:
+        return JsonResponse({"error": handler.error}, status=handler.status)
+    if uploaded_file is None:
+        return JsonResponse({"error": "ifc_file required"}, status=400)
+    file_hash, input_path = uploaded_file.file_hash, uploaded_file.path
+    metrics.add_bytes("upload", "in", uploaded_file.compressed_size)
+
+    # 同じプロジェクトの前回リビジョンと比べ、変わった階層だけ変換する
+    project = request.POST.get("project") or None
+
+    # 同じ内容のファイルが変換済みなら即座に返す
+    manifest = load_job_manifest(file_hash)
+    if manifest is not None:
+        return JsonResponse({"status": "success", "cached": True, "file_hash": file_hash, "glb_files": manifest["glb_files"]})
+
+    # 分割・GLB変換はすべて Celery 側で実行（リクエスト内では待たない）
+    job_id = uuid.uuid4().hex
+    progress.create_job(job_id, file_hash=file_hash, project=project, size=uploaded_file.size, created_at=time.time())
+    split_and_convert.apply_async((str(input_path), file_hash, job_id, project), task_id=job_id)
+
+    return JsonResponse({"job_id": job_id, "status": "queued", "file_hash": file_hash}, status=202)
+
+
+def job_etag(request, job_id):
+    """ジョブ状態の版数から ETag を作る（変化がなければ 304 を返し、状態は読まない）"""
+    version = progress.get_version(job_id)
+    return f"{job_id}-{version}" if version is not None else None
+
+
+@condition(etag_func=job_etag)
+def conversion_status(request, job_id):
+    job = progress.get_job(job_id)
+    if job is None:
+        return JsonResponse({"error": "job not found"}, status=404)
+    return JsonResponse({"job_id": job_id, **job})
+
+
+def metrics_view(request):
+    """Prometheus 形式の計測値（段階ごとの時間・バイト数・最大 RSS、ジョブ数）"""
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4")
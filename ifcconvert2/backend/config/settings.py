@@ -21,3 +21,13 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = os.environ.get("CELERY_RESULT_BACKEND")
+
+# ジョブ進捗（ワーカー間で共有するため Redis を使用）
+CACHE_URL = os.environ.get("CACHE_URL", CELERY_BROKER_URL)
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+        }
+    }
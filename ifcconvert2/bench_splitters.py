@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+# -----------------------------------------------------
+# 分割処理のベンチマーク
+#
+# 合成 IFC（synthetic_ifc.py）をプリセットごとに生成し、
+# split_ifc_by_storey / split_ifc_by_storey_and_type（全体読み込み・--indexed）と
+# Celery タスク本体（eager モード）を別プロセスで実行して、
+# 実行時間・最大メモリ・出力バイト数・オブジェクト数を JSON の履歴に追記する。
+# 前回の同じプリセットの結果との差も表示する。
+#
+# 実行方法
+# python3 bench_splitters.py                          # small
+# python3 bench_splitters.py --preset small medium --jobs 4
+# python3 bench_splitters.py --preset large --celery  # Celery タスク本体も計測
+# -----------------------------------------------------
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from synthetic_ifc import generate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(HERE, "backend")
+DEFAULT_HISTORY = os.path.join(HERE, "bench_history.json")
+
+# プリセット：合成 IFC の生成パラメータ
+PRESETS = {
+    "small": {"storeys": 5, "elements": 1000, "shared": 0.5, "segments": 8, "skew": 0.0},
+    "medium": {"storeys": 20, "elements": 20000, "shared": 0.5, "segments": 12, "skew": 0.3},
+    "large": {"storeys": 40, "elements": 200000, "shared": 0.6, "segments": 16, "skew": 0.5},
+}
+
+# ベンチマーク名 → スクリプトと追加引数
+SCRIPTS = {
+    "storey": ("split_ifc_by_storey.py", []),
+    "storey_indexed": ("split_ifc_by_storey.py", ["--indexed"]),
+    "storey_and_type": ("split_ifc_by_storey_and_type.py", []),
+    "storey_and_type_indexed": ("split_ifc_by_storey_and_type.py", ["--indexed"]),
+}
+
+
+def output_stats(directory):
+    """出力 IFC の (ファイル数, バイト数, エンティティ数)"""
+    files = size = objects = 0
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if not name.endswith(".ifc"):
+                continue
+            path = os.path.join(root, name)
+            files += 1
+            size += os.path.getsize(path)
+            with open(path, "rb") as f:
+                objects += sum(1 for line in f if line.startswith(b"#"))
+    return files, size, objects
+
+
+def bench_script(name, ifc_path, workdir, jobs):
+    script, extra = SCRIPTS[name]
+    output_dir = os.path.join(workdir, name)
+    cmd = [sys.executable, os.path.join(HERE, script), ifc_path, output_dir, "--jobs", str(jobs)] + extra
+    return _measure(cmd, output_dir, cwd=HERE)
+
+
+def bench_celery(ifc_path, workdir):
+    """backend の split_and_convert を eager モードで実行（変換サービスがなければ変換は失敗として記録される）"""
+    media_root = os.path.join(workdir, "celery_media")
+    cmd = [sys.executable, os.path.abspath(__file__), "--celery-run", ifc_path, media_root]
+    return _measure(cmd, os.path.join(media_root, "split"), cwd=BACKEND_DIR)
+
+
+def _measure(cmd, output_dir, cwd):
+    # 子プロセスの最大メモリを個別に取るため、Popen.wait ではなく wait4 で回収する
+    # （Linux の ru_maxrss は KiB）。標準エラーはパイプ詰まりを避けて一時ファイルへ
+    t0 = time.perf_counter()
+    with tempfile.TemporaryFile() as err:
+        process = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=err)
+        stdout = process.stdout.read()
+        process.stdout.close()
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.perf_counter() - t0
+        err.seek(0)
+        stderr = err.read()
+
+    result = {
+        "ok": process.returncode == 0,
+        "seconds": round(elapsed, 3),
+        "peak_rss": usage.ru_maxrss * 1024,
+    }
+    if process.returncode != 0:
+        lines = stderr.decode("utf-8", "replace").strip().splitlines()
+        result["error"] = lines[-1] if lines else f"exit {process.returncode}"
+        return result
+
+    files, size, objects = output_stats(output_dir)
+    result.update(files=files, output_bytes=size, objects=objects)
+    # Celery 実行では タスク結果（段階ごとの計測値）を最後の行に JSON で出力する
+    last = stdout.decode("utf-8", "replace").strip().splitlines()[-1:]
+    if last and last[0].startswith("{"):
+        result["task"] = json.loads(last[0])
+    return result
+
+
+def celery_run(ifc_path, media_root):
+    """（子プロセス）Django を初期化して split_and_convert を eager 実行し、結果を JSON で出力"""
+    sys.path.insert(0, BACKEND_DIR)
+    # 共有モジュール（ifc_common）
+    sys.path.insert(0, os.path.dirname(HERE))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    import django
+    from django.conf import settings
+
+    django.setup()
+    # ContentStore は import 時に MEDIA_ROOT を読むので tasks より先に差し替える
+    settings.MEDIA_ROOT = media_root
+
+    from config.celery import app
+    app.conf.task_always_eager = True
+    app.conf.task_store_eager_result = False
+
+    from ifc_common.content_store import hash_file
+    from api.tasks import split_and_convert
+
+    job_id = uuid.uuid4().hex
+    result = split_and_convert.apply(args=(ifc_path, hash_file(ifc_path), job_id)).get()
+    from ifc_common import progress
+    job = progress.get_job(job_id) or {}
+    print(json.dumps({
+        "status": job.get("status", result.get("status")),
+        "storeys": len(result.get("storeys", [])),
+        "metrics": job.get("metrics", {}).get("totals"),
+    }))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def previous_run(history, preset):
+    for entry in reversed(history):
+        if entry["preset"] == preset:
+            return entry
+    return None
+
+
+def delta(current, previous):
+    if not previous:
+        return ""
+    return f" ({(current - previous) * 100 / previous:+.1f}%)"
+
+
+def print_results(entry, previous):
+    print(f"📊 {entry['preset']} ({entry['input_bytes'] / 1024 ** 2:.1f} MB, {entry['entities']} entities)")
+    prev_results = previous["results"] if previous else {}
+    for name, result in entry["results"].items():
+        if not result["ok"]:
+            print(f"  ❌ {name}: {result['error']}")
+            continue
+        prev = prev_results.get(name) if prev_results.get(name, {}).get("ok") else {}
+        print(
+            f"  ⏱ {name}: {result['seconds']:.2f}s{delta(result['seconds'], prev.get('seconds'))}"
+            f" / RSS {result['peak_rss'] / 1024 ** 2:.0f} MB{delta(result['peak_rss'], prev.get('peak_rss'))}"
+            f" / {result['output_bytes'] / 1024 ** 2:.1f} MB out, {result['objects']} objects in {result['files']} files"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分割処理のベンチマーク（合成 IFC）")
+    parser.add_argument("--preset", nargs="+", choices=PRESETS, default=["small"])
+    parser.add_argument("--bench", nargs="+", choices=SCRIPTS, default=list(SCRIPTS), help="実行するスクリプト")
+    parser.add_argument("--celery", action="store_true", help="Celery タスク本体（eager）も計測")
+    parser.add_argument("--jobs", "-j", type=int, default=1)
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="結果を追記する JSON ファイル")
+    parser.add_argument("--workdir", default=None, help="合成 IFC と出力の置き場所（省略時は一時ディレクトリ）")
+    parser.add_argument("--celery-run", nargs=2, metavar=("IFC", "MEDIA_ROOT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.celery_run:
+        celery_run(*args.celery_run)
+        return
+
+    history = load_history(args.history)
+    revision = git_revision()
+
+    for preset in args.preset:
+        workdir = tempfile.mkdtemp(prefix=f"bench-{preset}-", dir=args.workdir)
+        try:
+            ifc_path = os.path.join(workdir, f"{preset}.ifc")
+            print(f"🧪 Generating {preset}: {PRESETS[preset]}")
+            entities = generate(ifc_path, **PRESETS[preset])
+
+            results = {}
+            for name in args.bench:
+                results[name] = bench_script(name, ifc_path, workdir, args.jobs)
+            if args.celery:
+                results["celery_split_and_convert"] = bench_celery(ifc_path, workdir)
+
+            entry = {
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "revision": revision,
+                "preset": preset,
+                "params": PRESETS[preset],
+                "jobs": args.jobs,
+                "input_bytes": os.path.getsize(ifc_path),
+                "entities": entities,
+                "results": results,
+            }
+            print_results(entry, previous_run(history, preset))
+            history.append(entry)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.history, "w", encoding="utf-8") as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+    print(f"📝 History: {args.history}")
+
+
+if __name__ == "__main__":
+    main()
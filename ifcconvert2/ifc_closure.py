@@ -0,0 +1,142 @@
+# -----------------------------------------------------
+# IFC 参照クロージャ（前方参照の推移閉包）の計算
+#
+# 配置・表現コンテキスト・OwnerHistory・材料・タイプなど
+# 複数の階層から共有されるリソースのクロージャはメモ化し、
+# 1回の実行内で全階層から再利用する
+# -----------------------------------------------------
+
+import ifcopenshell
+import ifcopenshell.util.element
+
+# クロージャをメモ化する共有リソースのクラス（サブクラスも含む）
+SHARED_CLASSES = (
+    "IfcOwnerHistory",
+    "IfcRepresentationContext",
+    "IfcObjectPlacement",
+    "IfcUnitAssignment",
+    "IfcTypeObject",
+    "IfcRepresentationMap",
+    "IfcMaterialDefinition",  # IFC4
+    "IfcMaterial",
+    "IfcMaterialLayerSet",
+    "IfcMaterialLayerSetUsage",
+    "IfcMaterialList",
+    "IfcPresentationStyle",
+    "IfcPresentationStyleAssignment",  # IFC2X3
+)
+
+
+def iter_references(entity):
+    """エンティティが直接参照しているエンティティを列挙（インライン値は除く）"""
+    stack = [entity[i] for i in range(len(entity))]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, ifcopenshell.entity_instance):
+            if value.id():
+                yield value
+        elif isinstance(value, (tuple, list)):
+            stack.extend(value)
+
+
+class ClosureIndex:
+    """前方参照クロージャのメモ表（1モデル・1実行で共有）"""
+
+    def __init__(self, model):
+        self.model = model
+        self.memo = {}
+        self.hits = 0
+        self.misses = 0
+        self._shared_types = {}
+
+    def is_shared(self, entity):
+        """共有リソース判定（クラス名ごとにキャッシュ）"""
+        name = entity.is_a()
+        shared = self._shared_types.get(name)
+        if shared is None:
+            shared = any(entity.is_a(c) for c in SHARED_CLASSES)
+            self._shared_types[name] = shared
+        return shared
+
+    def closure(self, entity):
+        """entity から前方参照で到達できる全エンティティのID集合"""
+        root_id = entity.id()
+        cached = self.memo.get(root_id)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+
+        result = set()
+        stack = [entity]
+        while stack:
+            current = stack.pop()
+            current_id = current.id()
+            if current_id in result:
+                continue
+            if current_id != root_id and self.is_shared(current):
+                result |= self.closure(current)
+                continue
+            result.add(current_id)
+            stack.extend(iter_references(current))
+
+        result = frozenset(result)
+        if self.is_shared(entity):
+            self.memo[root_id] = result
+        return result
+
+    def roots(self, product):
+        """product 自身と、逆参照でしか辿れない関連（スタイル・タイプ・材料）"""
+        yield product
+        try:
+            yield from ifcopenshell.util.element.get_styled_items(product)
+        except Exception:
+            pass
+        try:
+            element_type = ifcopenshell.util.element.get_type(product)
+            if element_type and element_type != product:
+                yield element_type
+        except Exception:
+            pass
+        try:
+            material = ifcopenshell.util.element.get_material(product)
+            if material:
+                yield material
+        except Exception:
+            pass
+
+    def product_closure(self, product, decompose=True):
+        """product（と分解構造の子要素）のクロージャの和集合"""
+        products = [product]
+        if decompose:
+            try:
+                products.extend(ifcopenshell.util.element.get_decomposition(product))
+            except Exception:
+                pass
+
+        ids = set()
+        for p in products:
+            for root in self.roots(p):
+                ids |= self.closure(root)
+        return ids
+
+    def warm(self):
+        """共有リソースのクロージャを事前計算（fork 前に呼ぶとワーカーで共有される）"""
+        for name in SHARED_CLASSES:
+            try:
+                entities = self.model.by_type(name)
+            except Exception:
+                continue
+            for entity in entities:
+                self.closure(entity)
+
+
+def build_model(model, ids):
+    """ID集合から新しいIFCモデルを作成"""
+    new_model = ifcopenshell.file(schema=model.schema)
+    for entity_id in sorted(ids):
+        try:
+            new_model.add(model.by_id(entity_id))
+        except Exception:
+            continue
+    return new_model
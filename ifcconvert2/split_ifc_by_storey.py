@@ -3,87 +3,205 @@
 # -----------------------------------------------------
 # 実行方法
 # python3 split_ifc_by_storey.py input.ifc output_dir/
+# python3 split_ifc_by_storey.py input.ifc output_dir/ --jobs 8   # 並列
+# python3 split_ifc_by_storey.py input.ifc output_dir/ --indexed  # 部分読み込み
+# python3 split_ifc_by_storey.py input.ifc output_dir/ --large-model --memory-budget 4 --jobs 4  # 大規模モデル
+# python3 split_ifc_by_storey.py input.ifc output_dir/ --indexed --compress gzip  # 圧縮して出力（.ifc.gz / .ifczip）
 # -----------------------------------------------------
 
-import sys
+import argparse
+import multiprocessing
 import os
+import sys
+import time
 import ifcopenshell
-import ifcopenshell.util.element
+from ifc_closure import ClosureIndex, build_model
 
-def collect_related_objects(model, product, collected):
-    """再帰的に関連要素・スタイルを収集"""
-    if product in collected:
-        return
-    collected.add(product)
-
-    # 材料・スタイル追跡
-    try:
-        styled_items = ifcopenshell.util.element.get_styled_items(product)
-        for item in styled_items:
-            collected.add(item)
-            if getattr(item, "Styles", None):
-                for s in item.Styles:
-                    collected.add(s)
-    except Exception:
-        pass
-
-    # 子要素（分解構造）
-    try:
-        for sub in ifcopenshell.util.element.get_decomposition(product):
-            collect_related_objects(model, sub, collected)
-    except Exception:
-        pass
-
-def export_storey(model, storey, output_dir):
+# 共有モジュール（リポジトリ直下の ifc_common）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ifc_common.step_index import COMPRESSION_SUFFIXES, MemoryBudget, StepIndex, open_output  # noqa: E402
+
+# このサイズ以上の IFC は大規模モデルモードで処理する
+LARGE_MODEL_MIN_BYTES = 1024 ** 3
+LARGE_MODEL_BUDGET_GB = 4.0
+
+
+def report(output_path, count, written):
+    """出力の報告（圧縮した場合は減ったバイト数も）"""
+    stored = os.path.getsize(output_path)
+    saved = f", {written / 1024 ** 2:.1f} → {stored / 1024 ** 2:.1f} MB" if written != stored else ""
+    print(f"✅ Exported: {output_path}  (objects: {count}{saved})")
+
+
+def write_model(model, output_path):
+    """モデルを保存し、書き込んだバイト数（圧縮前）を返す（.gz / .ifczip は圧縮）"""
+    if output_path.endswith(".ifc"):
+        model.write(output_path)
+        return os.path.getsize(output_path)
+    data = model.to_string().encode("utf-8")
+    with open_output(output_path) as f:
+        f.write(data)
+    return len(data)
+
+
+def export_storey(model, closures, storey, output_dir, compression=None):
     """指定階層を抽出して新しいIFCに保存"""
     storey_name = storey.Name or f"Storey_{storey.id()}"
     safe_name = "".join(c if c.isalnum() else "_" for c in storey_name)
-    output_path = os.path.join(output_dir, f"floor_{safe_name}.ifc")
+    output_path = os.path.join(output_dir, f"floor_{safe_name}{COMPRESSION_SUFFIXES[compression]}")
 
-    new_model = ifcopenshell.file(schema=model.schema)
-    collected = set()
-    collect_related_objects(model, storey, collected)
+    # 階層（分解構造の子要素を含む）のクロージャ
+    collected = closures.product_closure(storey)
 
-    # 階層内の要素を収集
+    # 階層内の要素を収集（分解構造で収集済みのものは除く）
     for rel in getattr(storey, "ContainsElements", []) or []:
         for elem in rel.RelatedElements:
-            collect_related_objects(model, elem, collected)
-
-    # 参照付きで追加
-    for elem in collected:
-        try:
-            new_model.add(elem)
-        except Exception:
-            continue
-
-    new_model.write(output_path)
-    print(f"✅ Exported: {output_path}  (objects: {len(collected)})")
+            if elem.id() not in collected:
+                collected |= closures.product_closure(elem)
+
+    # キャッシュ済みクロージャの和集合から作成
+    new_model = build_model(model, collected)
+    written = write_model(new_model, output_path)
+    report(output_path, len(collected), written)
+    return len(collected)
+
+
+def export_storey_indexed(index, storey_id, storey_name, output_dir, budget_bytes=None, compression=None):
+    """
+    オフセット索引から階層のクロージャに含まれる行だけを読んで保存
+    budget_bytes を超えるとクロージャをディスクに退避する
+    """
+    storey_name = storey_name or f"Storey_{storey_id}"
+    safe_name = "".join(c if c.isalnum() else "_" for c in storey_name)
+    output_path = os.path.join(output_dir, f"floor_{safe_name}{COMPRESSION_SUFFIXES[compression]}")
+
+    count, written = index.extract_storey(storey_id, output_path, budget=MemoryBudget(budget_bytes))
+    report(output_path, count, written)
+    return count
+
+
+# === 並列実行（--jobs） ===
+# fork 可能な環境では親で読み込んだモデルをコピーオンライトで共有し、
+# それ以外（spawn）では各ワーカーで IFC を開き直す
+_MODEL = None
+_CLOSURES = None
+_INDEX = None
+_BUDGET = None
+_COMPRESSION = None
+
+
+def _init_worker(input_ifc, indexed, budget_bytes=None, compression=None):
+    global _MODEL, _CLOSURES, _INDEX, _BUDGET, _COMPRESSION
+    _BUDGET = budget_bytes
+    _COMPRESSION = compression
+    if indexed:
+        if _INDEX is None:
+            _INDEX = StepIndex.open(input_ifc)
+    elif _MODEL is None:
+        _MODEL = ifcopenshell.open(input_ifc)
+        _CLOSURES = ClosureIndex(_MODEL)
+
+
+def _export_job(job):
+    storey_id, storey_name, output_dir = job
+    t0 = time.perf_counter()
+    if _INDEX is not None:
+        count = export_storey_indexed(_INDEX, storey_id, storey_name, output_dir, _BUDGET, _COMPRESSION)
+        return storey_name, count, time.perf_counter() - t0
+
+    storey = _MODEL.by_id(storey_id)
+    count = export_storey(_MODEL, _CLOSURES, storey, output_dir, _COMPRESSION)
+    return storey.Name, count, time.perf_counter() - t0
+
+
+def run_exports(model, input_ifc, jobs, n_jobs, index=None, budget_bytes=None, max_tasks_per_child=None,
+                compression=None):
+    """
+    階層ごとのエクスポートを実行し (階層名, オブジェクト数, 秒) を返す
+    index を渡すとモデル全体を開かずにオフセット索引から抽出する
+    compression（"gzip" / "ifczip"）を指定すると圧縮して保存する
+    """
+    global _MODEL, _CLOSURES, _INDEX, _BUDGET, _COMPRESSION
+    _INDEX = index
+    _BUDGET = budget_bytes
+    _COMPRESSION = compression
+    if index is None:
+        _MODEL = model
+        _CLOSURES = ClosureIndex(model)
+
+    if n_jobs <= 1:
+        return [_export_job(job) for job in jobs]
+
+    # 共有リソースのクロージャを fork 前に計算しておく
+    if index is None:
+        _CLOSURES.warm()
+
+    method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    ctx = multiprocessing.get_context(method)
+    # max_tasks_per_child を指定するとその数の階層を処理したワーカーを入れ替える（メモリを返す）
+    with ctx.Pool(
+        n_jobs,
+        initializer=_init_worker,
+        initargs=(input_ifc, index is not None, budget_bytes, compression),
+        maxtasksperchild=max_tasks_per_child,
+    ) as pool:
+        return pool.map(_export_job, jobs, chunksize=1)
 
 
 def main():
-    if len(sys.argv) < 3:
-        print("Usage: python3 split_ifc_by_storey.py <input.ifc> <output_dir>")
-        sys.exit(1)
-
-    input_ifc = sys.argv[1]
-    output_dir = sys.argv[2]
+    parser = argparse.ArgumentParser(description="IFC を階層ごとに分割")
+    parser.add_argument("input_ifc")
+    parser.add_argument("output_dir")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="並列プロセス数")
+    parser.add_argument("--indexed", action="store_true", help="全体を開かずオフセット索引から部分抽出")
+    parser.add_argument("--large-model", action="store_true",
+                        help=f"大規模モデルモード（{LARGE_MODEL_MIN_BYTES // 1024 ** 3} GiB 以上は自動）")
+    parser.add_argument("--memory-budget", type=float, default=None, help="RSS の上限（GiB）。超えたらクロージャをディスクに退避")
+    parser.add_argument("--max-tasks-per-child", type=int, default=None, help="ワーカーを入れ替えるまでの階層数")
+    parser.add_argument("--compress", choices=["gzip", "ifczip"], default=None, help="圧縮して出力（.ifc.gz / .ifczip）")
+    args = parser.parse_args()
+
+    # 大規模モデル：部分抽出・メモリ予算・1階層ごとのワーカー入れ替え
+    if args.large_model or os.path.getsize(args.input_ifc) >= LARGE_MODEL_MIN_BYTES:
+        print("🐘 Large-model mode")
+        args.indexed = True
+        if args.memory_budget is None:
+            args.memory_budget = LARGE_MODEL_BUDGET_GB
+        if args.max_tasks_per_child is None:
+            args.max_tasks_per_child = 1
+    budget_bytes = int(args.memory_budget * 1024 ** 3) if args.memory_budget else None
+
+    input_ifc = args.input_ifc
+    output_dir = args.output_dir
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    print(f"📂 Loading IFC: {input_ifc}")
-    model = ifcopenshell.open(input_ifc)
+    model = index = None
+    if args.indexed:
+        print(f"📂 Indexing IFC: {input_ifc}")
+        index = StepIndex.open(input_ifc)
+        storeys = [(storey_id, name) for storey_id, _, name in index.storeys()]
+    else:
+        print(f"📂 Loading IFC: {input_ifc}")
+        model = ifcopenshell.open(input_ifc)
+        storeys = [(storey.id(), storey.Name) for storey in model.by_type("IfcBuildingStorey")]
 
-    storeys = model.by_type("IfcBuildingStorey")
     if not storeys:
         print("❌ No IfcBuildingStorey found in this IFC file.")
-        sys.exit(0)
+        return
 
     print(f"🏗 Found {len(storeys)} storeys.")
-    for storey in storeys:
-        export_storey(model, storey, output_dir)
-
-    print("🎉 All storeys exported successfully.")
+    t0 = time.perf_counter()
+    jobs = [(storey_id, name, output_dir) for storey_id, name in storeys]
+    results = run_exports(
+        model, input_ifc, jobs, args.jobs, index, budget_bytes, args.max_tasks_per_child, args.compress
+    )
+    elapsed = time.perf_counter() - t0
+
+    for name, count, sec in sorted(results, key=lambda r: r[2], reverse=True):
+        print(f"  ⏱ {name}: {count} objects, {sec:.2f}s")
+    print(f"🎉 All storeys exported successfully. ({elapsed:.2f}s, jobs={args.jobs})")
 
 
 if __name__ == "__main__":
@@ -3,109 +3,306 @@
 # -----------------------------------------------------
 # 実行方法
 # python3 split_ifc_by_storey_and_type.py input.ifc output/
+# python3 split_ifc_by_storey_and_type.py input.ifc output/ --jobs 8   # 並列
+# python3 split_ifc_by_storey_and_type.py input.ifc output/ --indexed  # 部分読み込み
+# python3 split_ifc_by_storey_and_type.py input.ifc output/ --large-model --memory-budget 4 --jobs 4  # 大規模モデル
+# python3 split_ifc_by_storey_and_type.py input.ifc output/ --indexed --compress gzip  # 圧縮して出力（.ifc.gz / .ifczip）
 # -----------------------------------------------------
 
 
-import sys
+import argparse
+import multiprocessing
 import os
+import sys
+import time
 import ifcopenshell
-import ifcopenshell.util.element
+from ifc_closure import ClosureIndex, build_model
+
+# 共有モジュール（リポジトリ直下の ifc_common）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ifc_common.step_index import COMPRESSION_SUFFIXES, MemoryBudget, StepIndex, is_subtype, open_output, refs_in, schema_of  # noqa: E402
 
 # === 🔧 設定項目 ===
-# 分割したい要素タイプ（部分一致でもOK）
+# 分割したい要素タイプ（クラス継承で判定：IfcWall はサブクラスも含む）
 TARGET_CLASSES = ["IfcWall", "IfcWallStandardCase", "IfcDoor", "IfcWindow"]
 
-def collect_related_objects(model, product, collected):
-    """再帰的に関連要素・スタイルを収集"""
-    if product in collected:
-        return
-    collected.add(product)
-
-    # スタイル付き項目
-    try:
-        styled_items = ifcopenshell.util.element.get_styled_items(product)
-        for item in styled_items:
-            collected.add(item)
-            if getattr(item, "Styles", None):
-                for s in item.Styles:
-                    collected.add(s)
-    except Exception:
-        pass
-
-    # 子要素（分解構造）
-    try:
-        for sub in ifcopenshell.util.element.get_decomposition(product):
-            collect_related_objects(model, sub, collected)
-    except Exception:
-        pass
-
-
-def export_storey(model, storey, elements, suffix, output_dir):
+# このサイズ以上の IFC は大規模モデルモードで処理する
+LARGE_MODEL_MIN_BYTES = 1024 ** 3
+LARGE_MODEL_BUDGET_GB = 4.0
+
+
+def resolve_bucket(elem, bucket_cache):
+    """クラス階層（is_a 継承）で target / other を判定（クラス名ごとにキャッシュ）"""
+    elem_type = elem.is_a()
+    bucket = bucket_cache.get(elem_type)
+    if bucket is None:
+        bucket = "target" if any(elem.is_a(t) for t in TARGET_CLASSES) else "other"
+        bucket_cache[elem_type] = bucket
+    return bucket
+
+
+def build_index(model):
+    """
+    1パスで 要素ID → (階層ID, バケット) の索引を作成
+    IfcRelContainedInSpatialStructure を一度だけ走査する
+    """
+    index = {}
+    bucket_cache = {}
+    for rel in model.by_type("IfcRelContainedInSpatialStructure"):
+        storey = rel.RelatingStructure
+        if not storey or not storey.is_a("IfcBuildingStorey"):
+            continue
+        for elem in rel.RelatedElements:
+            index[elem.id()] = (storey.id(), resolve_bucket(elem, bucket_cache))
+    return index
+
+
+def build_index_from_step(step):
+    """
+    build_index のオフセット索引版（モデル全体を開かない）
+    継承の判定はスキーマ定義から行う
+    """
+    schema = schema_of(step)
+    index = {}
+    bucket_cache = {}
+    for rel_id in step.ids_of_type("IfcRelContainedInSpatialStructure"):
+        args = step.args(rel_id)
+        for storey_id in refs_in(args[5]):
+            if step.type_of(storey_id) != "IFCBUILDINGSTOREY":
+                continue
+            for elem_id in refs_in(args[4]):
+                elem_type = step.type_of(elem_id)
+                bucket = bucket_cache.get(elem_type)
+                if bucket is None:
+                    is_target = any(is_subtype(schema, elem_type, t) for t in TARGET_CLASSES)
+                    bucket = bucket_cache[elem_type] = "target" if is_target else "other"
+                index[elem_id] = (storey_id, bucket)
+    return index
+
+
+def group_index(index):
+    """索引を 階層ID → {バケット: [要素ID]} にまとめる"""
+    groups = {}
+    for elem_id, (storey_id, bucket) in index.items():
+        buckets = groups.setdefault(storey_id, {"target": [], "other": []})
+        buckets[bucket].append(elem_id)
+    return groups
+
+
+def report(output_path, count, written):
+    """出力の報告（圧縮した場合は減ったバイト数も）"""
+    stored = os.path.getsize(output_path)
+    saved = f", {written / 1024 ** 2:.1f} → {stored / 1024 ** 2:.1f} MB" if written != stored else ""
+    print(f"✅ Exported: {output_path}  (objects: {count}{saved})")
+
+
+def write_model(model, output_path):
+    """モデルを保存し、書き込んだバイト数（圧縮前）を返す（.gz / .ifczip は圧縮）"""
+    if output_path.endswith(".ifc"):
+        model.write(output_path)
+        return os.path.getsize(output_path)
+    data = model.to_string().encode("utf-8")
+    with open_output(output_path) as f:
+        f.write(data)
+    return len(data)
+
+
+def export_storey(model, closures, storey, elements, suffix, output_dir, storey_collected=None, compression=None):
     """指定階層＋要素グループをIFCとして保存"""
     storey_name = storey.Name or f"Storey_{storey.id()}"
     safe_name = "".join(c if c.isalnum() else "_" for c in storey_name)
-    output_path = os.path.join(output_dir, f"{safe_name}_{suffix}.ifc")
+    output_path = os.path.join(output_dir, f"{safe_name}_{suffix}{COMPRESSION_SUFFIXES[compression]}")
 
-    new_model = ifcopenshell.file(schema=model.schema)
-    collected = set()
-    collect_related_objects(model, storey, collected)
+    # 階層自体のクロージャはバケット間で共有する（子要素はバケット側で追加）
+    if storey_collected is None:
+        storey_collected = closures.product_closure(storey, decompose=False)
+    collected = set(storey_collected)
 
     for elem in elements:
-        collect_related_objects(model, elem, collected)
+        collected |= closures.product_closure(elem)
+
+    # キャッシュ済みクロージャの和集合から作成
+    new_model = build_model(model, collected)
+    written = write_model(new_model, output_path)
+    report(output_path, len(collected), written)
+    return len(collected)
+
+
+def export_storey_buckets(model, closures, storey, buckets, output_dir, compression=None):
+    """1階層分の target / other を出力し、オブジェクト数の合計を返す"""
+    storey_collected = closures.product_closure(storey, decompose=False)
+
+    count = 0
+    for suffix in ("target", "other"):
+        if buckets[suffix]:
+            count += export_storey(
+                model, closures, storey, buckets[suffix], suffix, output_dir, storey_collected, compression
+            )
+    return count
 
-    for elem in collected:
-        try:
-            new_model.add(elem)
-        except Exception:
+
+def export_storey_indexed(step, storey_id, storey_name, bucket_ids, output_dir, budget_bytes=None, compression=None):
+    """
+    オフセット索引から 階層＋要素グループ のクロージャに含まれる行だけを読んで保存
+    budget_bytes を超えるとクロージャをディスクに退避する
+    """
+    storey_name = storey_name or f"Storey_{storey_id}"
+    safe_name = "".join(c if c.isalnum() else "_" for c in storey_name)
+
+    count = 0
+    for suffix in ("target", "other"):
+        if not bucket_ids[suffix]:
             continue
+        output_path = os.path.join(output_dir, f"{safe_name}_{suffix}{COMPRESSION_SUFFIXES[compression]}")
+        objects, written = step.extract_storey(
+            storey_id, output_path, element_ids=bucket_ids[suffix], budget=MemoryBudget(budget_bytes)
+        )
+        report(output_path, objects, written)
+        count += objects
+    return count
+
+
+# === 並列実行（--jobs） ===
+# fork 可能な環境では親で読み込んだモデルをコピーオンライトで共有し、
+# それ以外（spawn）では各ワーカーで IFC を開き直す
+_MODEL = None
+_CLOSURES = None
+_STEP = None
+_BUDGET = None
+_COMPRESSION = None
+
+
+def _init_worker(input_ifc, indexed, budget_bytes=None, compression=None):
+    global _MODEL, _CLOSURES, _STEP, _BUDGET, _COMPRESSION
+    _BUDGET = budget_bytes
+    _COMPRESSION = compression
+    if indexed:
+        if _STEP is None:
+            _STEP = StepIndex.open(input_ifc)
+    elif _MODEL is None:
+        _MODEL = ifcopenshell.open(input_ifc)
+        _CLOSURES = ClosureIndex(_MODEL)
+
+
+def _export_job(job):
+    storey_id, storey_name, bucket_ids, output_dir = job
+    t0 = time.perf_counter()
+    if _STEP is not None:
+        count = export_storey_indexed(_STEP, storey_id, storey_name, bucket_ids, output_dir, _BUDGET, _COMPRESSION)
+        return storey_name, count, time.perf_counter() - t0
+
+    storey = _MODEL.by_id(storey_id)
+    buckets = {k: [_MODEL.by_id(i) for i in ids] for k, ids in bucket_ids.items()}
+    count = export_storey_buckets(_MODEL, _CLOSURES, storey, buckets, output_dir, _COMPRESSION)
+    return storey.Name, count, time.perf_counter() - t0
+
 
-    new_model.write(output_path)
-    print(f"✅ Exported: {output_path}  (objects: {len(collected)})")
+def run_exports(model, input_ifc, jobs, n_jobs, step=None, budget_bytes=None, max_tasks_per_child=None,
+                compression=None):
+    """
+    階層ごとのエクスポートを実行し (階層名, オブジェクト数, 秒) を返す
+    step（オフセット索引）を渡すとモデル全体を開かずに抽出する
+    compression（"gzip" / "ifczip"）を指定すると圧縮して保存する
+    """
+    global _MODEL, _CLOSURES, _STEP, _BUDGET, _COMPRESSION
+    _STEP = step
+    _BUDGET = budget_bytes
+    _COMPRESSION = compression
+    if step is None:
+        _MODEL = model
+        _CLOSURES = ClosureIndex(model)
+
+    if n_jobs <= 1:
+        return [_export_job(job) for job in jobs]
+
+    # 共有リソースのクロージャを fork 前に計算しておく
+    if step is None:
+        _CLOSURES.warm()
+
+    method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    ctx = multiprocessing.get_context(method)
+    # max_tasks_per_child を指定するとその数の階層を処理したワーカーを入れ替える（メモリを返す）
+    with ctx.Pool(
+        n_jobs,
+        initializer=_init_worker,
+        initargs=(input_ifc, step is not None, budget_bytes, compression),
+        maxtasksperchild=max_tasks_per_child,
+    ) as pool:
+        return pool.map(_export_job, jobs, chunksize=1)
 
 
 def main():
-    if len(sys.argv) < 3:
-        print("Usage: python3 split_ifc_by_storey_and_type.py <input.ifc> <output_dir>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="IFC を階層・要素タイプごとに分割")
+    parser.add_argument("input_ifc")
+    parser.add_argument("output_dir")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="並列プロセス数")
+    parser.add_argument("--indexed", action="store_true", help="全体を開かずオフセット索引から部分抽出")
+    parser.add_argument("--large-model", action="store_true",
+                        help=f"大規模モデルモード（{LARGE_MODEL_MIN_BYTES // 1024 ** 3} GiB 以上は自動）")
+    parser.add_argument("--memory-budget", type=float, default=None, help="RSS の上限（GiB）。超えたらクロージャをディスクに退避")
+    parser.add_argument("--max-tasks-per-child", type=int, default=None, help="ワーカーを入れ替えるまでの階層数")
+    parser.add_argument("--compress", choices=["gzip", "ifczip"], default=None, help="圧縮して出力（.ifc.gz / .ifczip）")
+    args = parser.parse_args()
 
-    input_ifc = sys.argv[1]
-    output_dir = sys.argv[2]
+    # 大規模モデル：部分抽出・メモリ予算・1階層ごとのワーカー入れ替え
+    if args.large_model or os.path.getsize(args.input_ifc) >= LARGE_MODEL_MIN_BYTES:
+        print("🐘 Large-model mode")
+        args.indexed = True
+        if args.memory_budget is None:
+            args.memory_budget = LARGE_MODEL_BUDGET_GB
+        if args.max_tasks_per_child is None:
+            args.max_tasks_per_child = 1
+    budget_bytes = int(args.memory_budget * 1024 ** 3) if args.memory_budget else None
+
+    input_ifc = args.input_ifc
+    output_dir = args.output_dir
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    print(f"📂 Loading IFC: {input_ifc}")
-    model = ifcopenshell.open(input_ifc)
+    timings = {}
+
+    model = step = None
+    t0 = time.perf_counter()
+    if args.indexed:
+        print(f"📂 Indexing IFC: {input_ifc}")
+        step = StepIndex.open(input_ifc)
+        storeys = [(storey_id, name) for storey_id, _, name in step.storeys()]
+    else:
+        print(f"📂 Loading IFC: {input_ifc}")
+        model = ifcopenshell.open(input_ifc)
+        storeys = [(storey.id(), storey.Name) for storey in model.by_type("IfcBuildingStorey")]
+    timings["load"] = time.perf_counter() - t0
 
-    storeys = model.by_type("IfcBuildingStorey")
     if not storeys:
         print("❌ No IfcBuildingStorey found.")
-        sys.exit(0)
-
-    for storey in storeys:
-        all_elements = []
-        target_elements = []
-        other_elements = []
-
-        # 各階層の要素を取得
-        for rel in getattr(storey, "ContainsElements", []) or []:
-            for elem in rel.RelatedElements:
-                all_elements.append(elem)
-                elem_type = elem.is_a()
-                if any(t in elem_type for t in TARGET_CLASSES):
-                    target_elements.append(elem)
-                else:
-                    other_elements.append(elem)
-
-        print(f"🏢 {storey.Name}: {len(target_elements)} target / {len(other_elements)} others")
-
-        if target_elements:
-            export_storey(model, storey, target_elements, "target", output_dir)
-        if other_elements:
-            export_storey(model, storey, other_elements, "other", output_dir)
+        return
 
-    print("🎉 Export completed for all storeys and element types.")
+    # 要素 → (階層, バケット) の索引を一度だけ作成
+    t0 = time.perf_counter()
+    index = build_index_from_step(step) if step else build_index(model)
+    groups = group_index(index)
+    timings["index"] = time.perf_counter() - t0
+    print(f"🗂 Indexed {len(index)} elements in {len(groups)} storeys.")
+
+    jobs = []
+    for storey_id, storey_name in storeys:
+        bucket_ids = groups.get(storey_id, {"target": [], "other": []})
+        print(f"🏢 {storey_name}: {len(bucket_ids['target'])} target / {len(bucket_ids['other'])} others")
+        if not bucket_ids["target"] and not bucket_ids["other"]:
+            continue
+        jobs.append((storey_id, storey_name, bucket_ids, output_dir))
 
+    t0 = time.perf_counter()
+    results = run_exports(
+        model, input_ifc, jobs, args.jobs, step, budget_bytes, args.max_tasks_per_child, args.compress
+    )
+    timings["export"] = time.perf_counter() - t0
+
+    for name, count, sec in sorted(results, key=lambda r: r[2], reverse=True):
+        print(f"  ⏱ {name}: {count} objects, {sec:.2f}s")
+    print("🎉 Export completed for all storeys and element types.")
+    print("⏱ " + " / ".join(f"{phase}: {sec:.2f}s" for phase, sec in timings.items()) + f" (jobs={args.jobs})")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+# -----------------------------------------------------
+# ベンチマーク用の合成 IFC（IFC4）を生成する
+#
+# 実行方法
+# python3 synthetic_ifc.py out.ifc --storeys 10 --elements 5000
+# python3 synthetic_ifc.py out.ifc --mix wall=4,slab=1,door=2,window=2 --shared 0.5 --skew 0.6
+# -----------------------------------------------------
+
+import argparse
+import math
+import random
+
+# IFC の GlobalId（22文字の base64 変種）に使う文字
+GUID_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_$"
+
+# 要素クラス → (IFC 型名, 要素の末尾属性, タイプ型名, タイプの末尾属性, 色)
+ELEMENT_CLASSES = {
+    "wall": ("IFCWALL", "$,.STANDARD.", "IFCWALLTYPE", "$,$,.STANDARD.", (0.8, 0.8, 0.75)),
+    "slab": ("IFCSLAB", "$,.FLOOR.", "IFCSLABTYPE", "$,$,.FLOOR.", (0.6, 0.6, 0.6)),
+    "column": ("IFCCOLUMN", "$,.COLUMN.", "IFCCOLUMNTYPE", "$,$,.COLUMN.", (0.7, 0.7, 0.7)),
+    "beam": ("IFCBEAM", "$,.BEAM.", "IFCBEAMTYPE", "$,$,.BEAM.", (0.5, 0.5, 0.55)),
+    "door": ("IFCDOOR", "$,2.1,0.9,.DOOR.,.SINGLE_SWING_LEFT.,$", "IFCDOORTYPE",
+             "$,$,.DOOR.,.SINGLE_SWING_LEFT.,.F.,$", (0.55, 0.35, 0.2)),
+    "window": ("IFCWINDOW", "$,1.2,1.0,.WINDOW.,.SINGLE_PANEL.,$", "IFCWINDOWTYPE",
+               "$,$,.WINDOW.,.SINGLE_PANEL.,.F.,$", (0.6, 0.8, 0.9)),
+}
+
+DEFAULT_MIX = {"wall": 4, "slab": 1, "column": 1, "beam": 1, "door": 2, "window": 2}
+
+STOREY_HEIGHT = 3.0
+
+
+def parse_mix(text):
+    """'wall=4,door=2' → {"wall": 4, "door": 2}"""
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip().lower()
+        if name not in ELEMENT_CLASSES:
+            raise ValueError(f"Unknown element class: {name} (choose from {', '.join(ELEMENT_CLASSES)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def guid(n):
+    """連番から決定的な GlobalId を作る"""
+    chars = []
+    for _ in range(22):
+        n, r = divmod(n, 64)
+        chars.append(GUID_CHARS[r])
+    return "".join(reversed(chars))
+
+
+def fmt(value):
+    """STEP の実数（小数点必須）"""
+    text = f"{float(value):.6g}"
+    mantissa, e, exponent = text.partition("e")
+    if "." not in mantissa:
+        mantissa += "."
+    return f"{mantissa}E{exponent}" if e else mantissa
+
+
+class StepWriter:
+    """#ID を振りながら DATA 行を書き出す"""
+
+    def __init__(self, f):
+        self.f = f
+        self.next_id = 1
+        self.count = 0
+
+    def add(self, type_name, *args):
+        entity_id = self.next_id
+        self.next_id += 1
+        self.count += 1
+        self.f.write(f"#{entity_id}={type_name}({','.join(args)});\n")
+        return entity_id
+
+
+def ref(entity_id):
+    return f"#{entity_id}"
+
+
+def refs(ids):
+    return "(" + ",".join(f"#{i}" for i in ids) + ")"
+
+
+def string(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+def prism(w, segments, width, depth, height):
+    """底面が segments 角形の柱（三角形メッシュ）を書き、IfcTriangulatedFaceSet の ID を返す"""
+    points = []
+    for z in (0.0, height):
+        for k in range(segments):
+            a = 2 * math.pi * k / segments
+            points.append((width / 2 * math.cos(a), depth / 2 * math.sin(a), z))
+    coords = w.add("IFCCARTESIANPOINTLIST3D", "(" + ",".join(f"({fmt(x)},{fmt(y)},{fmt(z)})" for x, y, z in points) + ")", "$")
+
+    faces = []
+    n = segments
+    for k in range(n):
+        a, b = k + 1, (k + 1) % n + 1
+        faces += [(a, b, b + n), (a, b + n, a + n)]
+    for k in range(1, n - 1):
+        faces += [(1, k + 2, k + 1), (n + 1, n + k + 1, n + k + 2)]
+    return w.add("IFCTRIANGULATEDFACESET", ref(coords), "$", ".T.", "(" + ",".join(f"({a},{b},{c})" for a, b, c in faces) + ")", "$")
+
+
+def generate(path, storeys=5, elements=1000, mix=None, shared=0.5, segments=8, skew=0.0, seed=0):
+    """
+    合成 IFC を書き出し、エンティティ数を返す
+    storeys: 階数 / elements: 要素数（全階の合計） / mix: クラスごとの比率
+    shared: タイプの共有形状（IfcMappedItem）を使う要素の割合 / segments: 要素あたりの形状の細かさ
+    skew: 1階に集める要素の割合（0 なら均等。低層部に偏ったモデルの再現用）
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    classes = list(mix)
+    weights = [mix[c] for c in classes]
+    gid = iter(range(1, 1 << 62))
+
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write("ISO-10303-21;\nHEADER;\n")
+        f.write("FILE_DESCRIPTION(('ViewDefinition [DesignTransferView]'),'2;1');\n")
+        f.write(f"FILE_NAME({string(str(path))},'2024-01-01T00:00:00',(''),(''),'synthetic_ifc','synthetic_ifc','');\n")
+        f.write("FILE_SCHEMA(('IFC4'));\nENDSEC;\nDATA;\n")
+        w = StepWriter(f)
+
+        # 単位・コンテキスト・プロジェクト
+        unit = w.add("IFCSIUNIT", "*", ".LENGTHUNIT.", "$", ".METRE.")
+        units = w.add("IFCUNITASSIGNMENT", refs([unit]))
+        origin = w.add("IFCCARTESIANPOINT", "(0.,0.,0.)")
+        z_axis = w.add("IFCDIRECTION", "(0.,0.,1.)")
+        x_axis = w.add("IFCDIRECTION", "(1.,0.,0.)")
+        world = w.add("IFCAXIS2PLACEMENT3D", ref(origin), ref(z_axis), ref(x_axis))
+        context = w.add("IFCGEOMETRICREPRESENTATIONCONTEXT", "$", "'Model'", "3", "1.E-05", ref(world), "$")
+        project = w.add("IFCPROJECT", string(guid(next(gid))), "$", "'Synthetic'", "$", "$", "$", "$", refs([context]), ref(units))
+
+        site_placement = w.add("IFCLOCALPLACEMENT", "$", ref(world))
+        site = w.add("IFCSITE", string(guid(next(gid))), "$", "'Site'", "$", "$", ref(site_placement), "$", "$", ".ELEMENT.", "$", "$", "$", "$", "$")
+        building_placement = w.add("IFCLOCALPLACEMENT", ref(site_placement), ref(world))
+        building = w.add("IFCBUILDING", string(guid(next(gid))), "$", "'Building'", "$", "$", ref(building_placement), "$", "$", ".ELEMENT.", "$", "$", "$")
+        w.add("IFCRELAGGREGATES", string(guid(next(gid))), "$", "$", "$", ref(project), refs([site]))
+        w.add("IFCRELAGGREGATES", string(guid(next(gid))), "$", "$", "$", ref(site), refs([building]))
+
+        # クラスごとの材料・スタイル・タイプ（共有形状）
+        kinds = {}
+        for name in classes:
+            _, _, type_name, type_tail, (r, g, b) = ELEMENT_CLASSES[name]
+            colour = w.add("IFCCOLOURRGB", "$", fmt(r), fmt(g), fmt(b))
+            rendering = w.add("IFCSURFACESTYLERENDERING", ref(colour), "0.", "$", "$", "$", "$", "$", "$", ".NOTDEFINED.")
+            style = w.add("IFCSURFACESTYLE", string(name), ".BOTH.", refs([rendering]))
+            material = w.add("IFCMATERIAL", string(name.title()), "$", "$")
+
+            shared_faces = prism(w, segments, 1.0, 0.3, STOREY_HEIGHT * 0.9)
+            w.add("IFCSTYLEDITEM", ref(shared_faces), refs([style]), "$")
+            shared_rep = w.add("IFCSHAPEREPRESENTATION", ref(context), "'Body'", "'Tessellation'", refs([shared_faces]))
+            rep_map = w.add("IFCREPRESENTATIONMAP", ref(world), ref(shared_rep))
+            type_id = w.add(type_name, string(guid(next(gid))), "$", string(f"{name.title()} Type"), "$", "$", "$", refs([rep_map]), type_tail)
+            kinds[name] = {"style": style, "material": material, "rep_map": rep_map, "type": type_id}
+
+        # 階ごとの要素数（skew の分を1階に寄せる）
+        per_storey = [elements * (1 - skew) / storeys] * storeys
+        per_storey[0] += elements * skew
+        per_storey = [int(round(n)) for n in per_storey]
+
+        storey_ids = []
+        for level, count in enumerate(per_storey):
+            elevation = level * STOREY_HEIGHT
+            level_origin = w.add("IFCCARTESIANPOINT", f"(0.,0.,{fmt(elevation)})")
+            level_axes = w.add("IFCAXIS2PLACEMENT3D", ref(level_origin), "$", "$")
+            storey_placement = w.add("IFCLOCALPLACEMENT", ref(building_placement), ref(level_axes))
+            storey = w.add("IFCBUILDINGSTOREY", string(guid(next(gid))), "$", string(f"Level {level + 1}"), "$", "$",
+                           ref(storey_placement), "$", "$", ".ELEMENT.", fmt(elevation))
+            storey_ids.append(storey)
+
+            by_class = {name: [] for name in classes}
+            columns = max(int(math.sqrt(count)), 1)
+            for i in range(count):
+                name = rng.choices(classes, weights)[0]
+                ifc_type, tail, _, _, _ = ELEMENT_CLASSES[name]
+                kind = kinds[name]
+
+                point = w.add("IFCCARTESIANPOINT", f"({fmt((i % columns) * 2.0)},{fmt((i // columns) * 2.0)},0.)")
+                axes = w.add("IFCAXIS2PLACEMENT3D", ref(point), "$", "$")
+                placement = w.add("IFCLOCALPLACEMENT", ref(storey_placement), ref(axes))
+
+                if rng.random() < shared:
+                    operator = w.add("IFCCARTESIANTRANSFORMATIONOPERATOR3D", "$", "$", ref(origin), "1.", "$")
+                    item = w.add("IFCMAPPEDITEM", ref(kind["rep_map"]), ref(operator))
+                    rep = w.add("IFCSHAPEREPRESENTATION", ref(context), "'Body'", "'MappedRepresentation'", refs([item]))
+                else:
+                    faces = prism(w, segments, rng.uniform(0.5, 2.0), rng.uniform(0.1, 0.5), STOREY_HEIGHT * 0.9)
+                    w.add("IFCSTYLEDITEM", ref(faces), refs([kind["style"]]), "$")
+                    rep = w.add("IFCSHAPEREPRESENTATION", ref(context), "'Body'", "'Tessellation'", refs([faces]))
+                shape = w.add("IFCPRODUCTDEFINITIONSHAPE", "$", "$", refs([rep]))
+
+                element = w.add(ifc_type, string(guid(next(gid))), "$", string(f"{name}-{level + 1}-{i}"), "$", "$",
+                                ref(placement), ref(shape), tail)
+                by_class[name].append(element)
+
+            contained = [e for ids in by_class.values() for e in ids]
+            if contained:
+                w.add("IFCRELCONTAINEDINSPATIALSTRUCTURE", string(guid(next(gid))), "$", "$", "$", refs(contained), ref(storey))
+            for name, ids in by_class.items():
+                if not ids:
+                    continue
+                w.add("IFCRELDEFINESBYTYPE", string(guid(next(gid))), "$", "$", "$", refs(ids), ref(kinds[name]["type"]))
+                w.add("IFCRELASSOCIATESMATERIAL", string(guid(next(gid))), "$", "$", "$", refs(ids), ref(kinds[name]["material"]))
+
+        w.add("IFCRELAGGREGATES", string(guid(next(gid))), "$", "$", "$", ref(building), refs(storey_ids))
+        f.write("ENDSEC;\nEND-ISO-10303-21;\n")
+    return w.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成 IFC を生成")
+    parser.add_argument("output_ifc")
+    parser.add_argument("--storeys", type=int, default=5)
+    parser.add_argument("--elements", type=int, default=1000, help="全階の要素数の合計")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="クラスの比率（例: wall=4,door=2）")
+    parser.add_argument("--shared", type=float, default=0.5, help="共有形状を使う要素の割合")
+    parser.add_argument("--segments", type=int, default=8, help="要素形状の細かさ（底面の角数）")
+    parser.add_argument("--skew", type=float, default=0.0, help="1階に集める要素の割合")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    count = generate(args.output_ifc, args.storeys, args.elements, args.mix, args.shared, args.segments, args.skew, args.seed)
+    print(f"✅ Generated: {args.output_ifc}  (entities: {count})")
+
+
+if __name__ == "__main__":
+    main()